@@ -1,4 +1,5 @@
 import sys
+import time
 import pandas as pd
 import numpy as np
 from pathlib import Path
@@ -8,11 +9,16 @@ import streamlit as st
 import plotly
 
 # Our functions
-from get_applicants_inventors_details import get_applicants_inventors_data
+from get_applicants_inventors_details import (
+    estimate_applicants_inventors_run,
+    finish_analysis_run,
+    get_applicants_inventors_results,
+)
 from connect_database import create_sqlalchemy_session
 from config import Config  
 from prompts import PROMPTS
 from llm_analyse import analyze_dataframe
+from extract_cache import invalidate_cache
 from ploting_applicants_inventors_details import plot_appl_inv_ratios_interactive
 
 # Setup logging
@@ -30,6 +36,53 @@ def setup_logging():
 
 logger = setup_logging()
 
+# Outputs saved to CSV and displayed: CSV name -> pipeline output name
+OUTPUT_NAMES = {
+    "unique_family_ids": "df_unique_family_ids",
+    "appl_invt": "df_appl_invt",
+    "appl_invt_agg": "df_appl_invt_agg",
+    "applicant_ratios": "df_applicant_ratios",
+    "inventor_ratios": "df_inventor_ratios",
+    "combined_ratios": "df_combined_ratios",
+    "applicant_counts": "df_applicant_counts",
+    "inventor_counts": "df_inventor_counts",
+    "combined_counts": "df_combined_counts",
+    "inv_indiv_counts": "df_invt_indiv_counts",
+    "inv_non_indiv_counts": "df_invt_non_indiv_counts",
+    "app_non_indiv_counts": "df_appl_non_indiv_counts",
+    "app_indiv_counts": "df_appl_indiv_counts",
+    "indiv_applicant_ratio": "df_indiv_applicant_ratio",
+    "num_families_with_indiv": "num_families_with_indiv",
+    "ratio_only_indiv": "ratio_only_indiv",
+    "female_inventor_ratio": "df_female_inventor_ratio",
+}
+
+# Count outputs analysed together by the LLM
+ANALYSED_COUNTS = ["applicant_counts", "inventor_counts", "combined_counts"]
+
+# Outputs drawn by the plot_indiv_non_indiv stage
+INDIV_NON_INDIV_OUTPUTS = {
+    "inv_indiv_counts",
+    "inv_non_indiv_counts",
+    "app_non_indiv_counts",
+    "app_indiv_counts",
+}
+
+# Displayed sections: plot/analysis file prefix -> (title, CSV name of the output)
+DATAFRAME_VIEWS = {
+    "applicant_ratio": ("Applicant Ratios", "applicant_ratios"),
+    "inventor_ratio": ("Inventor Ratios", "inventor_ratios"),
+    "combined_ratio": ("Combined Ratios", "combined_ratios"),
+    "applicant_counts": ("Applicant Counts", "applicant_counts"),
+    "inventor_counts": ("Inventor Counts", "inventor_counts"),
+    "inv_indiv_counts": ("Inventor Individual Counts", "inv_indiv_counts"),
+    "inv_non_indiv_counts": ("Inventor Non-Individual Counts", "inv_non_indiv_counts"),
+    "app_indiv_counts": ("Applicant Individual Counts", "app_indiv_counts"),
+    "app_non_indiv_counts": ("Applicant Non-Individual Counts", "app_non_indiv_counts"),
+    "indiv_applicant_ratio": ("Individual Applicant Ratio", "indiv_applicant_ratio"),
+    "female_inventor_ratio": ("Female Inventor Ratio", "female_inventor_ratio"),
+}
+
 # Function to create output directory
 def create_data_folder(country_code, start_year, end_year, working_dir):
     """
@@ -41,6 +94,42 @@ def create_data_folder(country_code, start_year, end_year, working_dir):
     logger.info(f"Created output directory: {output_dir}")
     return output_dir
 
+def show_estimate(estimate):
+    """Display a run estimate (see run_estimator.predict_run)."""
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Families", f"{estimate['families']:,}")
+    col2.metric("Rows", f"{estimate['rows']:,}")
+    col3.metric("Memory", f"{estimate['memory_mb']:,.0f} MB")
+    col4.metric("Time", f"{estimate['seconds'] / 60:,.1f} min")
+    if estimate["based_on_runs"] == 0:
+        st.caption("No previous runs recorded yet, the time estimate uses default throughput.")
+
+
+def estimated_run_options(estimate):
+    """
+    Warn about long or large runs and return the suggested mode as per-run options
+    of get_applicants_inventors_data (Config is shared by every session, so it is
+    left untouched): long runs keep their extract cached, short ones skip the
+    Parquet cache and query the database directly.
+    """
+    run_options = {"spill_extract": estimate["mode"] == "spill"}
+    if estimate["mode"] == "spill":
+        st.warning(
+            f"Estimated {estimate['memory_mb']:,.0f} MB exceeds the memory budget "
+            f"({Config.memory_budget_mb} MB): processing out of core, chunk by chunk."
+        )
+    elif estimate["mode"] == "cache":
+        run_options["use_extract_cache"] = True
+        st.warning(
+            f"Estimated run time is {estimate['seconds'] / 60:,.0f} minutes; "
+            "the extract will be cached so later runs are fast."
+        )
+    else:
+        run_options["use_extract_cache"] = False
+        st.caption("Short run: extracting directly, without the extract cache.")
+    return run_options
+
+
 def main():
     st.title("Patent Data Analysis")
 
@@ -48,11 +137,55 @@ def main():
     country_code = st.text_input("Country Code", value="NO")
     start_year = st.number_input("Start Year", min_value=1900, max_value=2100, value=2020)
     end_year = st.number_input("End Year", min_value=1900, max_value=2100, value=2020)
+    preview_size = st.number_input(
+        "Preview Sample (families, 0 = full run)",
+        min_value=0,
+        value=Config.preview_sample_size,
+        step=100,
+    )
+    # Only the selected outputs (and the stages they depend on) are computed
+    selected_outputs = st.multiselect(
+        "Outputs",
+        options=list(OUTPUT_NAMES),
+        default=list(OUTPUT_NAMES),
+    )
 
     # Define working directory
     working_dir = Path("C:/Users/iao/Desktop/Patstat_TIP/Patent_family/applicants_inventors_analyse/")
     
 
+    # Button to drop the cached extract of the selected country and years, and
+    # the per-year partitions (Config.partition_by_year) it may be served from
+    if st.button("Clear Cached Extract"):
+        removed = invalidate_cache(
+            kind="extract",
+            country_code=country_code,
+            start_year=int(start_year),
+            end_year=int(end_year),
+        )
+        for filing_year in range(int(start_year), int(end_year) + 1):
+            removed += invalidate_cache(
+                kind="partition",
+                country_code=country_code,
+                filing_year=filing_year,
+            )
+        st.info(f"Removed {removed} cached extract(s).")
+
+    # Button to estimate the size and duration of a run without extracting it
+    if st.button("Estimate Run"):
+        with st.spinner("Counting families and rows..."):
+            try:
+                show_estimate(
+                    estimate_applicants_inventors_run(
+                        country_code,
+                        int(start_year),
+                        int(end_year),
+                        preview_sample_size=int(preview_size),
+                    )
+                )
+            except Exception as e:
+                st.error(f"Could not estimate the run: {e}")
+
     # Button to process data
     if st.button("Process Data"):
         with st.spinner("Processing patent data..."):
@@ -75,57 +208,53 @@ def main():
                     end_year=end_year,
                 )
 
-                # Process data
-                dfs = get_applicants_inventors_data(
-                    Config.country_code, Config.start_year, Config.end_year
+                # Estimate the run first and switch to chunked or cached mode if needed
+                run_options = {"preview_sample_size": int(preview_size)}
+                if Config.estimate_before_run:
+                    try:
+                        estimate = estimate_applicants_inventors_run(
+                            country_code,
+                            int(start_year),
+                            int(end_year),
+                            preview_sample_size=int(preview_size),
+                        )
+                        show_estimate(estimate)
+                        run_options.update(estimated_run_options(estimate))
+                    except Exception as e:
+                        logger.warning(f"Run estimate failed: {e}")
+
+                # Extract; analysis stages only run for the outputs read below
+                results = get_applicants_inventors_results(
+                    Config.country_code,
+                    Config.start_year,
+                    Config.end_year,
+                    **run_options,
                 )
+                if results is None:
+                    st.warning("No families found for the given country and years.")
+                    return
 
-                # Unpack the tuple
-                (
-                    df_unique_family_ids,
-                    df_appl_invt,
-                    df_appl_invt_agg,
-                    df_applicant_ratios,
-                    df_inventor_ratios,
-                    df_combined_ratios,
-                    df_applicant_counts,
-                    df_inventor_counts,
-                    df_combined_counts,
-                    df_inv_indiv_counts,
-                    df_inv_non_indiv_counts,
-                    df_app_non_indiv_counts,
-                    df_app_indiv_counts,
-                    df_indiv_applicant_ratio,
-                    num_families_with_indiv,
-                    ratio_only_indiv,
-                    df_female_inventor_ratio,
-                ) = dfs
-
-                # Define DataFrame names
-                df_names = [
-                    "unique_family_ids",
-                    "appl_invt",
-                    "appl_invt_agg",
-                    "applicant_ratios",
-                    "inventor_ratios",
-                    "combined_ratios",
-                    "applicant_counts",
-                    "inventor_counts",
-                    "combined_counts",
-                    "inv_indiv_counts",
-                    "inv_non_indiv_counts",
-                    "app_non_indiv_counts",
-                    "app_indiv_counts",
-                    "indiv_applicant_ratio",
-                    "num_families_with_indiv",
-                    "ratio_only_indiv",
-                    "female_inventor_ratio",
-                ]
+                # Compute the selected outputs together (independent stages run
+                # concurrently), plus the individual/non-individual plot they show
+                output_names = {
+                    name: OUTPUT_NAMES[name] for name in OUTPUT_NAMES if name in selected_outputs
+                }
+                plots = (
+                    ["plot_indiv_non_indiv"]
+                    if INDIV_NON_INDIV_OUTPUTS.intersection(output_names)
+                    else []
+                )
+                start_time = time.perf_counter()
+                values = results.compute(*output_names.values(), *plots)
+                outputs = dict(zip(output_names, values))
+                df_preview_estimates = finish_analysis_run(
+                    results, output_names.values(), time.perf_counter() - start_time
+                )
 
                 # Save DataFrames to CSV
                 csv_output_dir = output_dir / "data" / "applicants_inventors"
                 csv_output_dir.mkdir(parents=True, exist_ok=True)
-                for i, (df_item, name) in enumerate(zip(dfs, df_names)):
+                for name, df_item in outputs.items():
                     filepath = csv_output_dir / f"{name}.csv"
                     if isinstance(df_item, pd.DataFrame):
                         df_item.to_csv(filepath, index=False)
@@ -135,53 +264,51 @@ def main():
                         value_df.to_csv(filepath, index=False)
                         logger.info(f"Saved value '{name}' to {filepath}")
 
-                # Create a list of dataframes
-                dataframes_list = [df_applicant_counts, df_inventor_counts, df_combined_counts]
-                dataframe_names = ["applicant_counts", "inventor_counts", "combined_counts"]
-                
-                prompt_name = "applicants_inventors_count"
-                # Get analysis for all dataframes together
-                analysis_result = analyze_dataframe(
-                dataframes_list,
-                dataframe_names,
-                prompt_name,
-                Config.country_code
-                )
+                # Preview runs: approximate population ratios with confidence intervals
+                if df_preview_estimates is not None:
+                    st.subheader("Preview Estimates (95% confidence intervals)")
+                    st.dataframe(df_preview_estimates)
+
+                # Create a list of the selected count dataframes
+                dataframe_names = [name for name in ANALYSED_COUNTS if name in outputs]
+                dataframes_list = [outputs[name] for name in dataframe_names]
 
-                # Save individual analyses
                 txt_output_dir = output_dir / "analyse" / "applicants_inventors"
                 txt_output_dir.mkdir(parents=True, exist_ok=True)
 
-                for individual in analysis_result["individual_responses"]:
-                    df_name = individual["df_name"]
-                    response = individual["response"]
-                    filepath = txt_output_dir / f"{df_name}_analysis.txt"
-                    with open(filepath, "w", encoding="utf-8") as f:
-                        f.write(response)
-                    logger.info(f"Saved analysis for '{df_name}' to {filepath}")
+                if dataframes_list:
+                    prompt_name = "applicants_inventors_count"
+                    # Get analysis for all dataframes together
+                    analysis_result = analyze_dataframe(
+                    dataframes_list,
+                    dataframe_names,
+                    prompt_name,
+                    Config.country_code
+                    )
+
+                    # Save individual analyses
+                    for individual in analysis_result["individual_responses"]:
+                        df_name = individual["df_name"]
+                        response = individual["response"]
+                        filepath = txt_output_dir / f"{df_name}_analysis.txt"
+                        with open(filepath, "w", encoding="utf-8") as f:
+                            f.write(response)
+                        logger.info(f"Saved analysis for '{df_name}' to {filepath}")
 
-                # Save summary
-                summary_filepath = txt_output_dir / "appl_inv_summary_analysis.txt"
-                with open(summary_filepath, "w", encoding="utf-8") as f:
-                    f.write(analysis_result["summary"])
-                logger.info(f"Saved summary to {summary_filepath}")
+                    # Save summary
+                    summary_filepath = txt_output_dir / "appl_inv_summary_analysis.txt"
+                    with open(summary_filepath, "w", encoding="utf-8") as f:
+                        f.write(analysis_result["summary"])
+                    logger.info(f"Saved summary to {summary_filepath}")
 
                 # Define the directory where plots are saved 
                 plots_dir = Path(Config.output_dir) / "plots" / "applicants_inventors"
 
-                # Updated DataFrames dictionary with singular names to match file prefixes
+                # Selected DataFrames, keyed by singular names to match file prefixes
                 dataframes = {
-                    "applicant_ratio": ("Applicant Ratios", df_applicant_ratios),
-                    "inventor_ratio": ("Inventor Ratios", df_inventor_ratios),
-                    "combined_ratio": ("Combined Ratios", df_combined_ratios),
-                    "applicant_counts": ("Applicant Counts", df_applicant_counts),
-                    "inventor_counts": ("Inventor Counts", df_inventor_counts),
-                    "inv_indiv_counts": ("Inventor Individual Counts", df_inv_indiv_counts),
-                    "inv_non_indiv_counts": ("Inventor Non-Individual Counts", df_inv_non_indiv_counts),
-                    "app_indiv_counts": ("Applicant Individual Counts", df_app_indiv_counts),
-                    "app_non_indiv_counts": ("Applicant Non-Individual Counts", df_app_non_indiv_counts),
-                    "indiv_applicant_ratio": ("Individual Applicant Ratio", df_indiv_applicant_ratio),
-                    "female_inventor_ratio": ("Female Inventor Ratio", df_female_inventor_ratio),
+                    df_name: (display_name, outputs[output])
+                    for df_name, (display_name, output) in DATAFRAME_VIEWS.items()
+                    if output in outputs
                 }
 
                 # Function to display a section for a DataFrame
@@ -241,8 +368,15 @@ def main():
 
                 # Display scalar metrics (outside the expanders)
                 st.subheader("Overview")
-                st.metric("Number of Families with Individuals", num_families_with_indiv)
-                st.metric("Ratio of Families with Only Individuals", f"{ratio_only_indiv:.2f}")
+                if "num_families_with_indiv" in outputs:
+                    st.metric(
+                        "Number of Families with Individuals", outputs["num_families_with_indiv"]
+                    )
+                if "ratio_only_indiv" in outputs:
+                    st.metric(
+                        "Ratio of Families with Only Individuals",
+                        f"{outputs['ratio_only_indiv']:.2f}",
+                    )
 
                 # Display each DataFrame section
                 for df_name, (display_name, df) in dataframes.items():
@@ -6,6 +6,55 @@ class Config:
     start_year = 2020
     end_year = 2020
     batch_size = 200  # Example static setting
+    extraction_workers = 1  # Batches fetched concurrently, each on its own pooled connection
+    extraction_mode = "batch"  # "batch" (IN-list per batch_size) or "temp_table" (one join)
+    checkpoint_extraction = False  # Checkpoint every batch so a failed extraction resumes where it stopped
+    checkpoint_min_batches = 50  # Extractions of at least this many batches are checkpointed anyway
+    checkpoint_dir = "checkpoints"  # Folder of the batch checkpoints and run manifests
+    fetch_chunk_size = 50000  # Rows per streamed/fetchmany chunk
+    columnar_fetch = True  # Fetch through the raw cursor into typed column buffers
+    db_backend = "mssql"  # "mssql" (PATSTAT SQL Server) or "sqlite" (offline stand-in)
+    sqlite_path = "patstat_offline.db"  # Offline database file for db_backend = "sqlite"
+    db_echo = False  # Log every SQL statement emitted by SQLAlchemy
+    db_pool_size = 5  # Connections kept open in the engine pool
+    db_max_overflow = 10  # Extra connections allowed beyond db_pool_size
+    db_pool_pre_ping = True  # Test connections before handing them out
+    db_pool_recycle = 1800  # Seconds before a pooled connection is recycled
+    counts_engine = "pandas"  # "pandas" or "sql" (aggregate applicant/inventor counts in the database)
+    pipeline_workers = 4  # Analysis stages run concurrently, see pipeline.py
+    compute_shards = 1  # >1 splits per-family stages into docdb_family_id hash shards, see family_shards.py
+    shard_workers = 0  # Worker processes for the shards, 0 = one per CPU (at most compute_shards)
+    entity_cache_size = 1_000_000  # (person_name, psn_sector) pairs kept by classify_entities
+    spill_extract = False  # Stream extraction batches to Parquet and run per-family stages chunk by chunk
+    spill_dir = "spill"  # Folder of the spilled extracts (spill_extract), evicted with the extract cache
+    memory_budget_mb = 2048  # Approximate memory per chunk of a spilled extract
+    preview_sample_size = 0  # >0 runs a preview on a stratified sample of this many families, see preview_sampling.py
+    preview_seed = 42  # Random seed of the preview sample (same seed and population, same sample)
+    use_extract_cache = True  # Reuse Parquet extracts of identical runs
+    partition_by_year = False  # Cache extracts per (country, filing year), query missing years only
+    use_stage_cache = True  # Reuse analysis stage outputs computed from identical inputs
+    cache_dir = "cache"  # Folder of the on-disk Parquet cache
+    cache_max_bytes = 2 * 1024**3  # LRU eviction above this total size
+    query_version = "1"  # Bump when the extraction queries change
+    patstat_edition = "2024_autumn"  # PATSTAT edition loaded in the database
+    throughput_history_path = "cache/throughput_history.json"  # Per-stage throughput of past runs, see run_estimator.py
+    throughput_history_size = 20  # Recent runs kept per stage
+    estimate_before_run = True  # Estimate size and time before processing (Streamlit app)
+    estimate_warn_seconds = 600  # Warn and keep the extract cached above this predicted wall time
+    gender_mode = "api"  # "api" (Genderize.io + persistent cache) or "offline" (local name table)
+    gender_table_dir = "gender_table"  # Folder of the offline name table, see gender_table.py
+    use_orig_first_names = True  # Prefer TLS226_PERSON_ORIG.first_name over parsing person_name
+    gender_cache_path = "cache/gender_cache.db"  # Persistent first-name gender cache (SQLite)
+    gender_cache_ttl_days = 180  # Re-resolve cached first names older than this
+    gender_cache_max_entries = 500_000  # LRU eviction above this many (name, country) entries
+    gender_threshold = 0.8  # Minimum probability for a gender to count as known
+    genderize_url = "https://api.genderize.io"  # Genderize endpoint (point at a stub server for tests)
+    genderize_batch_size = 10  # Names per request (Genderize accepts up to 10)
+    genderize_workers = 4  # Concurrent requests over the keep-alive session
+    genderize_rate_limit = 5.0  # Max requests per second, 0 disables the limit
+    genderize_timeout = 10  # Seconds before a request is abandoned
+    genderize_max_retries = 3  # Retries per request on timeouts, 429 and 5xx
+    genderize_backoff = 1.0  # Initial retry delay in seconds, doubled per attempt
     ollama_base_url = "http://localhost:11434"  # Ollama base URL
     model_name = "llama3.2:latest"  # Model name for Ollama
     openai_model_name = "gpt-4o"  # Model name for OpenAI
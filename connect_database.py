@@ -1,10 +1,20 @@
 import os
+import threading
 import urllib.parse
-import pyodbc
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
+from config import Config
+
+try:
+    import pyodbc
+except ImportError:  # Only needed for the SQL Server backend
+    pyodbc = None
+
 load_dotenv()
 
 # Get variables from environment
@@ -13,51 +23,258 @@ database = os.getenv('db_database')
 username = os.getenv('db_username')
 password = os.getenv('db_password')
 
+# Process-wide engine registry, keyed by connection URL
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def _odbc_connection_string():
+    """Build the ODBC connection string from the environment variables"""
+    return (
+        'DRIVER={ODBC Driver 17 for SQL Server};'
+        f'SERVER={server};'
+        f'DATABASE={database};'
+        f'UID={username};'
+        f'PWD={password}'
+    )
+
+
 def connect_database():
     """Create a direct PyODBC connection"""
+    if pyodbc is None:
+        print("Error connecting to database: pyodbc is not available")
+        return None
     try:
-        conn_str = (
-            'DRIVER={ODBC Driver 17 for SQL Server};'
-            f'SERVER={server};'
-            f'DATABASE={database};'
-            f'UID={username};'
-            f'PWD={password}'
-        )
-        conn = pyodbc.connect(conn_str)
+        conn = pyodbc.connect(_odbc_connection_string())
         print("Database connection....OK...")
         return conn
     except pyodbc.Error as err:
         print(f"Error connecting to database: {err}")
         return None
 
-def create_sqlalchemy_session():
-    """Create SQLAlchemy session with proper connection string"""
-    try:
-        # First create the connection string
-        conn_str = (
-            'DRIVER={ODBC Driver 17 for SQL Server};'
-            f'SERVER={server};'
-            f'DATABASE={database};'
-            f'UID={username};'
-            f'PWD={password}'
-        )
-        
+
+def _connection_url():
+    """Build the SQLAlchemy URL of the configured backend (Config.db_backend)."""
+    if Config.db_backend == "mssql":
         # URL encode the connection string
-        encoded_conn_str = urllib.parse.quote_plus(conn_str)
-        
+        encoded_conn_str = urllib.parse.quote_plus(_odbc_connection_string())
+
         # Create the full SQLAlchemy URL
-        connection_url = f"mssql+pyodbc:///?odbc_connect={encoded_conn_str}"
-        
-        # Create the engine and session
-        engine = create_engine(connection_url, echo=True)
-        Session = sessionmaker(bind=engine)
-        session = Session()
-        
-        return session
-        
+        return f"mssql+pyodbc:///?odbc_connect={encoded_conn_str}"
+    if Config.db_backend == "sqlite":
+        # Offline PATSTAT stand-in, see offline_backend.py
+        return f"sqlite:///{Config.sqlite_path}"
+    raise ValueError(
+        f"Unknown database backend: {Config.db_backend} (expected 'mssql' or 'sqlite')."
+    )
+
+
+def backend_identity() -> str:
+    """
+    Identify the database the extracts come from, for cache and checkpoint keys:
+    the SQL Server host and database, or the path of the offline SQLite file.
+    Credentials are left out, the keys are stored in plain manifests.
+    """
+    if Config.db_backend == "sqlite":
+        return f"sqlite:///{os.path.abspath(Config.sqlite_path)}"
+    return f"{Config.db_backend}://{server}/{database}"
+
+
+def _get_registered_engine():
+    """Return the (engine, sessionmaker) pair for the current connection URL."""
+    connection_url = _connection_url()
+
+    with _engines_lock:
+        if connection_url not in _engines:
+            if Config.db_backend == "mssql":
+                # fast_executemany speeds up bulk inserts (e.g. family ID temp tables)
+                backend_options = {"fast_executemany": True}
+            else:
+                # Pooled SQLite connections are handed to worker threads
+                backend_options = {"connect_args": {"check_same_thread": False}}
+            engine = create_engine(
+                connection_url,
+                echo=Config.db_echo,
+                pool_size=Config.db_pool_size,
+                max_overflow=Config.db_max_overflow,
+                pool_pre_ping=Config.db_pool_pre_ping,
+                pool_recycle=Config.db_pool_recycle,
+                **backend_options,
+            )
+            _engines[connection_url] = (engine, sessionmaker(bind=engine))
+        return _engines[connection_url]
+
+
+def get_engine():
+    """
+    Return the process-wide SQLAlchemy engine, creating it on first use.
+
+    The engine keeps a connection pool sized by Config.db_pool_size and
+    Config.db_max_overflow, so repeated sessions reuse open ODBC connections
+    instead of paying a new handshake on every call.
+    """
+    engine, _ = _get_registered_engine()
+    return engine
+
+
+def dispose_engines():
+    """Close all pooled connections and clear the engine registry."""
+    with _engines_lock:
+        for engine, _ in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+
+def create_sqlalchemy_session():
+    """Create SQLAlchemy session bound to the pooled engine"""
+    try:
+        _, Session = _get_registered_engine()
+        return Session()
+
     except Exception as e:
         print(f"Error creating SQLAlchemy session: {e}")
         return None
 
 
- 
\ No newline at end of file
+@contextmanager
+def session_scope():
+    """
+    Provide one SQLAlchemy session for the duration of a pipeline run.
+
+    The session is rolled back on error and always closed on exit, which
+    returns its connection to the pool.
+    """
+    session = create_sqlalchemy_session()
+    if session is None:
+        raise ConnectionError("Could not create a SQLAlchemy session.")
+    try:
+        yield session
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def _nullable_dtype(dtype) -> pd.api.extensions.ExtensionDtype:
+    """Pandas nullable counterpart of a NumPy integer dtype (int16 -> Int16)."""
+    name = np.dtype(dtype).name
+    return pd.api.types.pandas_dtype(name[0].upper() + name[1:])
+
+
+def _to_datetime64(value, dtype) -> np.datetime64:
+    try:
+        return np.datetime64(value).astype(dtype)
+    except (TypeError, ValueError):
+        return np.datetime64("NaT")
+
+
+def _column_array(values: tuple, dtype):
+    """
+    Convert one fetched column chunk into an array of the requested dtype.
+
+    Dates become datetime64[s], which also holds PATSTAT's 9999-12-31 placeholder
+    of unpublished applications (outside the datetime64[ns] range); unparsable
+    values become NaT. Integer columns with NULLs become the nullable integer
+    dtype of the same width instead of float, see fetch_columnar.
+    """
+    if dtype is None or np.dtype(dtype) == np.dtype(object):
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+    if np.dtype(dtype).kind == "M":
+        try:
+            return np.array(values, dtype=dtype)
+        except (TypeError, ValueError):
+            # Convert value by value, unparsable ones as NaT
+            return np.array([_to_datetime64(value, dtype) for value in values], dtype=dtype)
+    try:
+        return np.fromiter(values, dtype=dtype, count=len(values))
+    except (TypeError, ValueError):
+        # NULLs (or numeric strings): same width, missing values as <NA>
+        return pd.array(
+            pd.to_numeric(pd.Series(values, dtype=object)), dtype=_nullable_dtype(dtype)
+        )
+
+
+def _typed_frame(columns: list, row_chunks, dtypes: dict) -> pd.DataFrame:
+    """Transpose chunks of row tuples into typed per-column buffers, see fetch_columnar."""
+    buffers = {column: [] for column in columns}
+    for rows in row_chunks:
+        for column, values in zip(columns, zip(*rows)):
+            buffers[column].append(_column_array(values, dtypes.get(column)))
+
+    data = {}
+    for column in columns:
+        dtype = dtypes.get(column, object)
+        chunks = buffers[column]
+        if any(isinstance(chunk, pd.api.extensions.ExtensionArray) for chunk in chunks):
+            # One dtype per column: every chunk nullable once any chunk has NULLs
+            data[column] = pd.array(
+                np.concatenate([np.asarray(chunk, dtype=object) for chunk in chunks]),
+                dtype=_nullable_dtype(dtype),
+            )
+        elif chunks:
+            data[column] = np.concatenate(chunks)
+        else:
+            data[column] = np.empty(0, dtype=dtype)
+    return pd.DataFrame(data, columns=columns)
+
+
+def frame_from_rows(rows: list, columns: list, dtypes: dict) -> pd.DataFrame:
+    """
+    Build a DataFrame from already fetched rows (e.g. SQLAlchemy Row objects) with
+    the same column dtypes fetch_columnar gives.
+
+    Args:
+        rows (list): Row tuples.
+        columns (list): Column names, in row order.
+        dtypes (dict): Column name -> NumPy dtype; unlisted columns stay object.
+
+    Returns:
+        pd.DataFrame: The rows with the requested column dtypes.
+    """
+    return _typed_frame(columns, [rows] if rows else [], dtypes)
+
+
+def frame_from_row_chunks(row_chunks, columns: list, dtypes: dict) -> pd.DataFrame:
+    """
+    frame_from_rows for rows streamed in chunks (e.g. Result.partitions()); each
+    chunk is converted as it arrives, with one dtype per column across all chunks.
+    """
+    return _typed_frame(columns, row_chunks, dtypes)
+
+
+def fetch_columnar(db, statement, dtypes: dict, chunk_size: int = None) -> pd.DataFrame:
+    """
+    Execute a statement and build a DataFrame directly from the DBAPI cursor.
+
+    Rows are pulled with cursor.fetchmany(chunk_size) and transposed straight
+    into typed per-column NumPy buffers, so no SQLAlchemy Row objects are
+    created and only one chunk of raw rows is held at a time.
+
+    Args:
+        db: SQLAlchemy session to execute on.
+        statement: SQLAlchemy selectable to execute.
+        dtypes (dict): Column name -> NumPy dtype; unlisted columns stay object.
+        chunk_size (int, optional): Rows per fetchmany call; defaults to Config.fetch_chunk_size.
+
+    Returns:
+        pd.DataFrame: Result set with the requested column dtypes.
+    """
+    chunk_size = chunk_size or Config.fetch_chunk_size
+    result = db.connection().execute(statement)
+    cursor = result.cursor
+
+    def row_chunks():
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+
+    try:
+        columns = [description[0] for description in cursor.description]
+        return _typed_frame(columns, row_chunks(), dtypes)
+    finally:
+        result.close()
@@ -0,0 +1,321 @@
+# On-disk Parquet cache for extracted PATSTAT DataFrames (and pipeline stage outputs,
+# see pipeline.py).
+# Each entry is a folder named by a hash of its key, holding one Parquet file per
+# DataFrame plus a manifest.json. The manifest mtime is refreshed on every hit and
+# used as the last access time for LRU eviction.
+# Files written elsewhere (spilled extracts, see spill_store.py) are registered as
+# entries whose manifest lists them, so eviction and invalidation remove them too.
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+import config
+from connect_database import backend_identity
+
+# Initialize Logger
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+# Serializes writes and evictions between threads (e.g. concurrent pipeline stages)
+_cache_lock = threading.RLock()
+
+
+def extract_key_parts(
+    country_code: str, start_year: int, end_year: int, sample: Optional[dict] = None
+) -> dict:
+    """
+    Build the key identifying one extraction run.
+
+    Args:
+        country_code (str): 2-letter country code.
+        start_year (int): First filing year.
+        end_year (int): Last filing year.
+        sample (dict, optional): Spec of a preview sample (size and seed), None for
+            a full extraction.
+
+    Returns:
+        dict: Key parts, including the database (see connect_database.backend_identity),
+        query version and PATSTAT edition from config.
+    """
+    return {
+        "kind": "extract",
+        "country_code": country_code,
+        "start_year": int(start_year),
+        "end_year": int(end_year),
+        "sample": sample,
+        "database": backend_identity(),
+        "query_version": config.Config.query_version,
+        "patstat_edition": config.Config.patstat_edition,
+    }
+
+
+def partition_key_parts(country_code: str, filing_year: int) -> dict:
+    """
+    Build the key of one (country, filing year) extraction partition.
+
+    Args:
+        country_code (str): 2-letter country code.
+        filing_year (int): Filing year of the partition.
+
+    Returns:
+        dict: Key parts, including the database (see connect_database.backend_identity),
+        query version and PATSTAT edition from config.
+    """
+    return {
+        "kind": "partition",
+        "country_code": country_code,
+        "filing_year": int(filing_year),
+        "database": backend_identity(),
+        "query_version": config.Config.query_version,
+        "patstat_edition": config.Config.patstat_edition,
+    }
+
+
+def make_cache_key(key_parts: dict) -> str:
+    """Hash the key parts into a stable folder name."""
+    payload = json.dumps(key_parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def _cache_dir() -> Path:
+    return Path(config.Config.cache_dir)
+
+
+def _iter_entries():
+    """Yield (entry_dir, manifest) for every complete cache entry."""
+    cache_dir = _cache_dir()
+    if not cache_dir.exists():
+        return
+    for entry_dir in cache_dir.iterdir():
+        if entry_dir.name.startswith("."):
+            continue  # Entry still being written
+        manifest_path = entry_dir / MANIFEST_NAME
+        if not manifest_path.is_file():
+            continue
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                yield entry_dir, json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Skipping unreadable cache entry {entry_dir}: {e}")
+
+
+def _remove_entry(entry_dir: Path, manifest: dict) -> None:
+    """Delete a cache entry and the registered files it lists."""
+    for path in manifest.get("files", {}).values():
+        Path(path).unlink(missing_ok=True)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+
+
+def load_frames(key_parts: dict) -> Optional[dict]:
+    """
+    Load the DataFrames stored under key_parts.
+
+    Args:
+        key_parts (dict): Key as built by extract_key_parts or partition_key_parts.
+
+    Returns:
+        Optional[dict]: Mapping of frame name to DataFrame, or None on a cache miss.
+    """
+    entry_dir = _cache_dir() / make_cache_key(key_parts)
+    manifest_path = entry_dir / MANIFEST_NAME
+    if not manifest_path.is_file():
+        return None
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        frames = {
+            name: pd.read_parquet(entry_dir / f"{name}.parquet")
+            for name in manifest["frames"]
+        }
+    except Exception as e:
+        logger.warning(f"Discarding corrupt cache entry {entry_dir}: {e}")
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        return None
+
+    # Refresh last access time for LRU eviction
+    os.utime(manifest_path)
+    logger.info(f"Cache hit for {key_parts} ({entry_dir})")
+    return frames
+
+
+def save_frames(key_parts: dict, frames: dict, index: bool = False) -> Path:
+    """
+    Store DataFrames under key_parts, replacing any existing entry, then evict
+    least recently used entries beyond config.Config.cache_max_bytes.
+
+    Args:
+        key_parts (dict): Key as built by extract_key_parts or partition_key_parts.
+        frames (dict): Mapping of frame name to DataFrame.
+        index (bool): Also store the DataFrame indexes.
+
+    Returns:
+        Path: The cache entry folder.
+    """
+    cache_dir = _cache_dir()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    entry_dir = cache_dir / make_cache_key(key_parts)
+
+    # Write into a temporary folder first so readers never see a partial entry
+    tmp_dir = cache_dir / f".{entry_dir.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+    size_bytes = 0
+    for name, df in frames.items():
+        filepath = tmp_dir / f"{name}.parquet"
+        df.to_parquet(filepath, index=index)
+        size_bytes += filepath.stat().st_size
+
+    manifest = {
+        "key": key_parts,
+        "frames": list(frames),
+        "size_bytes": size_bytes,
+        "created": time.time(),
+    }
+    with open(tmp_dir / MANIFEST_NAME, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, default=str)
+
+    with _cache_lock:
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        tmp_dir.rename(entry_dir)
+        logger.info(f"Cached {list(frames)} for {key_parts} ({size_bytes} bytes)")
+        evict_cache()
+    return entry_dir
+
+
+def register_files(key_parts: dict, files: dict) -> Path:
+    """
+    Register files written outside the cache folder (e.g. a spilled extract) under
+    key_parts, then evict least recently used entries beyond
+    config.Config.cache_max_bytes (never this one, its files are about to be read).
+
+    Args:
+        key_parts (dict): Key of the files, see extract_key_parts.
+        files (dict): Mapping of name to file path.
+
+    Returns:
+        Path: The cache entry folder.
+    """
+    cache_dir = _cache_dir()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    entry_dir = cache_dir / make_cache_key(key_parts)
+    manifest = {
+        "key": key_parts,
+        "files": {name: str(Path(path).resolve()) for name, path in files.items()},
+        "size_bytes": sum(Path(path).stat().st_size for path in files.values()),
+        "created": time.time(),
+    }
+
+    with _cache_lock:
+        entry_dir.mkdir(exist_ok=True)
+        tmp_path = entry_dir / f".{MANIFEST_NAME}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, default=str)
+        os.replace(tmp_path, entry_dir / MANIFEST_NAME)
+        logger.info(f"Registered {list(files)} for {key_parts} ({manifest['size_bytes']} bytes)")
+        evict_cache(keep=entry_dir)
+    return entry_dir
+
+
+def load_files(key_parts: dict) -> Optional[dict]:
+    """
+    Paths of the files registered under key_parts (see register_files).
+
+    Returns:
+        Optional[dict]: Mapping of name to Path, or None on a cache miss (also
+        when a registered file has gone missing; the entry is then dropped).
+    """
+    entry_dir = _cache_dir() / make_cache_key(key_parts)
+    manifest_path = entry_dir / MANIFEST_NAME
+    if not manifest_path.is_file():
+        return None
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        files = {name: Path(path) for name, path in manifest["files"].items()}
+    except (OSError, KeyError, json.JSONDecodeError) as e:
+        logger.warning(f"Discarding corrupt cache entry {entry_dir}: {e}")
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        return None
+    if not all(path.is_file() for path in files.values()):
+        logger.warning(f"Discarding cache entry {entry_dir}, registered files are missing")
+        _remove_entry(entry_dir, manifest)
+        return None
+
+    # Refresh last access time for LRU eviction
+    os.utime(manifest_path)
+    logger.info(f"Cache hit for {key_parts} ({entry_dir})")
+    return files
+
+
+def _key_part_matches(key: dict, name: str, value) -> bool:
+    """Whether a key has value for name; a multi-country extract matches each country."""
+    if key.get(name) == value:
+        return True
+    return name == "country_code" and value in key.get("country_codes", ())
+
+
+def invalidate_cache(**key_filter) -> int:
+    """
+    Remove cache entries whose key matches every given key part.
+
+    Example: invalidate_cache(country_code="NO") drops all Norway extracts (also
+    multi-country ones that include Norway),
+    invalidate_cache() drops everything.
+
+    Returns:
+        int: Number of entries removed.
+    """
+    removed = 0
+    for entry_dir, manifest in list(_iter_entries()):
+        key = manifest.get("key", {})
+        if all(_key_part_matches(key, name, value) for name, value in key_filter.items()):
+            _remove_entry(entry_dir, manifest)
+            removed += 1
+    logger.info(f"Invalidated {removed} cache entries matching {key_filter}")
+    return removed
+
+
+def evict_cache(max_bytes: Optional[int] = None, keep: Optional[Path] = None) -> int:
+    """
+    Remove least recently used entries until the cache fits in max_bytes.
+
+    Args:
+        max_bytes (int, optional): Size budget; defaults to config.Config.cache_max_bytes.
+        keep (Path, optional): Entry folder never evicted (still counted in the size).
+
+    Returns:
+        int: Number of entries removed.
+    """
+    max_bytes = config.Config.cache_max_bytes if max_bytes is None else max_bytes
+    with _cache_lock:
+        entries = []
+        for entry_dir, manifest in _iter_entries():
+            try:
+                last_access = (entry_dir / MANIFEST_NAME).stat().st_mtime
+            except OSError:
+                continue  # Removed meanwhile
+            entries.append((last_access, manifest.get("size_bytes", 0), entry_dir, manifest))
+        total_bytes = sum(entry[1] for entry in entries)
+
+        removed = 0
+        for _, size_bytes, entry_dir, manifest in sorted(entries, key=lambda e: e[:3]):
+            if total_bytes <= max_bytes:
+                break
+            if keep is not None and entry_dir == Path(keep):
+                continue
+            _remove_entry(entry_dir, manifest)
+            total_bytes -= size_bytes
+            removed += 1
+            logger.info(f"Evicted cache entry {entry_dir} ({size_bytes} bytes)")
+    return removed
@@ -0,0 +1,189 @@
+# Checkpoints for long batched extractions.
+# Every completed batch is written to its own Parquet file and recorded in a run
+# manifest, in a folder named by a hash of the extraction plan (family IDs, batch
+# size, database, query version, PATSTAT edition). Rerunning the same job finds the folder and
+# only fetches the batches still missing; verify() then checks that every family
+# was fetched exactly once before the checkpoints are combined and removed.
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import config
+from connect_database import backend_identity
+
+# Initialize Logger
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+
+def plan_key(batches: list[list[int]]) -> str:
+    """
+    Hash identifying an extraction plan: its batches, the database they are read
+    from, the query version and PATSTAT edition.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(
+        json.dumps(
+            {
+                "batch_sizes": [len(batch) for batch in batches],
+                "database": backend_identity(),
+                "query_version": config.Config.query_version,
+                "patstat_edition": config.Config.patstat_edition,
+            }
+        ).encode("utf-8")
+    )
+    for batch in batches:
+        hasher.update(np.asarray(batch, dtype=np.int64).tobytes())
+    return hasher.hexdigest()[:32]
+
+
+def checkpointed_run(batches: list[list[int]]) -> Optional["ExtractionRun"]:
+    """
+    The ExtractionRun of batches, or None when the extraction is not checkpointed:
+    only with Config.checkpoint_extraction, or from Config.checkpoint_min_batches
+    batches up, where a failure costs more than writing every batch twice.
+    """
+    if (
+        config.Config.checkpoint_extraction
+        or len(batches) >= config.Config.checkpoint_min_batches
+    ):
+        return ExtractionRun(batches)
+    return None
+
+
+class ExtractionRun:
+    """
+    Checkpointed state of one batched extraction.
+
+    Args:
+        batches (list[list[int]]): The family IDs of every batch, in order.
+        checkpoint_dir (str, optional): Parent folder; defaults to Config.checkpoint_dir.
+    """
+
+    def __init__(self, batches: list[list[int]], checkpoint_dir: str = None):
+        self.batches = batches
+        self.key = plan_key(batches)
+        self.run_dir = Path(checkpoint_dir or config.Config.checkpoint_dir) / self.key
+        self._lock = threading.Lock()
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> dict:
+        manifest_path = self.run_dir / MANIFEST_NAME
+        if manifest_path.is_file():
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                completed = manifest.get("completed", {})
+                logger.info(
+                    f"Resuming extraction {self.key}: {len(completed)} of "
+                    f"{len(self.batches)} batches already fetched"
+                )
+                return manifest
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Restarting extraction {self.key}, unreadable manifest: {e}")
+        return {
+            "key": self.key,
+            "n_batches": len(self.batches),
+            "created": time.time(),
+            "completed": {},
+        }
+
+    def _write_manifest(self) -> None:
+        """Replace the manifest atomically (a crash leaves the previous one)."""
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.run_dir / f".{MANIFEST_NAME}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.run_dir / MANIFEST_NAME)
+
+    def _batch_path(self, index: int) -> Path:
+        return self.run_dir / f"batch_{index:05d}.parquet"
+
+    def is_completed(self, index: int) -> bool:
+        return str(index) in self.manifest["completed"] and self._batch_path(index).is_file()
+
+    def pending(self) -> list[int]:
+        """Indexes of the batches still to fetch."""
+        return [i for i in range(len(self.batches)) if not self.is_completed(i)]
+
+    def save_batch(self, index: int, df: pd.DataFrame) -> None:
+        """Checkpoint one fetched batch; safe to call from several threads."""
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        batch_path = self._batch_path(index)
+        tmp_path = batch_path.with_name(f".{batch_path.name}.tmp")
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, batch_path)
+        with self._lock:
+            self.manifest["completed"][str(index)] = {
+                "rows": len(df),
+                "families": int(df["docdb_family_id"].nunique()) if len(df) else 0,
+                "fetched": time.time(),
+            }
+            self._write_manifest()
+
+    def load_batch(self, index: int) -> pd.DataFrame:
+        return pd.read_parquet(self._batch_path(index))
+
+    def verify(self) -> None:
+        """
+        Check that every batch was fetched and every family was fetched exactly once:
+        each batch only holds families it asked for, and no family is in two batches.
+
+        Raises:
+            RuntimeError: On a missing batch, an unexpected family or a family
+                fetched more than once.
+        """
+        pending = self.pending()
+        if pending:
+            raise RuntimeError(
+                f"Extraction {self.key} is incomplete, missing batches {pending[:10]}"
+            )
+
+        batch_of_family = {}
+        families_without_rows = 0
+        for index, batch in enumerate(self.batches):
+            if self.manifest["completed"][str(index)]["rows"] == 0:
+                fetched = np.array([], dtype=np.int64)
+            else:
+                fetched = np.unique(
+                    pq.read_table(self._batch_path(index), columns=["docdb_family_id"])
+                    .column("docdb_family_id")
+                    .to_numpy()
+                )
+            unexpected = np.setdiff1d(fetched, np.asarray(batch, dtype=np.int64))
+            if len(unexpected):
+                raise RuntimeError(
+                    f"Batch {index} holds families it did not request: {unexpected[:10].tolist()}"
+                )
+            for family_id in fetched.tolist():
+                if family_id in batch_of_family:
+                    raise RuntimeError(
+                        f"Family {family_id} fetched twice "
+                        f"(batches {batch_of_family[family_id]} and {index})"
+                    )
+                batch_of_family[family_id] = index
+            families_without_rows += len(set(batch)) - len(fetched)
+
+        logger.info(
+            f"Extraction {self.key} verified: {len(batch_of_family)} families in "
+            f"{len(self.batches)} batches, each fetched once"
+        )
+        if families_without_rows:
+            logger.warning(
+                f"{families_without_rows} families have no applicant/inventor rows"
+            )
+
+    def remove(self) -> None:
+        """Drop the checkpoints once their result is stored elsewhere."""
+        shutil.rmtree(self.run_dir, ignore_errors=True)
@@ -0,0 +1,198 @@
+# Sparse family x country matrices shared by the ratio computations and the plots.
+# Long (docdb_family_id, person_ctry_code, value) frames are integer-encoded once into
+# a scipy.sparse CSR matrix, so row normalization, country totals and "Others"
+# rollups are sparse operations; only the few columns actually drawn are densified.
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class FamilyCountryMatrix:
+    """
+    CSR matrix of one value (count or ratio) per family (rows) and country (columns).
+
+    Args:
+        matrix (sparse.csr_matrix): Values, shape (len(families), len(countries)).
+        families (np.ndarray): Sorted docdb_family_id of each row.
+        countries (np.ndarray): Sorted person_ctry_code of each column.
+    """
+
+    def __init__(self, matrix: sparse.csr_matrix, families: np.ndarray, countries: np.ndarray):
+        self.matrix = sparse.csr_matrix(matrix)
+        self.families = np.asarray(families)
+        self.countries = np.asarray(countries, dtype=object)
+
+    @classmethod
+    def from_long(
+        cls,
+        df: pd.DataFrame,
+        value_column: str,
+        families: Optional[np.ndarray] = None,
+        countries: Optional[np.ndarray] = None,
+    ) -> "FamilyCountryMatrix":
+        """
+        Build the matrix from a long frame; repeated (family, country) pairs are summed.
+
+        Args:
+            df (pd.DataFrame): Columns docdb_family_id, person_ctry_code and value_column.
+            value_column (str): Column holding the values.
+            families (np.ndarray, optional): Sorted family axis to use (e.g. shared by
+                several roles); defaults to the families of df.
+            countries (np.ndarray, optional): Sorted country axis; defaults to the countries of df.
+        """
+        # Integer-encode both axes (sorted factorize, or lookup in the given axes)
+        family_values = df["docdb_family_id"].to_numpy()
+        country_values = df["person_ctry_code"].astype(object).fillna("nan").astype(str)
+        if families is None:
+            rows, families = pd.factorize(family_values, sort=True)
+        else:
+            rows = np.searchsorted(families, family_values)
+        if countries is None:
+            cols, countries = pd.factorize(country_values, sort=True)
+            countries = np.asarray(countries, dtype=object)
+        else:
+            cols = np.searchsorted(countries.astype(str), country_values.to_numpy())
+        matrix = sparse.csr_matrix(
+            (df[value_column].to_numpy(dtype=np.float64), (rows, cols)),
+            shape=(len(families), len(countries)),
+        )
+        matrix.sum_duplicates()
+        return cls(matrix, families, countries)
+
+    @property
+    def shape(self) -> tuple:
+        return self.matrix.shape
+
+    def row_sums(self) -> np.ndarray:
+        return np.asarray(self.matrix.sum(axis=1)).ravel()
+
+    def country_totals(self) -> pd.Series:
+        """Column sums, indexed by country."""
+        return pd.Series(
+            np.asarray(self.matrix.sum(axis=0)).ravel(), index=self.countries
+        )
+
+    def country_means(self) -> pd.Series:
+        """Mean value per country over all families (missing entries count as 0)."""
+        return self.country_totals() / max(len(self.families), 1)
+
+    def divide_rows(self, divisors: np.ndarray) -> "FamilyCountryMatrix":
+        """Divide every row by its divisor; rows with a zero divisor become zero."""
+        divisors = np.asarray(divisors, dtype=np.float64)
+        inverse = np.divide(
+            1.0, divisors, out=np.zeros_like(divisors), where=divisors != 0
+        )
+        return FamilyCountryMatrix(
+            sparse.diags(inverse) @ self.matrix, self.families, self.countries
+        )
+
+    def row_normalize(self, scale: float = 1.0) -> "FamilyCountryMatrix":
+        """Scale every row to sum to `scale`; all-zero rows stay zero."""
+        return self.divide_rows(self.row_sums() / scale)
+
+    def restrict(self, family_mask: np.ndarray, country_mask: np.ndarray) -> "FamilyCountryMatrix":
+        """Keep the families and countries selected by the boolean masks."""
+        return FamilyCountryMatrix(
+            self.matrix[family_mask][:, country_mask],
+            self.families[family_mask],
+            self.countries[country_mask],
+        )
+
+    def compact(self) -> "FamilyCountryMatrix":
+        """
+        Drop the families and countries without entries, e.g. to get one role's own
+        axes back from a matrix built on axes shared with other roles.
+        """
+        return self.restrict(self.matrix.getnnz(axis=1) > 0, self.matrix.getnnz(axis=0) > 0)
+
+    def column(self, country: str) -> np.ndarray:
+        """Dense values of one country (zeros when the country is absent)."""
+        positions = np.flatnonzero(self.countries == country)
+        if len(positions) == 0:
+            return np.zeros(len(self.families))
+        return self.matrix[:, positions[0]].toarray().ravel()
+
+    def reindex(self, families: np.ndarray, countries: np.ndarray) -> "FamilyCountryMatrix":
+        """Align on larger sorted axes (a superset of the current ones)."""
+        coo = self.matrix.tocoo()
+        rows = np.searchsorted(families, self.families[coo.row])
+        cols = np.searchsorted(countries.astype(str), self.countries[coo.col].astype(str))
+        matrix = sparse.csr_matrix(
+            (coo.data, (rows, cols)), shape=(len(families), len(countries))
+        )
+        return FamilyCountryMatrix(matrix, families, countries)
+
+    def to_frame(
+        self,
+        countries: Optional[list] = None,
+        row_order: Optional[np.ndarray] = None,
+        others: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """
+        Densify selected countries (the pivot table the plots draw).
+
+        Args:
+            countries (list, optional): Columns to keep, in order; defaults to all.
+            row_order (np.ndarray, optional): Row positions, in order; defaults to all families.
+            others (str, optional): Name of an extra column summing the countries left out.
+
+        Returns:
+            pd.DataFrame: Indexed by docdb_family_id.
+        """
+        countries = list(self.countries) if countries is None else list(countries)
+        positions = {country: i for i, country in enumerate(self.countries)}
+        column_positions = [positions[country] for country in countries]
+        matrix = self.matrix if row_order is None else self.matrix[row_order]
+        families = self.families if row_order is None else self.families[row_order]
+
+        table = pd.DataFrame(
+            matrix[:, column_positions].toarray(),
+            index=pd.Index(families, name="docdb_family_id"),
+            columns=pd.Index(countries, name="person_ctry_code"),
+        )
+        if others is not None:
+            kept = np.zeros(len(self.countries), dtype=bool)
+            kept[column_positions] = True
+            table[others] = np.asarray(matrix[:, ~kept].sum(axis=1)).ravel()
+        return table
+
+    def nonzero_countries(self) -> list:
+        """Countries with a non-zero total, in axis order."""
+        totals = self.country_totals()
+        return list(totals.index[totals.to_numpy() != 0])
+
+
+def shared_matrices(frames: dict) -> dict:
+    """
+    Build matrices for several roles on the same family and country axes.
+
+    Args:
+        frames (dict): Role -> (long DataFrame, value column).
+
+    Returns:
+        dict: Role -> FamilyCountryMatrix, all with identical axes.
+    """
+    families = np.unique(
+        np.concatenate(
+            [df["docdb_family_id"].to_numpy() for df, _ in frames.values()]
+        )
+    )
+    countries = np.unique(
+        np.concatenate(
+            [df["person_ctry_code"].astype(str).to_numpy() for df, _ in frames.values()]
+        )
+    ).astype(object)
+    return {
+        role: FamilyCountryMatrix.from_long(df, value_column, families, countries)
+        for role, (df, value_column) in frames.items()
+    }
+
+
+def descending_order(values: np.ndarray) -> np.ndarray:
+    """
+    Positions sorting values descending; ties keep their current order. Values are
+    rounded first, so shares computed from counts or from ratios tie the same way.
+    """
+    return np.argsort(-np.round(np.asarray(values, dtype=np.float64), 9), kind="stable")
@@ -0,0 +1,117 @@
+# Family-hash sharding for the per-family analysis stages.
+# Rows are partitioned by a hash of docdb_family_id, so every family lands whole in
+# exactly one shard; a per-shard function then runs in a pool of worker processes and
+# its per-family outputs are concatenated back. Workers are spawned (the parent runs
+# pipeline threads, which must not be forked) and start with the parent's Config.
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+import config
+
+# Initialize Logger
+logger = logging.getLogger(__name__)
+
+
+def shard_ids(family_ids, n_shards: int) -> np.ndarray:
+    """Shard number of each docdb_family_id (stable across runs and processes)."""
+    family_ids = np.asarray(family_ids, dtype=np.int64)
+    return (pd.util.hash_array(family_ids) % np.uint64(n_shards)).astype(np.int64)
+
+
+def split_by_family(df: pd.DataFrame, n_shards: int) -> list[pd.DataFrame]:
+    """
+    Partition rows by docdb_family_id hash.
+
+    Args:
+        df (pd.DataFrame): Frame with a docdb_family_id column.
+        n_shards (int): Number of shards.
+
+    Returns:
+        list[pd.DataFrame]: The non-empty shards, rows in their original order.
+    """
+    shards = shard_ids(df["docdb_family_id"].to_numpy(), n_shards)
+    return [
+        df[shards == shard].reset_index(drop=True)
+        for shard in range(n_shards)
+        if (shards == shard).any()
+    ]
+
+
+def _config_snapshot() -> dict:
+    """Plain Config attributes, applied in every worker process."""
+    return {
+        key: value
+        for key, value in vars(config.Config).items()
+        if not key.startswith("_") and not isinstance(value, (classmethod, staticmethod))
+    }
+
+
+def _init_worker(settings: dict) -> None:
+    config.Config.update(**settings)
+
+
+def concat_outputs(shard_outputs: list) -> tuple:
+    """
+    Concatenate per-shard output tuples element-wise.
+
+    DataFrames are concatenated, dicts of DataFrames are concatenated per key.
+    """
+    combined = []
+    for values in zip(*shard_outputs):
+        if isinstance(values[0], dict):
+            combined.append(
+                {
+                    key: pd.concat([value[key] for value in values], ignore_index=True)
+                    for key in values[0]
+                }
+            )
+        else:
+            combined.append(pd.concat(values, ignore_index=True))
+    return tuple(combined)
+
+
+def run_sharded(
+    func: Callable,
+    df: pd.DataFrame,
+    n_shards: int,
+    workers: int = None,
+) -> tuple:
+    """
+    Run a per-family function over family-hash shards of df in worker processes.
+
+    Args:
+        func (Callable): Module-level function taking one shard and returning a
+            tuple of DataFrames (or dicts of DataFrames) with per-family rows.
+        df (pd.DataFrame): Frame with a docdb_family_id column.
+        n_shards (int): Number of shards.
+        workers (int, optional): Worker processes; defaults to one per CPU, at most n_shards.
+
+    Returns:
+        tuple: The outputs of func over all shards, concatenated.
+    """
+    shards = split_by_family(df, n_shards)
+    if len(shards) <= 1:
+        return func(df)
+
+    workers = min(workers or os.cpu_count() or 1, len(shards))
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(_config_snapshot(),),
+    ) as executor:
+        shard_outputs = list(executor.map(func, shards))
+
+    logger.info(
+        f"Computed {func.__name__} over {len(shards)} family shards on {workers} "
+        f"processes in {time.perf_counter() - start_time:.2f}s"
+    )
+    return concat_outputs(shard_outputs)
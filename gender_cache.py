@@ -0,0 +1,169 @@
+# Persistent (first name, country) -> (gender, probability) cache on SQLite.
+# Entries expire after Config.gender_cache_ttl_days; beyond
+# Config.gender_cache_max_entries the least recently used entries are evicted.
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+import config
+
+# Initialize Logger
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of bound parameters per statement
+_LOOKUP_CHUNK = 500
+
+
+def normalize_gender_key(first_name, country) -> tuple:
+    """Case-fold the first name and country so "OLE"/"Ole" share one entry."""
+    first_name = "" if first_name is None else str(first_name).strip().lower()
+    country = "" if country is None else str(country).strip().upper()
+    return first_name, country
+
+
+class GenderCache:
+    """
+    SQLite-backed gender cache shared by all runs on this machine.
+
+    Args:
+        path (str, optional): Database file; defaults to Config.gender_cache_path.
+        ttl_days (float, optional): Entry lifetime; defaults to Config.gender_cache_ttl_days.
+        max_entries (int, optional): LRU size bound; defaults to Config.gender_cache_max_entries.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl_days: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ):
+        self.path = Path(path or config.Config.gender_cache_path)
+        self.ttl_seconds = (
+            config.Config.gender_cache_ttl_days if ttl_days is None else ttl_days
+        ) * 86400
+        self.max_entries = (
+            config.Config.gender_cache_max_entries if max_entries is None else max_entries
+        )
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS gender_cache (
+                    first_name TEXT NOT NULL,
+                    country TEXT NOT NULL,
+                    gender TEXT NOT NULL,
+                    probability REAL NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (first_name, country)
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_gender_cache_last_access "
+                "ON gender_cache (last_access)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        """Open a connection, commit on success and always close it."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, keys) -> dict:
+        """
+        Look up cached results.
+
+        Args:
+            keys: Iterable of (first_name, country) pairs, already normalized.
+
+        Returns:
+            dict: (first_name, country) -> (gender, probability) for fresh hits only.
+        """
+        keys = set(keys)
+        if not keys:
+            return {}
+        names = sorted({first_name for first_name, _ in keys})
+        now = time.time()
+        expires_before = now - self.ttl_seconds
+
+        hits = {}
+        with self._lock, self._connect() as conn:
+            for start in range(0, len(names), _LOOKUP_CHUNK):
+                chunk = names[start : start + _LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    "SELECT first_name, country, gender, probability FROM gender_cache "
+                    f"WHERE first_name IN ({placeholders}) AND fetched_at >= ?",
+                    (*chunk, expires_before),
+                ).fetchall()
+                for first_name, country, gender, probability in rows:
+                    if (first_name, country) in keys:
+                        hits[(first_name, country)] = (gender, probability)
+
+            # Refresh last access time for LRU eviction
+            conn.executemany(
+                "UPDATE gender_cache SET last_access = ? WHERE first_name = ? AND country = ?",
+                [(now, first_name, country) for first_name, country in hits],
+            )
+        return hits
+
+    def set_many(self, results: dict) -> None:
+        """
+        Store freshly resolved results, then evict expired and surplus entries.
+
+        Args:
+            results (dict): (first_name, country) -> (gender, probability).
+        """
+        if not results:
+            return
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO gender_cache "
+                "(first_name, country, gender, probability, fetched_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (first_name, country, gender, float(probability or 0), now, now)
+                    for (first_name, country), (gender, probability) in results.items()
+                ],
+            )
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        Drop expired entries and the least recently used ones beyond max_entries.
+
+        Returns:
+            int: Number of entries removed.
+        """
+        with self._lock, self._connect() as conn:
+            removed = conn.execute(
+                "DELETE FROM gender_cache WHERE fetched_at < ?",
+                (time.time() - self.ttl_seconds,),
+            ).rowcount
+            (count,) = conn.execute("SELECT COUNT(*) FROM gender_cache").fetchone()
+            surplus = count - self.max_entries
+            if surplus > 0:
+                removed += conn.execute(
+                    "DELETE FROM gender_cache WHERE rowid IN ("
+                    "SELECT rowid FROM gender_cache ORDER BY last_access LIMIT ?)",
+                    (surplus,),
+                ).rowcount
+        if removed:
+            logger.info(f"Evicted {removed} gender cache entries")
+        return removed
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM gender_cache")
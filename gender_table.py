@@ -0,0 +1,204 @@
+# Offline first-name gender table: (first name, country) -> P(female).
+# Keys are stored sorted as a fixed-width unicode .npy array next to a float32
+# array of female probabilities and memory-mapped on load, so a whole column of
+# names is resolved with one vectorized searchsorted call. Names missing for a
+# country fall back to the global prior (country "").
+#
+# The table is not shipped with the repository; build it from any
+# first_name,country,gender,probability[,count] CSV (e.g. a Genderize or WGND export):
+#   python gender_table.py build names.csv --table-dir gender_table
+# Until it is built, offline mode raises FileNotFoundError instead of using the network.
+import argparse
+import logging
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+import config
+
+# Initialize Logger
+logger = logging.getLogger(__name__)
+
+KEYS_FILE = "keys.npy"
+P_FEMALE_FILE = "p_female.npy"
+KEY_SEPARATOR = "\t"
+
+
+def _make_keys(first_names, countries) -> np.ndarray:
+    """Join normalized first names and countries into sortable unicode keys."""
+    first_names = pd.Series(first_names, dtype=object).fillna("").astype(str)
+    countries = pd.Series(countries, dtype=object).fillna("").astype(str)
+    keys = first_names.str.strip().str.lower() + KEY_SEPARATOR + countries.str.strip().str.upper()
+    return keys.to_numpy(dtype=str)
+
+
+def build_name_table(csv_path: str, table_dir: str = None) -> int:
+    """
+    Build the offline gender table from a CSV of first-name gender estimates.
+
+    Rows with the same (first_name, country) are averaged, weighted by the
+    optional count column. Global priors (country "") missing from the CSV are
+    derived from the country rows in the same way.
+
+    Args:
+        csv_path (str): CSV with columns first_name, country, gender, probability and optionally count.
+        table_dir (str, optional): Output folder; defaults to Config.gender_table_dir.
+
+    Returns:
+        int: Number of keys in the table.
+    """
+    table_dir = Path(table_dir or config.Config.gender_table_dir)
+    df = pd.read_csv(csv_path, dtype={"first_name": str, "country": str}, keep_default_na=False)
+
+    # Step 1: Normalize to P(female) and a weight per row
+    df["first_name"] = df["first_name"].str.strip().str.lower()
+    df["country"] = df["country"].str.strip().str.upper()
+    df = df[df["first_name"] != ""]
+    probability = pd.to_numeric(df["probability"], errors="coerce").fillna(0.5)
+    df["p_female"] = np.where(df["gender"] == "female", probability, 1 - probability)
+    df["weight"] = df["count"].astype(float) if "count" in df.columns else 1.0
+    df["weighted"] = df["p_female"] * df["weight"]
+
+    # Step 2: Average per key, then add global priors that the CSV lacks
+    per_key = df.groupby(["first_name", "country"], as_index=False)[["weighted", "weight"]].sum()
+    derived_global = (
+        per_key[per_key["country"] != ""]
+        .groupby("first_name", as_index=False)[["weighted", "weight"]]
+        .sum()
+        .assign(country="")
+    )
+    derived_global = derived_global[
+        ~derived_global["first_name"].isin(per_key.loc[per_key["country"] == "", "first_name"])
+    ]
+    table = pd.concat([per_key, derived_global], ignore_index=True)
+    table = table[table["weight"] > 0]
+
+    # Step 3: Sort by key and save as plain arrays
+    keys = _make_keys(table["first_name"], table["country"])
+    p_female = (table["weighted"] / table["weight"]).to_numpy(dtype=np.float32)
+    order = np.argsort(keys, kind="stable")
+
+    # Replace the files rather than overwrite them, tables already mapped keep theirs
+    table_dir.mkdir(parents=True, exist_ok=True)
+    for filename, values in ((KEYS_FILE, keys[order]), (P_FEMALE_FILE, p_female[order])):
+        tmp_path = table_dir / f".{filename}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, values)
+        os.replace(tmp_path, table_dir / filename)
+    _load_name_table.cache_clear()
+    logger.info(f"Built gender table with {len(keys)} keys in {table_dir}")
+    return len(keys)
+
+
+class NameTable:
+    """Memory-mapped sorted key / P(female) arrays, see build_name_table."""
+
+    def __init__(self, table_dir: str):
+        table_dir = Path(table_dir)
+        self.keys = np.load(table_dir / KEYS_FILE, mmap_mode="r")
+        self.p_female = np.load(table_dir / P_FEMALE_FILE, mmap_mode="r")
+
+    def _find(self, keys: np.ndarray) -> tuple:
+        """Return (positions, found mask) of keys in the sorted key array."""
+        if len(self.keys) == 0:
+            return np.zeros(len(keys), dtype=np.intp), np.zeros(len(keys), dtype=bool)
+        positions = np.searchsorted(self.keys, keys)
+        positions = np.minimum(positions, len(self.keys) - 1)
+        return positions, self.keys[positions] == keys
+
+    def lookup(self, first_names, countries) -> tuple:
+        """
+        Resolve whole columns of first names, falling back to global priors.
+
+        Args:
+            first_names: Array-like of first names.
+            countries: Array-like of 2-letter country codes, aligned with first_names.
+
+        Returns:
+            tuple: (gender, probability) arrays; gender is "unknown" with
+            probability 0 for names missing from the table.
+        """
+        # Build string keys for unique (name, country) pairs only
+        pairs = pd.MultiIndex.from_arrays(
+            [
+                pd.Series(first_names, dtype=object).fillna(""),
+                pd.Series(countries, dtype=object).fillna(""),
+            ]
+        )
+        codes, unique_pairs = pairs.factorize()
+        unique_names = unique_pairs.get_level_values(0)
+
+        positions, found = self._find(
+            _make_keys(unique_names, unique_pairs.get_level_values(1))
+        )
+        global_positions, global_found = self._find(
+            _make_keys(unique_names, np.full(len(unique_pairs), "", dtype=object))
+        )
+        positions = np.where(found, positions, global_positions)[codes]
+        found = (found | global_found)[codes]
+
+        p_female = np.asarray(self.p_female[positions], dtype=np.float64)
+        gender = np.where(
+            found, np.where(p_female >= 0.5, "female", "male"), "unknown"
+        ).astype(object)
+        probability = np.where(found, np.maximum(p_female, 1 - p_female), 0.0)
+        return gender, probability
+
+
+def table_fingerprint(table_dir: str = None) -> Optional[str]:
+    """
+    Size and modification time of the table files in table_dir (defaults to
+    Config.gender_table_dir), for cache keys; None while no table is built.
+    """
+    table_dir = Path(table_dir or config.Config.gender_table_dir)
+    files = [table_dir / KEYS_FILE, table_dir / P_FEMALE_FILE]
+    if not all(path.is_file() for path in files):
+        return None
+    return ";".join(
+        f"{path.name}:{path.stat().st_size}:{path.stat().st_mtime_ns}" for path in files
+    )
+
+
+def load_name_table(table_dir: str = None) -> NameTable:
+    """
+    Load (and keep mapped) the table in table_dir, defaults to Config.gender_table_dir.
+    A table rebuilt since, by any process, is loaded again: the mapping is cached
+    per table_fingerprint.
+    """
+    table_dir = str(table_dir or config.Config.gender_table_dir)
+    return _load_name_table(table_dir, table_fingerprint(table_dir))
+
+
+@lru_cache(maxsize=4)
+def _load_name_table(table_dir: str, fingerprint: Optional[str]) -> NameTable:
+    if fingerprint is None:
+        raise FileNotFoundError(
+            f"No offline gender table in {table_dir}; build one with "
+            f"`python gender_table.py build names.csv --table-dir {table_dir}` "
+            f"or set Config.gender_mode = \"api\"."
+        )
+    return NameTable(table_dir)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Offline first-name gender table")
+    parser.add_argument(
+        "--table-dir", default=config.Config.gender_table_dir, help="Table folder"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Build the table from a CSV")
+    build_parser.add_argument("csv_path")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        print(build_name_table(args.csv_path, args.table_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# Batched, concurrent and rate limited client for the Genderize.io API.
+# Names are sent up to Config.genderize_batch_size per request (name[]=...),
+# requests run on a bounded thread pool over one keep-alive session, and
+# failures degrade to missing results (read as "unknown") instead of raising.
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+
+# Initialize Logger
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: rate limited or temporary server errors
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """
+    Spread calls evenly so no more than `rate` start per second across threads.
+
+    Args:
+        rate (float): Calls per second; 0 or None disables the limit.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class GenderizeResolver:
+    """
+    Resolve many (first_name, country) pairs against Genderize.io.
+
+    Args:
+        base_url (str, optional): API endpoint; defaults to Config.genderize_url,
+            point it at a local stub server for testing.
+        batch_size (int, optional): Names per request; defaults to Config.genderize_batch_size.
+        workers (int, optional): Concurrent requests; defaults to Config.genderize_workers.
+        rate_limit (float, optional): Requests per second; defaults to Config.genderize_rate_limit.
+        timeout (float, optional): Seconds per request; defaults to Config.genderize_timeout.
+        max_retries (int, optional): Retries per batch; defaults to Config.genderize_max_retries.
+    """
+
+    def __init__(
+        self,
+        base_url: str = None,
+        batch_size: int = None,
+        workers: int = None,
+        rate_limit: float = None,
+        timeout: float = None,
+        max_retries: int = None,
+    ):
+        cfg = config.Config
+        self.base_url = base_url or cfg.genderize_url
+        self.batch_size = batch_size or cfg.genderize_batch_size
+        self.workers = max(1, workers or cfg.genderize_workers)
+        self.timeout = timeout or cfg.genderize_timeout
+        self.max_retries = cfg.genderize_max_retries if max_retries is None else max_retries
+        self.rate_limiter = RateLimiter(
+            cfg.genderize_rate_limit if rate_limit is None else rate_limit
+        )
+        self.api_key = os.getenv("genderize_api_key")
+
+        # One keep-alive connection per worker
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _batches(self, keys) -> list:
+        """Group keys by country (one country_id per request) and chunk by batch_size."""
+        by_country = {}
+        for first_name, country in sorted(keys):
+            by_country.setdefault(country, []).append(first_name)
+        return [
+            (country, names[start : start + self.batch_size])
+            for country, names in by_country.items()
+            for start in range(0, len(names), self.batch_size)
+        ]
+
+    def _request(self, country: str, names: list) -> list:
+        """Send one multi-name request, retrying with exponential backoff."""
+        params = [("name[]", name) for name in names]
+        if country:
+            params.append(("country_id", country))
+        if self.api_key:
+            params.append(("apikey", self.api_key))
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait()
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    payload = response.json()
+                    # A single name[] may come back as an object instead of a list
+                    return payload if isinstance(payload, list) else [payload]
+                error = f"HTTP {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+            if attempt < self.max_retries:
+                delay = config.Config.genderize_backoff * 2**attempt
+                logger.debug(f"Genderize retry {attempt + 1} in {delay:.1f}s: {error}")
+                time.sleep(delay)
+        raise requests.RequestException(f"Gave up after {self.max_retries + 1} attempts: {error}")
+
+    def _resolve_batch(self, batch: tuple) -> dict:
+        country, names = batch
+        try:
+            payload = self._request(country, names)
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Genderize lookup failed for {len(names)} names ({country}): {e}")
+            return {}
+
+        results = {}
+        for name, item in zip(names, payload):
+            gender = item.get("gender") or "unknown"
+            probability = item.get("probability") or 0
+            results[(name, country)] = (gender, probability)
+        return results
+
+    def resolve(self, keys) -> dict:
+        """
+        Resolve normalized (first_name, country) pairs.
+
+        Args:
+            keys: Iterable of (first_name, country) pairs.
+
+        Returns:
+            dict: (first_name, country) -> (gender, probability) for successful
+            lookups; pairs that failed or timed out are left out.
+        """
+        batches = self._batches(keys)
+        if not batches:
+            return {}
+
+        start_time = time.perf_counter()
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for batch_results in executor.map(self._resolve_batch, batches):
+                results.update(batch_results)
+        logger.info(
+            f"Genderize resolved {len(results)} names in {len(batches)} requests "
+            f"({time.perf_counter() - start_time:.2f}s)"
+        )
+        return results
+
+    def close(self) -> None:
+        self.session.close()
@@ -4,7 +4,14 @@ import os, sys
 import pandas as pd
 import numpy as np
 from pathlib import Path
-from connect_database import create_sqlalchemy_session
+from connect_database import (
+    backend_identity,
+    create_sqlalchemy_session,
+    fetch_columnar,
+    frame_from_row_chunks,
+    frame_from_rows,
+    session_scope,
+)
 from sqlalchemy.orm import aliased
 from sqlalchemy import (
     create_engine,
@@ -21,17 +28,25 @@ from sqlalchemy import (
     func,
     distinct,
     and_,
+    literal,
+    union_all,
 )
 from sqlalchemy.sql import func
+from sqlalchemy.exc import SQLAlchemyError
 import matplotlib.pyplot as plt
 import ast
 import unicodedata
 import streamlit as st
 import re
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 from typing import Union
 import logging
 import requests
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from scipy.stats import mode  # used to get the most common value/ in inventors counts
 
 # Our functions
@@ -44,6 +59,25 @@ from ploting_applicants_inventors_details import (
     plot_appl_invt_indiv_non_indiv,
     plot_individ_appl_invt_ratios,
 )
+from extract_cache import (
+    extract_key_parts,
+    partition_key_parts,
+    load_files,
+    load_frames,
+    make_cache_key,
+    register_files,
+    save_frames,
+)
+from gender_cache import GenderCache
+from genderize_client import GenderizeResolver
+from gender_table import load_name_table, table_fingerprint
+from pipeline import LazyResults, Pipeline, Stage, skip_stage_cache
+from family_country_matrix import FamilyCountryMatrix, shared_matrices
+from family_shards import concat_outputs, run_sharded
+from spill_store import SAMPLE_ROWS, ParquetSpill, iter_family_chunks, row_stats
+from extraction_checkpoint import ExtractionRun, checkpointed_run
+from run_estimator import ANALYSIS, EXTRACT, ThroughputHistory, predict_run
+from preview_sampling import stratified_mean, stratified_sample
 import config
 
 # Initialize Logger
@@ -52,9 +86,6 @@ logger = logging.getLogger(__name__)
 # Get constant from config.py
 output_dir = Path(config.Config.output_dir)
 
-# Create a SQLAlchemy session
-db = create_sqlalchemy_session()
-
 # Tables to work with
 from models_tables import (
     TLS201_APPLN,
@@ -71,105 +102,612 @@ t206 = aliased(TLS206_PERSON)
 t207 = aliased(TLS207_PERS_APPLN)
 t226 = aliased(TLS226_PERSON_ORIG)
 
+# Explicit column dtypes for the columnar fetch path (see connect_database.fetch_columnar)
+FAMILY_IDS_DTYPES = {
+    "appln_id": "int64",
+    "docdb_family_id": "int64",
+    "appln_filing_year": "int16",
+}
+
+FAMILY_STRATA_DTYPES = {
+    "docdb_family_id": "int64",
+    "appln_filing_year": "int16",
+    "docdb_family_size": "int16",
+}
+
+FAMILY_COUNTRIES_DTYPES = {
+    "appln_id": "int64",
+    "docdb_family_id": "int64",
+    "person_ctry_code": "object",
+}
+
+APPL_INVT_DTYPES = {
+    # TLS201_APPLN
+    "docdb_family_id": "int64",
+    "appln_id": "int64",
+    "appln_filing_year": "int16",
+    "appln_auth": "object",
+    "appln_nr": "object",
+    "docdb_family_size": "int16",
+    "earliest_publn_date": "datetime64[s]",
+    "nb_applicants": "int16",
+    "nb_inventors": "int16",
+    # TLS206_PERSON
+    "person_ctry_code": "object",
+    "person_name": "object",
+    "person_id": "int64",
+    "doc_std_name_id": "int64",
+    "psn_sector": "object",
+    # TLS207_PERS_APPLN
+    "applt_seq_nr": "int16",
+    "invt_seq_nr": "int16",
+}
+
+# In-memory representation of df_appl_invt used by the analysis stages (see compact_appl_invt).
+# Integer columns fall back to a wider type when their values do not fit.
+COMPACT_APPL_INVT_DTYPES = {
+    "docdb_family_id": "int32",
+    "appln_id": "int32",
+    "person_id": "int32",
+    "doc_std_name_id": "int32",
+    "appln_filing_year": "int16",
+    "docdb_family_size": "int16",
+    "nb_applicants": "int16",
+    "nb_inventors": "int16",
+    "applt_seq_nr": "int8",
+    "invt_seq_nr": "int8",
+    "appln_auth": "category",
+    "person_ctry_code": "category",
+    "psn_sector": "category",
+}
+
+
+def _fetch_dataframe(db, query, dtypes: dict) -> pd.DataFrame:
+    """
+    Run a query into a DataFrame, through the raw cursor when config.Config.columnar_fetch
+    is set, otherwise through SQLAlchemy Row objects; both apply the same dtypes.
+    """
+    if config.Config.columnar_fetch:
+        return fetch_columnar(db, query.statement, dtypes)
+    columns = [column["name"] for column in query.column_descriptions]
+    return frame_from_rows(query.all(), columns, dtypes)
+
+
+def _compact_dtype(series: pd.Series, dtype: str):
+    """Target dtype for one column, or None to leave it as is."""
+    if dtype == "category":
+        return None if isinstance(series.dtype, pd.CategoricalDtype) else dtype
+    if (
+        series.dtype.kind not in "iu"
+        or series.dtype == np.dtype(dtype)
+        or series.hasnans
+    ):
+        return None  # NULLs (nullable/float/object) or already compact
+    for candidate in (dtype, "int16", "int32", "int64"):
+        info = np.iinfo(candidate)
+        if info.bits >= np.iinfo(dtype).bits and (
+            series.empty or (info.min <= series.min() and series.max() <= info.max)
+        ):
+            return None if series.dtype == np.dtype(candidate) else candidate
+    return None
+
+
+def compact_appl_invt(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert df_appl_invt to COMPACT_APPL_INVT_DTYPES: narrow integer IDs and sequence
+    numbers, and categorical country/sector/authority columns. person_ctry_code is
+    stripped once here, so later stages can filter it without re-cleaning.
+
+    Args:
+        df (pd.DataFrame): Applicant/inventor rows (e.g. from get_applicant_inventor).
+
+    Returns:
+        pd.DataFrame: New frame with compact dtypes; df itself if nothing changes.
+    """
+    dtypes = {
+        column: dtype
+        for column, dtype in (
+            (column, _compact_dtype(df[column], dtype))
+            for column, dtype in COMPACT_APPL_INVT_DTYPES.items()
+            if column in df.columns
+        )
+        if dtype is not None
+    }
+    if not dtypes:
+        return df
+
+    bytes_before = df.memory_usage(deep=True).sum()
+    converted = {}
+    for column, dtype in dtypes.items():
+        values = df[column]
+        if column == "person_ctry_code":
+            values = values.astype("string").str.strip().astype(object)
+        converted[column] = values.astype(dtype)
+    df_compact = df.assign(**converted)
+
+    bytes_after = df_compact.memory_usage(deep=True).sum()
+    logger.info(
+        f"Compacted df_appl_invt ({len(df)} rows): {bytes_before / 1e6:.1f} MB -> "
+        f"{bytes_after / 1e6:.1f} MB, {(bytes_before - bytes_after) / 1e6:.1f} MB saved"
+    )
+    return df_compact
+
+
 # Define the query for all applicants/inventors countries within a spesific country_code.
 # example country_code = 'NO', but a application can have applicants and inventors from other countries with 'NO'
 
 
+def _family_ids_query(db, country_code: str, start_year: int, end_year: int):
+    """Query the applications with a person from country_code filed in the year range."""
+    return (
+        db.query(t201.appln_id, t201.docdb_family_id, t201.appln_filing_year)
+        .join(t207, t201.appln_id == t207.appln_id)
+        .join(t206, t207.person_id == t206.person_id)
+        .filter(
+            t206.person_ctry_code == country_code,
+            t201.appln_filing_year.between(start_year, end_year),
+        )
+        .group_by(t201.appln_id, t201.docdb_family_id, t201.appln_filing_year)
+        .order_by(t201.appln_id, t201.appln_filing_year)
+    )
+
+
 # Function to fetch family IDs based on country_code and year range
-def get_family_ids(country_code: str, start_year: int, end_year: int) -> pd.DataFrame:
-    with create_sqlalchemy_session() as db:
-        if len(country_code) != 2 or not country_code.isalpha():
-            raise ValueError("Country code must be a 2-letter string (e.g., 'NO').")
-        if start_year < 1900 or start_year > 2025:
-            raise ValueError("Start year must be between 1900 and 2025.")
-        if end_year < start_year or end_year > 2025:
-            raise ValueError(
-                "End year must be greater than or equal to start year and <= 2023."
-            )
+def get_family_ids(
+    country_code: str, start_year: int, end_year: int, db=None
+) -> pd.DataFrame:
+    if len(country_code) != 2 or not country_code.isalpha():
+        raise ValueError("Country code must be a 2-letter string (e.g., 'NO').")
+    if start_year < 1900 or start_year > 2025:
+        raise ValueError("Start year must be between 1900 and 2025.")
+    if end_year < start_year or end_year > 2025:
+        raise ValueError(
+            "End year must be greater than or equal to start year and <= 2023."
+        )
+
+    # Open a session for this call only when the caller did not pass one
+    if db is None:
+        with session_scope() as db:
+            return get_family_ids(country_code, start_year, end_year, db)
+
+    query = _family_ids_query(db, country_code, start_year, end_year)
+    df_family_ids = _fetch_dataframe(db, query, FAMILY_IDS_DTYPES)
+    # if resutl is empty
+    if df_family_ids.empty:
+        return pd.Series([], dtype="int64")
+
+    # Remove duplicates
+    df_unique_family_ids = df_family_ids["docdb_family_id"].drop_duplicates()
+
+    # Make df as dataframe instead of serie:
+    df_unique_family_ids = pd.DataFrame(
+        df_unique_family_ids, columns=["docdb_family_id"]
+    )
+    return df_unique_family_ids
+
+
+def count_applicants_inventors(
+    country_code: str, start_year: int, end_year: int, db=None
+) -> dict:
+    """
+    Size of an extraction without fetching it: COUNT queries over TLS201/TLS207.
+
+    Args:
+        country_code (str): 2-letter country code.
+        start_year (int): First filing year.
+        end_year (int): Last filing year.
+        db: Optional SQLAlchemy session; a pooled session is opened when omitted.
+
+    Returns:
+        dict: families (matching docdb_family_id values) and rows (person-application
+        links of those families, i.e. the expected df_appl_invt rows).
+    """
+    if db is None:
+        with session_scope() as db:
+            return count_applicants_inventors(country_code, start_year, end_year, db)
+
+    family_ids = (
+        select(t201.docdb_family_id)
+        .join(t207, t201.appln_id == t207.appln_id)
+        .join(t206, t207.person_id == t206.person_id)
+        .where(
+            t206.person_ctry_code == country_code,
+            t201.appln_filing_year.between(start_year, end_year),
+        )
+        .distinct()
+        .subquery()
+    )
+    families = db.execute(select(func.count()).select_from(family_ids)).scalar()
+
+    family_appln = aliased(TLS201_APPLN)
+    rows = db.execute(
+        select(func.count())
+        .select_from(family_appln)
+        .join(t207, family_appln.appln_id == t207.appln_id)
+        .where(family_appln.docdb_family_id.in_(select(family_ids.c.docdb_family_id)))
+    ).scalar()
+    return {"families": int(families or 0), "rows": int(rows or 0)}
+
+
+def estimate_applicants_inventors_run(
+    country_code: str,
+    start_year: int,
+    end_year: int,
+    preview_sample_size: Optional[int] = None,
+) -> dict:
+    """
+    Dry run: predicted size, memory and wall time of a run, see run_estimator.predict_run.
+    preview_sample_size overrides config.Config.preview_sample_size.
+    """
+    counts = count_applicants_inventors(country_code, start_year, end_year)
+    sample_size = (
+        config.Config.preview_sample_size
+        if preview_sample_size is None
+        else preview_sample_size
+    )
+    if 0 < sample_size < counts["families"]:
+        # A preview extracts a proportional sample: the rows per family carry over
+        counts = {
+            "families": sample_size,
+            "rows": round(counts["rows"] * sample_size / counts["families"]),
+        }
+    estimate = predict_run(counts["families"], counts["rows"])
+    logger.info(
+        f"Estimate for {country_code} {start_year}-{end_year}: {estimate['families']} families, "
+        f"{estimate['rows']} rows, {estimate['memory_mb']} MB, ~{estimate['seconds']}s "
+        f"(mode '{estimate['mode']}', based on {estimate['based_on_runs']} runs)"
+    )
+    return estimate
+
+
+def get_family_years(
+    country_code: str, start_year: int, end_year: int, db
+) -> pd.DataFrame:
+    """
+    Fetch the filing years in which each family has an application from country_code.
+
+    Args:
+        country_code (str): 2-letter country code.
+        start_year (int): First filing year.
+        end_year (int): Last filing year.
+        db: SQLAlchemy session.
+
+    Returns:
+        pd.DataFrame: Unique (docdb_family_id, appln_filing_year) pairs.
+    """
+    query = _family_ids_query(db, country_code, start_year, end_year)
+    df_family_ids = _fetch_dataframe(db, query, FAMILY_IDS_DTYPES)
+    if df_family_ids.empty:
+        return pd.DataFrame(
+            {
+                "docdb_family_id": pd.Series([], dtype="int64"),
+                "appln_filing_year": pd.Series([], dtype="int16"),
+            }
+        )
+    return df_family_ids[["docdb_family_id", "appln_filing_year"]].drop_duplicates()
+
+
+def get_family_strata(
+    country_code: str, start_year: int, end_year: int, db
+) -> pd.DataFrame:
+    """
+    Fetch the sampling strata of the families with an application from country_code.
+
+    Args:
+        country_code (str): 2-letter country code.
+        start_year (int): First filing year.
+        end_year (int): Last filing year.
+        db: SQLAlchemy session.
+
+    Returns:
+        pd.DataFrame: One row per docdb_family_id with its first filing year in the
+        range (appln_filing_year) and docdb_family_size.
+    """
+    query = (
+        db.query(
+            t201.docdb_family_id,
+            func.min(t201.appln_filing_year).label("appln_filing_year"),
+            func.max(t201.docdb_family_size).label("docdb_family_size"),
+        )
+        .join(t207, t201.appln_id == t207.appln_id)
+        .join(t206, t207.person_id == t206.person_id)
+        .filter(
+            t206.person_ctry_code == country_code,
+            t201.appln_filing_year.between(start_year, end_year),
+        )
+        .group_by(t201.docdb_family_id)
+        .order_by(t201.docdb_family_id)
+    )
+    df_family_strata = _fetch_dataframe(db, query, FAMILY_STRATA_DTYPES)
+    if df_family_strata.empty:
+        return pd.DataFrame(
+            {
+                column: pd.Series([], dtype=dtype)
+                for column, dtype in FAMILY_STRATA_DTYPES.items()
+            }
+        )
+    return df_family_strata
+
+
+def get_family_countries(
+    country_codes: list[str], start_year: int, end_year: int, db
+) -> pd.DataFrame:
+    """
+    Fetch the families of several countries in one query.
+
+    Args:
+        country_codes (list[str]): 2-letter country codes.
+        start_year (int): First filing year.
+        end_year (int): Last filing year.
+        db: SQLAlchemy session.
+
+    Returns:
+        pd.DataFrame: Unique (docdb_family_id, person_ctry_code) pairs, ordered by
+        the first application of each pair, so the families of one country are in
+        the order get_family_ids returns them.
+    """
+    query = (
+        db.query(t201.appln_id, t201.docdb_family_id, t206.person_ctry_code)
+        .join(t207, t201.appln_id == t207.appln_id)
+        .join(t206, t207.person_id == t206.person_id)
+        .filter(
+            t206.person_ctry_code.in_(country_codes),
+            t201.appln_filing_year.between(start_year, end_year),
+        )
+        .group_by(t201.appln_id, t201.docdb_family_id, t206.person_ctry_code)
+        .order_by(t201.appln_id)
+    )
+    df_family_countries = _fetch_dataframe(db, query, FAMILY_COUNTRIES_DTYPES)
+    if df_family_countries.empty:
+        return pd.DataFrame(
+            {
+                "docdb_family_id": pd.Series([], dtype="int64"),
+                "person_ctry_code": pd.Series([], dtype="object"),
+            }
+        )
+    return (
+        df_family_countries[["docdb_family_id", "person_ctry_code"]]
+        .drop_duplicates()
+        .reset_index(drop=True)
+    )
+
+
+def _applicant_inventor_query(db):
+    """
+    Build the base query joining TLS201/TLS207/TLS206 with the applicant/inventor columns.
+
+    Args:
+        db: SQLAlchemy session to build the query on.
+
+    Returns:
+        Query: Unfiltered query, to be restricted to a set of family IDs by the caller.
+    """
+    return (
+        db.query(
+            t201.docdb_family_id,
+            t201.appln_id,
+            t201.appln_filing_year,
+            t201.appln_auth,
+            t201.appln_nr,
+            t201.docdb_family_size,
+            t201.earliest_publn_date,
+            t201.nb_applicants,
+            t201.nb_inventors,
+            t206.person_ctry_code,
+            t206.person_name,
+            t206.person_id,
+            t206.doc_std_name_id,
+            t206.psn_sector,
+            t207.applt_seq_nr,
+            t207.invt_seq_nr,
+        )
+        .join(t207, t201.appln_id == t207.appln_id)
+        .join(t206, t207.person_id == t206.person_id)
+    )
+
+
+def _load_family_ids_temp_table(db, family_ids_list: list[int]) -> Table:
+    """
+    Bulk-load the family IDs into a session temp table on the current connection.
+
+    Args:
+        db: SQLAlchemy session; the temp table lives as long as its connection.
+        family_ids_list (list[int]): docdb_family_id values to load.
+
+    Returns:
+        Table: The temp table, with a single docdb_family_id primary key column.
+    """
+    connection = db.connection()
+    if connection.dialect.name == "mssql":
+        # '#' makes the table local to the current SQL Server connection
+        table_name, prefixes = "#family_ids", []
+    else:
+        table_name, prefixes = "family_ids", ["TEMPORARY"]
+    family_ids_table = Table(
+        table_name,
+        MetaData(),
+        Column("docdb_family_id", Integer, primary_key=True, autoincrement=False),
+        prefixes=prefixes,
+    )
+    # A drop rolled back with an earlier session can leave the table on a pooled connection
+    family_ids_table.drop(connection, checkfirst=True)
+    family_ids_table.create(connection)
+    # Drop duplicates before insert, the primary key would reject them
+    unique_family_ids = list(dict.fromkeys(family_ids_list))
+    connection.execute(
+        family_ids_table.insert(),
+        [{"docdb_family_id": family_id} for family_id in unique_family_ids],
+    )
+    return family_ids_table
 
+
+def _get_applicant_inventor_temp_table(
+    family_ids_list: list[int], db
+) -> pd.DataFrame:
+    """
+    Retrieve applicants and inventors with one join against a temp table of family IDs,
+    streaming the rows back in chunks of config.Config.fetch_chunk_size.
+    """
+    family_ids_table = _load_family_ids_temp_table(db, family_ids_list)
+    try:
         query = (
-            db.query(t201.appln_id, t201.docdb_family_id, t201.appln_filing_year)
-            .join(t207, t201.appln_id == t207.appln_id)
-            .join(t206, t207.person_id == t206.person_id)
-            .filter(
-                t206.person_ctry_code == country_code,
-                t201.appln_filing_year.between(start_year, end_year),
+            _applicant_inventor_query(db)
+            .join(
+                family_ids_table,
+                t201.docdb_family_id == family_ids_table.c.docdb_family_id,
             )
-            .group_by(t201.appln_id, t201.docdb_family_id, t201.appln_filing_year)
-            .order_by(t201.appln_id, t201.appln_filing_year)
+            .order_by(t201.docdb_family_id, t201.appln_id)
         )
-        results = query.all()
-        # if resutl is empty
-        if not results:
-            return pd.Series([], dtype="int64")
-
-        df_family_ids = pd.DataFrame(results)
-        # Remove duplicates
-        df_unique_family_ids = df_family_ids["docdb_family_id"].drop_duplicates()
-
-        # Make df as dataframe instead of serie:
-        df_unique_family_ids = pd.DataFrame(
-            df_unique_family_ids, columns=["docdb_family_id"]
+        if config.Config.columnar_fetch:
+            # fetch_columnar already streams fetch_chunk_size rows at a time
+            chunks = [fetch_columnar(db, query.statement, APPL_INVT_DTYPES)]
+        else:
+            result = db.execute(
+                query.statement.execution_options(
+                    yield_per=config.Config.fetch_chunk_size
+                )
+            )
+            # Same column dtypes as fetch_columnar, whatever the fetch mode
+            chunks = [
+                frame_from_row_chunks(
+                    result.partitions(), list(result.keys()), APPL_INVT_DTYPES
+                )
+            ]
+    finally:
+        family_ids_table.drop(db.connection())
+
+    if not chunks:
+        return pd.DataFrame()
+    if len(chunks) == 1:
+        return chunks[0].drop_duplicates()
+    return pd.concat(chunks, ignore_index=True).drop_duplicates()
+
+
+def _fetch_applicant_inventor_batch(batch: list[int], db) -> pd.DataFrame:
+    """Fetch the applicant/inventor rows of one batch of family IDs."""
+    query = (
+        _applicant_inventor_query(db)
+        .where(t201.docdb_family_id.in_(batch))
+        .order_by(t201.docdb_family_id, t201.appln_id)
+    )
+    return _fetch_dataframe(db, query, APPL_INVT_DTYPES).drop_duplicates()
+
+
+def _iter_applicant_inventor_batches(
+    batches: list[list[int]], db, run: Optional[ExtractionRun] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Fetch all batches, sequentially on db or concurrently on
+    config.Config.extraction_workers pooled sessions.
+
+    At most two batches per worker are in flight, so a slow consumer (e.g. spilling
+    to disk) bounds how many fetched batches wait in memory. With a run, every
+    fetched batch is checkpointed as soon as it arrives and batches checkpointed by
+    an earlier attempt are read back instead of queried.
+
+    Yields:
+        pd.DataFrame: One DataFrame per batch, in the same order as batches.
+    """
+
+    def fetch(index: int, batch_db) -> pd.DataFrame:
+        if run is not None and run.is_completed(index):
+            return run.load_batch(index)
+        df_batch = _fetch_applicant_inventor_batch(batches[index], batch_db)
+        if run is not None:
+            run.save_batch(index, df_batch)
+        return df_batch
+
+    max_workers = min(config.Config.extraction_workers, len(batches))
+    if max_workers <= 1:
+        for index in range(len(batches)):
+            yield fetch(index, db)
+        return
+
+    pool_capacity = config.Config.db_pool_size + config.Config.db_max_overflow
+    if max_workers > pool_capacity:
+        logger.warning(
+            f"extraction_workers={max_workers} exceeds the connection pool capacity "
+            f"({pool_capacity}); workers will wait for free connections"
         )
-        return df_unique_family_ids
+
+    def fetch_on_own_session(index: int) -> pd.DataFrame:
+        # Sessions are not thread-safe, each worker checks out its own connection
+        with session_scope() as worker_db:
+            return fetch(index, worker_db)
+
+    # Futures are consumed in submission order, so families stay in input order
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for index in range(len(batches)):
+            pending.append(executor.submit(fetch_on_own_session, index))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _fetch_applicant_inventor_batches(
+    batches: list[list[int]], db, run: Optional[ExtractionRun] = None
+) -> list[pd.DataFrame]:
+    """All batches of _iter_applicant_inventor_batches, in the same order as batches."""
+    return list(_iter_applicant_inventor_batches(batches, db, run))
 
 
-def get_applicant_inventor(family_ids_list: list[int]):
+def get_applicant_inventor(family_ids_list: list[int], db=None):
     """
     Retrieves applicants and inventors for the given family IDs.
 
+    The extraction strategy follows config.Config.extraction_mode:
+        - "batch": one IN-list query per config.Config.batch_size family IDs, run on
+          config.Config.extraction_workers concurrent connections. With
+          config.Config.checkpoint_extraction, or from config.Config.checkpoint_min_batches
+          batches up, each batch is checkpointed, so rerunning a failed extraction of
+          the same families only fetches the missing batches.
+        - "temp_table": load all family IDs once into a session temp table and
+          run a single join against it.
+
     Args:
         family_ids_list (list[int]): List of docdb_family_id values to filter by.
+        db: Optional SQLAlchemy session; a pooled session is opened when omitted.
 
     Returns:
         pd.DataFrame: A DataFrame containing applicant and inventor details.
     """
+    if db is None:
+        with session_scope() as db:
+            return get_applicant_inventor(family_ids_list, db)
+
     try:
         if not family_ids_list or not all(isinstance(i, int) for i in family_ids_list):
             raise ValueError("Family IDs must be a non-empty list of integers.")
 
-        # Using batch for long dataset
-        batch_size = config.Config.batch_size
-        batches = [
-            family_ids_list[i : i + batch_size]
-            for i in range(0, len(family_ids_list), batch_size)
-        ]
+        extraction_mode = config.Config.extraction_mode
+        if extraction_mode == "temp_table":
+            df_appl_invt = _get_applicant_inventor_temp_table(family_ids_list, db)
+        elif extraction_mode == "batch":
+            # Using batch for long dataset
+            batch_size = config.Config.batch_size
+            batches = [
+                family_ids_list[i : i + batch_size]
+                for i in range(0, len(family_ids_list), batch_size)
+            ]
 
-        df_appl_invt = pd.DataFrame()
-        all_batches = []
-        for batch in batches:
-            query = (
-                db.query(
-                    t201.docdb_family_id,
-                    t201.appln_id,
-                    t201.appln_filing_year,
-                    t201.appln_auth,
-                    t201.appln_nr,
-                    t201.docdb_family_size,
-                    t201.earliest_publn_date,
-                    t201.nb_applicants,
-                    t201.nb_inventors,
-                    t206.person_ctry_code,
-                    t206.person_name,
-                    t206.person_id,
-                    t206.doc_std_name_id,
-                    t206.psn_sector,
-                    t207.applt_seq_nr,
-                    t207.invt_seq_nr,
-                )
-                .join(t207, t201.appln_id == t207.appln_id)
-                .join(t206, t207.person_id == t206.person_id)
-                .where(t201.docdb_family_id.in_(batch))
-                .order_by(t201.docdb_family_id, t201.appln_id)
-            )
-            results = query.all()
-            df_batch = pd.DataFrame(results).drop_duplicates()
-            all_batches.append(df_batch)
+            # Checkpoint every batch of long extractions, a failed run resumes from the missing ones
+            run = checkpointed_run(batches)
+            all_batches = _fetch_applicant_inventor_batches(batches, db, run)
+            if run is not None:
+                run.verify()
             df_appl_invt = (
                 pd.concat(all_batches, ignore_index=True)
                 if all_batches
                 else pd.DataFrame()
             )
+            if run is not None:
+                run.remove()
+        else:
+            raise ValueError(
+                f"Unknown extraction mode: {extraction_mode} (expected 'batch' or 'temp_table')."
+            )
 
     except Exception as e:
         logger.error(f"Error fetching applicant/inventor data: {str(e)}")
@@ -182,6 +720,189 @@ def get_applicant_inventor(family_ids_list: list[int]):
     return df_appl_invt
 
 
+def spill_applicant_inventor(family_ids_list: list[int], path: Path, db=None) -> int:
+    """
+    Stream the applicants and inventors of the given families to a Parquet file,
+    one extraction batch at a time, instead of building the whole frame in memory.
+
+    Always uses "batch" extraction (config.Config.batch_size families per query, on
+    config.Config.extraction_workers connections); each batch is written as soon as
+    it arrives and then released. Read the file back with spill_store.iter_family_chunks.
+
+    Args:
+        family_ids_list (list[int]): List of docdb_family_id values to filter by.
+        path (Path): Parquet file to write; only created once every batch succeeded.
+        db: Optional SQLAlchemy session; a pooled session is opened when omitted.
+
+    Returns:
+        int: Number of rows written.
+    """
+    if db is None:
+        with session_scope() as db:
+            return spill_applicant_inventor(family_ids_list, path, db)
+
+    if not family_ids_list or not all(isinstance(i, int) for i in family_ids_list):
+        raise ValueError("Family IDs must be a non-empty list of integers.")
+
+    batch_size = config.Config.batch_size
+    batches = [
+        family_ids_list[i : i + batch_size]
+        for i in range(0, len(family_ids_list), batch_size)
+    ]
+    run = checkpointed_run(batches)
+    try:
+        with ParquetSpill(path, APPL_INVT_DTYPES) as spill:
+            for df_batch in _iter_applicant_inventor_batches(batches, db, run):
+                spill.append(df_batch)
+            if run is not None:
+                run.verify()
+    except Exception as e:
+        logger.error(f"Error spilling applicant/inventor data: {str(e)}")
+        raise
+    if run is not None:
+        run.remove()
+    return spill.rows
+
+
+def get_partitioned_extract(
+    country_code: str, start_year: int, end_year: int, use_cache: bool = True
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Extract family IDs and applicant/inventor rows from per (country, filing year)
+    cache partitions, querying PATSTAT only for the years not cached yet.
+
+    A family filed in several years is stored in each of these partitions; the union
+    is deduplicated, so widening 2015-2019 to 2015-2020 only extracts 2020.
+
+    Args:
+        country_code (str): 2-letter country code.
+        start_year (int): First filing year.
+        end_year (int): Last filing year.
+        use_cache (bool): Read and write the partition cache; when False every year
+            is extracted and nothing is saved.
+
+    Returns:
+        tuple: (df_unique_family_ids, df_appl_invt) for the whole year range.
+    """
+    years = range(start_year, end_year + 1)
+    partitions = {
+        year: load_frames(partition_key_parts(country_code, year)) if use_cache else None
+        for year in years
+    }
+    missing_years = [year for year, frames in partitions.items() if frames is None]
+
+    if missing_years:
+        logger.info(
+            f"Extracting {country_code} partitions for filing years {missing_years}"
+        )
+        with session_scope() as db:
+            df_family_years = get_family_years(
+                country_code, min(missing_years), max(missing_years), db
+            )
+            df_family_years = df_family_years[
+                df_family_years["appln_filing_year"].isin(missing_years)
+            ]
+            family_ids_list = (
+                df_family_years["docdb_family_id"].drop_duplicates().tolist()
+            )
+            if family_ids_list:
+                df_new_appl_invt = get_applicant_inventor(family_ids_list, db)
+            else:
+                df_new_appl_invt = pd.DataFrame(
+                    {
+                        column: pd.Series([], dtype=dtype)
+                        for column, dtype in APPL_INVT_DTYPES.items()
+                    }
+                )
+
+        # Split the new rows into one partition per filing year
+        for year in missing_years:
+            df_year_family_ids = (
+                df_family_years.loc[
+                    df_family_years["appln_filing_year"] == year, ["docdb_family_id"]
+                ]
+                .drop_duplicates()
+                .reset_index(drop=True)
+            )
+            frames = {
+                "df_unique_family_ids": df_year_family_ids,
+                "df_appl_invt": df_new_appl_invt[
+                    df_new_appl_invt["docdb_family_id"].isin(
+                        df_year_family_ids["docdb_family_id"]
+                    )
+                ].reset_index(drop=True),
+            }
+            if use_cache:
+                save_frames(partition_key_parts(country_code, year), frames)
+            partitions[year] = frames
+
+    # Union of all partitions, recomputed downstream as one dataset
+    df_unique_family_ids = (
+        pd.concat(
+            [partitions[year]["df_unique_family_ids"] for year in years],
+            ignore_index=True,
+        )
+        .drop_duplicates()
+        .reset_index(drop=True)
+    )
+    df_appl_invt = (
+        pd.concat(
+            [partitions[year]["df_appl_invt"] for year in years], ignore_index=True
+        )
+        .drop_duplicates()
+        .reset_index(drop=True)
+    )
+    return df_unique_family_ids, df_appl_invt
+
+
+def get_spilled_extract(
+    country_code: str, start_year: int, end_year: int, use_cache: bool = True
+) -> tuple[pd.DataFrame, Optional[Path]]:
+    """
+    Extract family IDs and spill the applicant/inventor rows to a Parquet file in
+    config.Config.spill_dir (see spill_applicant_inventor). The files are registered
+    in the extract cache (see extract_cache.register_files), so they are evicted and
+    invalidated like any cached extract; with use_cache, files spilled earlier for
+    the same country, years, database, query version and PATSTAT edition are reused.
+
+    Args:
+        country_code (str): 2-letter country code.
+        start_year (int): First filing year.
+        end_year (int): Last filing year.
+        use_cache (bool): Reuse a registered spill instead of extracting again.
+
+    Returns:
+        tuple: (df_unique_family_ids, path of the spilled df_appl_invt), or an empty
+        frame and None when no family IDs match.
+    """
+    key_parts = {**extract_key_parts(country_code, start_year, end_year), "spilled": True}
+    if use_cache:
+        files = load_files(key_parts)
+        if files is not None:
+            logger.info(f"Reusing spilled extract {files['appl_invt']}")
+            return pd.read_parquet(files["family_ids"]), files["appl_invt"]
+
+    spill_key = make_cache_key(key_parts)
+    spill_dir = Path(config.Config.spill_dir)
+    family_ids_path = spill_dir / f"{spill_key}.family_ids.parquet"
+    appl_invt_path = spill_dir / f"{spill_key}.appl_invt.parquet"
+
+    with session_scope() as db:
+        df_unique_family_ids = get_family_ids(country_code, start_year, end_year, db)
+        if df_unique_family_ids.empty:
+            return df_unique_family_ids, None
+        spill_applicant_inventor(
+            df_unique_family_ids["docdb_family_id"].tolist(), appl_invt_path, db
+        )
+
+    # Registered last: the entry marks a complete spill
+    df_unique_family_ids.to_parquet(family_ids_path, index=False)
+    register_files(
+        key_parts, {"family_ids": family_ids_path, "appl_invt": appl_invt_path}
+    )
+    return df_unique_family_ids, appl_invt_path
+
+
 def aggregate_applicants_inventors(df: pd.DataFrame) -> pd.DataFrame:
     """
     Function to aggregate applicants, inventors, and application IDs for each docdb_family_id.
@@ -196,8 +917,11 @@ def aggregate_applicants_inventors(df: pd.DataFrame) -> pd.DataFrame:
         name = "".join(c for c in unicodedata.normalize("NFKD", name) if c.isascii())
         return name.title()
 
-    # Apply normalization to person_name
-    df["person_name_normalized"] = df["person_name"].apply(normalize_name)
+    # Apply normalization to person_name, on a new frame so the input is left
+    # untouched (it is shared with stages running concurrently)
+    df = df[
+        ["docdb_family_id", "appln_id", "person_name", "invt_seq_nr", "applt_seq_nr"]
+    ].assign(person_name_normalized=df["person_name"].map(normalize_name))
 
     # Extract inventors and applicants
     inventors_df = df[df["invt_seq_nr"] >= 1][
@@ -245,11 +969,56 @@ def aggregate_applicants_inventors(df: pd.DataFrame) -> pd.DataFrame:
     return df_appl_invt_agg
 
 
+def count_matrices(
+    df_applicant_counts: pd.DataFrame,
+    df_inventor_counts: pd.DataFrame,
+    df_combined_counts: pd.DataFrame,
+) -> dict:
+    """
+    Applicant, inventor and combined counts as FamilyCountryMatrix on shared axes,
+    built once per run and read by the ratios and the plots.
+
+    Returns:
+        dict: "applicant", "inventor" and "combined" -> FamilyCountryMatrix.
+    """
+    return shared_matrices(
+        {
+            "applicant": (df_applicant_counts, "applicant_count"),
+            "inventor": (df_inventor_counts, "inventor_count"),
+            "combined": (df_combined_counts, "combined_count"),
+        }
+    )
+
+
+def indiv_non_indiv_matrices(
+    df_invt_indiv_counts: pd.DataFrame,
+    df_invt_non_indiv_counts: pd.DataFrame,
+    df_appl_non_indiv_counts: pd.DataFrame,
+    df_appl_indiv_counts: pd.DataFrame,
+) -> dict:
+    """
+    Individual/non-individual counts as FamilyCountryMatrix on shared axes.
+
+    Returns:
+        dict: "invt_indiv", "invt_non_indiv", "appl_non_indiv" and "appl_indiv"
+        -> FamilyCountryMatrix.
+    """
+    return shared_matrices(
+        {
+            "invt_indiv": (df_invt_indiv_counts, "invt_indiv_count"),
+            "invt_non_indiv": (df_invt_non_indiv_counts, "invt_non_indiv_count"),
+            "appl_non_indiv": (df_appl_non_indiv_counts, "appl_non_indiv_count"),
+            "appl_indiv": (df_appl_indiv_counts, "appl_indiv_count"),
+        }
+    )
+
+
 # Calculate ratios
 def calculate_applicants_inventors_ratios(
     df_applicant_counts: pd.DataFrame,
     df_inventor_counts: pd.DataFrame,
     df_combined_counts: pd.DataFrame,
+    matrices: Optional[dict] = None,
 ) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """
     Calculate applicant, inventor, and combined ratios using pre-calculated counts.
@@ -258,132 +1027,222 @@ def calculate_applicants_inventors_ratios(
         df_applicant_counts (pd.DataFrame): DataFrame with applicant counts
         df_inventor_counts (pd.DataFrame): DataFrame with inventor counts
         df_combined_counts (pd.DataFrame): DataFrame with combined counts
+        matrices (Optional[dict]): Output of count_matrices for these counts,
+            built here when not given.
 
     Returns:
         tuple: (df_applicant_ratios, df_inventor_ratios, df_combined_ratios)
     """
+    if matrices is None:
+        matrices = count_matrices(
+            df_applicant_counts, df_inventor_counts, df_combined_counts
+        )
 
     def calculate_ratio(
-        df: pd.DataFrame, count_column: str, ratio_column: str
+        df: pd.DataFrame, role: str, count_column: str, ratio_column: str
     ) -> pd.DataFrame:
-        # Step 1: Calculate total count per docdb_family_id
-        total_counts = (
-            df.groupby("docdb_family_id")[count_column]
-            .sum()
-            .reset_index(name="total_count")
-        )
-
-        # Step 2: Merge total counts back into the original DataFrame
-        df = pd.merge(df, total_counts, on="docdb_family_id", how="left")
-
-        # Step 3: Calculate the ratio
-        df[ratio_column] = df[count_column] / df["total_count"]
+        # Step 1: Total count per docdb_family_id as sparse row sums
+        matrix = matrices[role]
+        rows = np.searchsorted(matrix.families, df["docdb_family_id"].to_numpy())
+        total_count = matrix.row_sums()[rows]
+
+        # Step 2: Calculate the ratio, keeping the row order of the counts
+        counts = df[count_column].to_numpy(dtype=np.float64)
+        df = df[["docdb_family_id", "person_ctry_code"]].reset_index(drop=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            df[ratio_column] = counts / total_count
         df[ratio_column] = df[ratio_column].fillna(0)
 
-        # Step 4: Keep only relevant columns
+        # Step 3: Keep only relevant columns
         return df[["docdb_family_id", "person_ctry_code", ratio_column]]
 
     # Step 1: Calculate applicant ratios
     df_applicant_ratios = calculate_ratio(
         df_applicant_counts,
+        "applicant",
         count_column="applicant_count",
         ratio_column="applicant_ratio",
     )
 
     # Step 2: Calculate inventor ratios
     df_inventor_ratios = calculate_ratio(
-        df_inventor_counts, count_column="inventor_count", ratio_column="inventor_ratio"
+        df_inventor_counts,
+        "inventor",
+        count_column="inventor_count",
+        ratio_column="inventor_ratio",
     )
 
     # Step 3: Calculate combined ratios
     df_combined_ratios = calculate_ratio(
-        df_combined_counts, count_column="combined_count", ratio_column="combined_ratio"
+        df_combined_counts,
+        "combined",
+        count_column="combined_count",
+        ratio_column="combined_ratio",
     )
 
     return df_applicant_ratios, df_inventor_ratios, df_combined_ratios
 
 
-###### Calculate Counts
-def calculate_applicants_inventors_counts(
-    df: pd.DataFrame,
-) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+# Sort keys (all descending) ranking the applications of a family for each role
+REPRESENTATIVE_APPLN_SORT = {
+    "inventor": ["nb_inventors", "nb_applicants", "earliest_publn_date"],
+    "applicant": ["nb_applicants", "nb_inventors", "earliest_publn_date"],
+}
+
+
+def clean_person_ctry_code(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Calculate counts of applicants, inventors, and combined per country per docdb_family_id.
+    Strip person_ctry_code and return the rows with a non-empty country code.
 
     Args:
-        df (pd.DataFrame): DataFrame with applicant/inventor data (e.g., from get_applicant_inventor)
+        df (pd.DataFrame): DataFrame with applicant/inventor data; it is not modified.
 
     Returns:
-        tuple: (df_applicant_counts, df_inventor_counts, df_combined_counts)
-        Each DataFrame has columns: docdb_family_id, person_ctry_code, {type}_count
+        pd.DataFrame: Copy of the rows with a valid person_ctry_code, stripped.
     """
+    ctry_codes = df["person_ctry_code"]
+    if isinstance(ctry_codes.dtype, pd.CategoricalDtype) and (
+        ctry_codes.cat.categories == ctry_codes.cat.categories.str.strip()
+    ).all():
+        # Already stripped at ingest (compact_appl_invt), only filter
+        return df[ctry_codes.notna() & (ctry_codes != "")]
+
+    ctry_codes = ctry_codes.astype(str).str.strip()
+    valid = (
+        ctry_codes.notna()  # Remove NaN
+        & (ctry_codes != "")  # Remove empty string
+        & (ctry_codes.str.len() > 0)  # Ensure length > 0 after stripping
+    )
+    return df[valid].assign(person_ctry_code=ctry_codes[valid])
 
-    # Step 1: Clean person_ctry_code
-    df["person_ctry_code"] = df["person_ctry_code"].astype(str).str.strip()
-    df_cleaned = df[
-        df["person_ctry_code"].notna()  # Remove NaN
-        & (df["person_ctry_code"] != "")  # Remove empty string
-        & (df["person_ctry_code"] != " ")  # Remove single space
-        & (df["person_ctry_code"].str.len() > 0)  # Ensure length > 0 after stripping
-    ].copy()
 
-    # Step 2: Inventor Counts
-    # Step 1: Filter rows with inventors (invt_seq_nr > 0)
-    inventor_data = df_cleaned[df_cleaned["invt_seq_nr"] > 0].copy()
-
-    # Step 2: Select the application with max nb_inventors, max nb_applicants, and latest earliest_publn_date
-    selected_appln = (
-        inventor_data.groupby("docdb_family_id")
-        .apply(
-            lambda x: x.sort_values(
-                by=["nb_inventors", "nb_applicants", "earliest_publn_date"],
-                ascending=[False, False, False],
-            ).iloc[
-                0
-            ]  # Take the top row after sorting
-        )
+def _select_best_applns(
+    role_data: pd.DataFrame, role: str, group_columns: list[str]
+) -> pd.DataFrame:
+    """
+    Keep the top-ranked application of each group with one sort and drop_duplicates,
+    instead of sorting every group in a Python-level groupby().apply().
+    appln_id (ascending) breaks ties deterministically.
+    """
+    sort_columns = REPRESENTATIVE_APPLN_SORT[role]
+    ranked = role_data.sort_values(
+        by=group_columns + sort_columns + ["appln_id"],
+        ascending=[True] * len(group_columns) + [False] * len(sort_columns) + [True],
+        kind="stable",
+    )
+    return (
+        ranked.drop_duplicates(subset=group_columns)[["docdb_family_id", "appln_id"]]
+        .drop_duplicates()
         .reset_index(drop=True)
     )
 
-    # Step 3: Extract the selected appln_ids for each docdb_family_id
-    selected_appln_ids = selected_appln[["docdb_family_id", "appln_id"]]
 
-    # Step 4: Merge back to get the inventor details for the selected appln_ids
-    selected_inventors = inventor_data.merge(
-        selected_appln_ids, on=["docdb_family_id", "appln_id"]
-    )
+def select_representative_applns(df_cleaned: pd.DataFrame) -> dict:
+    """
+    Select the representative ("best") application of each family for every role, once,
+    so all count functions can share the result.
 
-    # Step 5: Count distinct inventors (person_id) per country (person_ctry_code) for each family
-    df_inventor_counts = (
-        selected_inventors.groupby(["docdb_family_id", "person_ctry_code"])["person_id"]
+    Args:
+        df_cleaned (pd.DataFrame): Applicant/inventor rows with a valid person_ctry_code
+            (see clean_person_ctry_code).
+
+    Returns:
+        dict: DataFrames of (docdb_family_id, appln_id) keyed by:
+            - "inventor": best inventor application per family
+            - "applicant": best applicant application per family
+            - "applicant_by_country": best applicant application per family and country
+    """
+    inventor_data = df_cleaned[df_cleaned["invt_seq_nr"] > 0]
+    applicant_data = df_cleaned[df_cleaned["applt_seq_nr"] > 0]
+    return {
+        "inventor": _select_best_applns(inventor_data, "inventor", ["docdb_family_id"]),
+        "applicant": _select_best_applns(
+            applicant_data, "applicant", ["docdb_family_id"]
+        ),
+        "applicant_by_country": _select_best_applns(
+            applicant_data, "applicant", ["docdb_family_id", "person_ctry_code"]
+        ),
+    }
+
+
+def _count_persons(data: pd.DataFrame, count_column: str) -> pd.DataFrame:
+    """Count distinct person_id per docdb_family_id and person_ctry_code."""
+    df_counts = (
+        data.groupby(["docdb_family_id", "person_ctry_code"], observed=True)["person_id"]
         .nunique()
-        .reset_index(name="inventor_count")
+        .reset_index(name=count_column)
     )
+    # Small output frame: plain country strings for plots, CSVs and the SQL engine parity
+    return df_counts.astype({"person_ctry_code": object})
 
-    # Display the result (optional: filter for a specific family for verification)
-    print("Inventor counts per country for each patent family:")
-    print(df_inventor_counts)
 
-    # Step 3: Applicant Counts
-    applicant_data = df_cleaned[df_cleaned["applt_seq_nr"] > 0].copy()
-
-    # Step 3: Select the "best" application per family
-    # Sort by nb_applicants (descending), nb_inventors (descending), and earliest_publn_date (descending)
-    selected_appln = (
-        applicant_data.groupby(["docdb_family_id", "person_ctry_code"])
-        .apply(
-            lambda x: x.sort_values(
-                by=["nb_applicants", "nb_inventors", "earliest_publn_date"],
-                ascending=[False, False, False],
-            ).iloc[
-                0
-            ]  # Take the top row
-        )
-        .reset_index(drop=True)
+def _combine_counts(
+    df_applicant_counts: pd.DataFrame, df_inventor_counts: pd.DataFrame
+) -> pd.DataFrame:
+    """Sum applicant and inventor counts per docdb_family_id and person_ctry_code."""
+    return (
+        pd.concat(
+            [
+                df_inventor_counts[
+                    ["docdb_family_id", "person_ctry_code", "inventor_count"]
+                ].rename(columns={"inventor_count": "combined_count"}),
+                df_applicant_counts[
+                    ["docdb_family_id", "person_ctry_code", "applicant_count"]
+                ].rename(columns={"applicant_count": "combined_count"}),
+            ]
+        )
+        .groupby(["docdb_family_id", "person_ctry_code"], observed=True)
+        .sum()
+        .reset_index()
+    )
+
+
+###### Calculate Counts
+def calculate_applicants_inventors_counts(
+    df: pd.DataFrame,
+    representative_applns: Optional[dict] = None,
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Calculate counts of applicants, inventors, and combined per country per docdb_family_id.
+
+    Args:
+        df (pd.DataFrame): DataFrame with applicant/inventor data (e.g., from get_applicant_inventor)
+        representative_applns (Optional[dict]): Output of select_representative_applns,
+            computed here when not given.
+
+    Returns:
+        tuple: (df_applicant_counts, df_inventor_counts, df_combined_counts)
+        Each DataFrame has columns: docdb_family_id, person_ctry_code, {type}_count
+    """
+
+    # Step 1: Clean person_ctry_code
+    df_cleaned = clean_person_ctry_code(df)
+    if representative_applns is None:
+        representative_applns = select_representative_applns(df_cleaned)
+
+    # Step 2: Inventor Counts
+    # Step 1: Filter rows with inventors (invt_seq_nr > 0)
+    inventor_data = df_cleaned[df_cleaned["invt_seq_nr"] > 0]
+
+    # Step 2-3: appln_ids with max nb_inventors, max nb_applicants, and latest earliest_publn_date
+    selected_appln_ids = representative_applns["inventor"]
+
+    # Step 4: Merge back to get the inventor details for the selected appln_ids
+    selected_inventors = inventor_data.merge(
+        selected_appln_ids, on=["docdb_family_id", "appln_id"]
     )
 
-    # Step 4: Extract selected appln_ids for merging
-    selected_appln_ids = selected_appln[["docdb_family_id", "appln_id"]]
+    # Step 5: Count distinct inventors (person_id) per country (person_ctry_code) for each family
+    df_inventor_counts = _count_persons(selected_inventors, "inventor_count")
+
+    logger.debug("Inventor counts per country for each patent family:\n%s", df_inventor_counts)
+
+    # Step 3: Applicant Counts
+    applicant_data = df_cleaned[df_cleaned["applt_seq_nr"] > 0]
+
+    # Step 3-4: appln_ids of the "best" application per family and country
+    # Sorted by nb_applicants (descending), nb_inventors (descending), and earliest_publn_date (descending)
+    selected_appln_ids = representative_applns["applicant_by_country"]
 
     # Step 5: Merge back to get all applicant records for the selected applications
     selected_applicants = applicant_data.merge(
@@ -391,43 +1250,177 @@ def calculate_applicants_inventors_counts(
     )
 
     # Step 6: Count distinct applicants (person_id) per country (person_ctry_code) for each family
-    df_applicant_counts = (
-        selected_applicants.groupby(["docdb_family_id", "person_ctry_code"])[
-            "person_id"
-        ]
-        .nunique()
-        .reset_index(name="applicant_count")
-    )
+    df_applicant_counts = _count_persons(selected_applicants, "applicant_count")
 
-    # Step 7: Display the results
-    print("Number of distinct applicants per patent family:")
-    print(df_applicant_counts)
+    logger.debug("Number of distinct applicants per patent family:\n%s", df_applicant_counts)
 
     # Step 4: Combined Counts
-    df_combined_counts = (
-        pd.concat(
-            [
-                df_inventor_counts[
-                    ["docdb_family_id", "person_ctry_code", "inventor_count"]
-                ].rename(columns={"inventor_count": "combined_count"}),
-                df_applicant_counts[
-                    ["docdb_family_id", "person_ctry_code", "applicant_count"]
-                ].rename(columns={"applicant_count": "combined_count"}),
-            ]
+    df_combined_counts = _combine_counts(df_applicant_counts, df_inventor_counts)
+
+    return df_applicant_counts, df_inventor_counts, df_combined_counts
+
+
+def _role_counts_select(family_ids_table: Table, role: str):
+    """
+    Build the SQL counting distinct persons per docdb_family_id and country for one role,
+    on the representative application(s) of each family:
+        - inventor: best application per family by nb_inventors, nb_applicants,
+          earliest_publn_date (all descending).
+        - applicant: best application per family and country by nb_applicants,
+          nb_inventors, earliest_publn_date (all descending).
+    This mirrors the selection done in pandas by calculate_applicants_inventors_counts,
+    with appln_id as a deterministic tie-breaker.
+    """
+    if role == "inventor":
+        seq_nr = t207.invt_seq_nr
+        rank_order = [t201.nb_inventors.desc(), t201.nb_applicants.desc()]
+    else:
+        seq_nr = t207.applt_seq_nr
+        rank_order = [t201.nb_applicants.desc(), t201.nb_inventors.desc()]
+    rank_order += [t201.earliest_publn_date.desc(), t201.appln_id]
+
+    # Same cleaning as the pandas path: strip person_ctry_code and drop empty codes
+    person_ctry_code = func.ltrim(func.rtrim(t206.person_ctry_code))
+    rank_partition = [t201.docdb_family_id]
+    if role == "applicant":
+        rank_partition.append(person_ctry_code)
+
+    role_rows = (
+        select(
+            t201.docdb_family_id,
+            t201.appln_id,
+            t207.person_id,
+            person_ctry_code.label("person_ctry_code"),
+            func.row_number()
+            .over(partition_by=rank_partition, order_by=rank_order)
+            .label("appln_rank"),
         )
-        .groupby(["docdb_family_id", "person_ctry_code"])
-        .sum()
-        .reset_index()
+        .join_from(t201, t207, t201.appln_id == t207.appln_id)
+        .join(t206, t207.person_id == t206.person_id)
+        .join(
+            family_ids_table,
+            t201.docdb_family_id == family_ids_table.c.docdb_family_id,
+        )
+        .where(seq_nr > 0, person_ctry_code != "")
+        .cte(f"{role}_rows")
     )
 
-    # Calculate ratios
-    calculate_applicants_inventors_ratios(
-        df_applicant_counts, df_inventor_counts, df_combined_counts
+    selected_applns = (
+        select(role_rows.c.docdb_family_id, role_rows.c.appln_id)
+        .where(role_rows.c.appln_rank == 1)
+        .distinct()
+        .cte(f"{role}_selected_applns")
     )
 
+    return (
+        select(
+            literal(role).label("role"),
+            role_rows.c.docdb_family_id,
+            role_rows.c.person_ctry_code,
+            func.count(distinct(role_rows.c.person_id)).label("person_count"),
+        )
+        .join_from(
+            role_rows,
+            selected_applns,
+            and_(
+                role_rows.c.docdb_family_id == selected_applns.c.docdb_family_id,
+                role_rows.c.appln_id == selected_applns.c.appln_id,
+            ),
+        )
+        .group_by(role_rows.c.docdb_family_id, role_rows.c.person_ctry_code)
+    )
+
+
+def calculate_applicants_inventors_counts_sql(
+    family_ids_list: list[int], db=None
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Calculate the same counts as calculate_applicants_inventors_counts, but inside the
+    database: representative application selection (window functions) and
+    COUNT(DISTINCT person_id) per family and country run in one SQL statement, so only
+    the aggregated (family, country, count) rows are transferred.
+
+    Args:
+        family_ids_list (list[int]): List of docdb_family_id values to count.
+        db: Optional SQLAlchemy session; a pooled session is opened when omitted.
+
+    Returns:
+        tuple: (df_applicant_counts, df_inventor_counts, df_combined_counts)
+        Each DataFrame has columns: docdb_family_id, person_ctry_code, {type}_count
+    """
+    if db is None:
+        with session_scope() as db:
+            return calculate_applicants_inventors_counts_sql(family_ids_list, db)
+
+    family_ids_table = _load_family_ids_temp_table(db, family_ids_list)
+    try:
+        statement = union_all(
+            _role_counts_select(family_ids_table, "inventor"),
+            _role_counts_select(family_ids_table, "applicant"),
+        )
+        df_counts = fetch_columnar(
+            db,
+            statement,
+            {"role": "object", "docdb_family_id": "int64", "person_count": "int64"},
+        )
+    finally:
+        family_ids_table.drop(db.connection())
+
+    def role_counts(role: str, count_column: str) -> pd.DataFrame:
+        return (
+            df_counts.loc[
+                df_counts["role"] == role,
+                ["docdb_family_id", "person_ctry_code", "person_count"],
+            ]
+            .rename(columns={"person_count": count_column})
+            .sort_values(["docdb_family_id", "person_ctry_code"])
+            .reset_index(drop=True)
+        )
+
+    df_inventor_counts = role_counts("inventor", "inventor_count")
+    df_applicant_counts = role_counts("applicant", "applicant_count")
+    df_combined_counts = _combine_counts(df_applicant_counts, df_inventor_counts)
     return df_applicant_counts, df_inventor_counts, df_combined_counts
 
 
+# Define all expected PATSTAT psn_sector categories
+VALID_SECTORS = {
+    "INDIVIDUAL": "INDIVIDUAL",
+    "COMPANY": "NON_INDIVIDUAL",
+    "UNIVERSITY": "NON_INDIVIDUAL",
+    "GOV NON-PROFIT": "NON_INDIVIDUAL",
+    "GOVERNMENT": "NON_INDIVIDUAL",
+    "HOSPITAL": "NON_INDIVIDUAL",
+    "UNKNOWN": None,  # Trigger prediction for 'UNKNOWN'
+    "": None,  # Trigger prediction for empty string
+}
+
+NON_INDIV_KEYWORDS = [
+    "AS",
+    "ASA",
+    "INC",
+    "LTD",
+    "LLC",
+    "GMBH",
+    "SA",
+    "AG",
+    "CORP",
+    "NV",
+    "AB",
+    "UNIVERSITY",
+    "SCANDINAVIA",
+]
+
+# One precompiled alternation for whole-word matches of any keyword
+NON_INDIV_PATTERN = re.compile(
+    r"\b(?:" + "|".join(re.escape(keyword) for keyword in NON_INDIV_KEYWORDS) + r")\b"
+)
+
+# Classification cache shared across runs: (person_name, psn_sector) -> class
+_entity_class_cache = OrderedDict()
+_entity_class_cache_lock = threading.Lock()
+
+
 def classify_entity(name: str, psn_sector: Optional[str] = None) -> str:
     """
     Classify a name as 'INDIVIDUAL' or 'NON_INDIVIDUAL' based on psn_sector or naming patterns.
@@ -439,94 +1432,115 @@ def classify_entity(name: str, psn_sector: Optional[str] = None) -> str:
     Returns:
         str: 'INDIVIDUAL' or 'NON_INDIVIDUAL'.
     """
-    # Define all expected PATSTAT psn_sector categories
-    valid_sectors = {
-        "INDIVIDUAL": "INDIVIDUAL",
-        "COMPANY": "NON_INDIVIDUAL",
-        "UNIVERSITY": "NON_INDIVIDUAL",
-        "GOV NON-PROFIT": "NON_INDIVIDUAL",
-        "GOVERNMENT": "NON_INDIVIDUAL",
-        "HOSPITAL": "NON_INDIVIDUAL",
-        "UNKNOWN": None,  # Trigger prediction for 'UNKNOWN'
-        "": None,  # Trigger prediction for empty string
-    }
-
-    # If psn_sector is provided and in valid_sectors (not None), use it
+    # If psn_sector is provided and in VALID_SECTORS (not None), use it
     if (
         psn_sector
-        and psn_sector.strip() in valid_sectors
-        and valid_sectors[psn_sector.strip()] is not None
+        and psn_sector.strip() in VALID_SECTORS
+        and VALID_SECTORS[psn_sector.strip()] is not None
     ):
-        return valid_sectors[psn_sector.strip()]
+        return VALID_SECTORS[psn_sector.strip()]
 
     # Predict based on name for missing, empty, 'UNKNOWN', or invalid psn_sector
-    name = name.strip().upper()
-    non_indiv_keywords = [
-        "AS",
-        "ASA",
-        "INC",
-        "LTD",
-        "LLC",
-        "GMBH",
-        "SA",
-        "AG",
-        "CORP",
-        "NV",
-        "AB",
-        "UNIVERSITY",
-        "SCANDINAVIA",
-    ]
     # Check for whole-word matches only
-    if any(
-        re.search(r"\b" + re.escape(keyword) + r"\b", name)
-        for keyword in non_indiv_keywords
-    ):
-        return "NON_INDIVIDUAL"
-    if "," in name:
-        parts = name.split(",")
-        if len(parts) == 2 and all(part.strip() for part in parts):
-            return "INDIVIDUAL"
-    name = name.strip().upper()
-    non_indiv_keywords = [
-        "AS",
-        "ASA",
-        "INC",
-        "LTD",
-        "LLC",
-        "GMBH",
-        "SA",
-        "AG",
-        "CORP",
-        "NV",
-        "AB",
-        "UNIVERSITY",
-        "SCANDINAVIA",
-    ]
-    # Check for whole-word matches only
-    if any(
-        re.search(r"\b" + re.escape(keyword) + r"\b", name)
-        for keyword in non_indiv_keywords
-    ):
+    if NON_INDIV_PATTERN.search(name.strip().upper()):
         return "NON_INDIVIDUAL"
-    if "," in name:
-        parts = name.split(",")
-        if len(parts) == 2 and all(part.strip() for part in parts):
-            return "INDIVIDUAL"
-
-    # Split name into parts and check for individual-like patterns
-    parts = re.split(r"[,\s]+", name)
-    if ("," in name or len(parts) >= 2) and not any(
-        part in non_indiv_keywords for part in parts
-    ):
-        if any(len(part) <= 2 for part in parts) or len(parts) <= 4:
-            return "INDIVIDUAL"
 
-    # Default to INDIVIDUAL if no clear non-individual pattern is found
+    # "Lastname, Firstname", short multi-part names and anything else without a
+    # non-individual keyword default to INDIVIDUAL
     return "INDIVIDUAL"
 
 
+def classify_entities(names: pd.Series, psn_sectors: pd.Series) -> pd.Series:
+    """
+    Vectorized classify_entity over whole columns.
+
+    Only the unique (person_name, psn_sector) pairs are classified, with vectorized
+    str operations and the precompiled NON_INDIV_PATTERN; results are mapped back to
+    the rows through the factorized codes. Classified pairs are kept in an LRU cache
+    of config.Config.entity_cache_size entries shared across runs.
+
+    Args:
+        names (pd.Series): person_name column.
+        psn_sectors (pd.Series): psn_sector column, aligned with names.
+
+    Returns:
+        pd.Series: Categorical 'INDIVIDUAL' / 'NON_INDIVIDUAL', with the index of names.
+    """
+    if names.empty:
+        return pd.Series(
+            pd.Categorical([], categories=["INDIVIDUAL", "NON_INDIVIDUAL"]),
+            index=names.index,
+        )
+
+    # Factorize each column, then the pairs of their codes
+    name_codes, unique_names = pd.factorize(names.fillna("").astype(str).to_numpy())
+    sector_codes, unique_sectors = pd.factorize(
+        psn_sectors.astype(object).fillna("").astype(str).to_numpy()
+    )
+    codes, unique_pair_codes = pd.factorize(
+        name_codes.astype(np.int64) * len(unique_sectors) + sector_codes
+    )
+    unique_pairs = pd.DataFrame(
+        {
+            "person_name": unique_names[unique_pair_codes // len(unique_sectors)],
+            "psn_sector": unique_sectors[unique_pair_codes % len(unique_sectors)],
+        }
+    )
+
+    # Look up the unique pairs in the cross-run cache
+    with _entity_class_cache_lock:
+        cached = [
+            _entity_class_cache.get(pair)
+            for pair in zip(unique_pairs["person_name"], unique_pairs["psn_sector"])
+        ]
+    unique_classes = pd.Series(cached, dtype=object)
+
+    # Classify cache misses: psn_sector first, then keyword match on the name
+    missing = unique_classes.isna().to_numpy()
+    if missing.any():
+        to_classify = unique_pairs[missing]
+        sector_classes = to_classify["psn_sector"].str.strip().map(VALID_SECTORS)
+        name_is_non_indiv = (
+            to_classify["person_name"]
+            .str.strip()
+            .str.upper()
+            .str.contains(NON_INDIV_PATTERN)
+        )
+        predicted = sector_classes.where(
+            sector_classes.notna(),
+            np.where(name_is_non_indiv, "NON_INDIVIDUAL", "INDIVIDUAL"),
+        )
+        unique_classes[missing] = predicted.to_numpy()
+
+        with _entity_class_cache_lock:
+            for pair, entity_class in zip(
+                zip(to_classify["person_name"], to_classify["psn_sector"]),
+                predicted,
+            ):
+                _entity_class_cache[pair] = entity_class
+            while len(_entity_class_cache) > config.Config.entity_cache_size:
+                _entity_class_cache.popitem(last=False)
+
+    # Refresh recency of the pairs served from the cache
+    if (~missing).any():
+        with _entity_class_cache_lock:
+            for pair in zip(
+                unique_pairs.loc[~missing, "person_name"],
+                unique_pairs.loc[~missing, "psn_sector"],
+            ):
+                if pair in _entity_class_cache:
+                    _entity_class_cache.move_to_end(pair)
+
+    entity_classes = pd.Categorical(
+        unique_classes.to_numpy()[codes],
+        categories=["INDIVIDUAL", "NON_INDIVIDUAL"],
+    )
+    return pd.Series(entity_classes, index=names.index)
+
+
 def calculate_applicants_inventors_indiv_non_indiv(
     df: pd.DataFrame,
+    representative_applns: Optional[dict] = None,
 ) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """
     Calculate counts of individual inventors, non-individual inventors, non-individual applicants,
@@ -534,6 +1548,8 @@ def calculate_applicants_inventors_indiv_non_indiv(
 
     Args:
         df (pd.DataFrame): DataFrame with applicant/inventor data (e.g., from get_applicant_inventor)
+        representative_applns (Optional[dict]): Output of select_representative_applns,
+            computed here when not given.
 
     Returns:
         tuple: (df_invt_indiv_counts, df_invt_non_indiv_counts, df_appl_non_indiv_counts, df_appl_indiv_counts)
@@ -541,50 +1557,18 @@ def calculate_applicants_inventors_indiv_non_indiv(
     """
 
     # Step 1: Clean and classify
-    df["person_ctry_code"] = df["person_ctry_code"].astype(str).str.strip()
-    df_cleaned = df[
-        df["person_ctry_code"].notna()  # Remove NaN
-        & (df["person_ctry_code"] != "")  # Remove empty string
-        & (df["person_ctry_code"] != " ")  # Remove single space
-        & (df["person_ctry_code"].str.len() > 0)  # Ensure length > 0 after stripping
-    ].copy()
+    df_cleaned = clean_person_ctry_code(df)
+    if representative_applns is None:
+        representative_applns = select_representative_applns(df_cleaned)
 
     # Step 2: Select the "best" application per docdb_family_id
     # Filter inventor data
-    inventor_data = df_cleaned[df_cleaned["invt_seq_nr"] > 0].copy()
-    selected_appln_inventors = (
-        inventor_data.groupby("docdb_family_id")
-        .apply(
-            lambda x: x.sort_values(
-                by=["nb_inventors", "nb_applicants", "earliest_publn_date"],
-                ascending=[False, False, False],
-            ).iloc[
-                0
-            ]  # Take the top row after sorting
-        )
-        .reset_index(drop=True)
-    )
-    selected_appln_ids_inventors = selected_appln_inventors[
-        ["docdb_family_id", "appln_id"]
-    ]
+    inventor_data = df_cleaned[df_cleaned["invt_seq_nr"] > 0]
+    selected_appln_ids_inventors = representative_applns["inventor"]
 
     # Filter applicant data
-    applicant_data = df_cleaned[df_cleaned["applt_seq_nr"] > 0].copy()
-    selected_appln_applicants = (
-        applicant_data.groupby("docdb_family_id")
-        .apply(
-            lambda x: x.sort_values(
-                by=["nb_applicants", "nb_inventors", "earliest_publn_date"],
-                ascending=[False, False, False],
-            ).iloc[
-                0
-            ]  # Take the top row after sorting
-        )
-        .reset_index(drop=True)
-    )
-    selected_appln_ids_applicants = selected_appln_applicants[
-        ["docdb_family_id", "appln_id"]
-    ]
+    applicant_data = df_cleaned[df_cleaned["applt_seq_nr"] > 0]
+    selected_appln_ids_applicants = representative_applns["applicant"]
 
     # Step 3: Merge back to get the filtered data
     filtered_inventor_data = inventor_data.merge(
@@ -594,38 +1578,21 @@ def calculate_applicants_inventors_indiv_non_indiv(
         selected_appln_ids_applicants, on=["docdb_family_id", "appln_id"]
     )
 
-    # Step 4: Apply classification using classify_entity
-    print("Before Classification (Filtered Inventor Data):")
-    print(
-        filtered_inventor_data[["person_name", "psn_sector"]].head(20)
-    )  # Print first 20 rows for debugging
-
-    filtered_inventor_data["psn_sector_predicted"] = filtered_inventor_data.apply(
-        lambda row: classify_entity(row["person_name"], row["psn_sector"]), axis=1
+    # Step 4: Apply classification using classify_entities
+    filtered_inventor_data["psn_sector_predicted"] = classify_entities(
+        filtered_inventor_data["person_name"], filtered_inventor_data["psn_sector"]
     )
-
-    print("\nAfter Classification (Filtered Inventor Data):")
-    print(
-        filtered_inventor_data[
-            ["person_name", "psn_sector", "psn_sector_predicted"]
-        ].head(20)
-    )  # Print first 20 rows for debugging
-
-    print("\nBefore Classification (Filtered Applicant Data):")
-    print(
-        filtered_applicant_data[["person_name", "psn_sector"]].head(20)
-    )  # Print first 20 rows for debugging
-
-    filtered_applicant_data["psn_sector_predicted"] = filtered_applicant_data.apply(
-        lambda row: classify_entity(row["person_name"], row["psn_sector"]), axis=1
+    filtered_applicant_data["psn_sector_predicted"] = classify_entities(
+        filtered_applicant_data["person_name"], filtered_applicant_data["psn_sector"]
+    )
+    logger.debug(
+        "Classified inventors:\n%s",
+        filtered_inventor_data[["person_name", "psn_sector", "psn_sector_predicted"]].head(20),
+    )
+    logger.debug(
+        "Classified applicants:\n%s",
+        filtered_applicant_data[["person_name", "psn_sector", "psn_sector_predicted"]].head(20),
     )
-
-    print("\nAfter Classification (Filtered Applicant Data):")
-    print(
-        filtered_applicant_data[
-            ["person_name", "psn_sector", "psn_sector_predicted"]
-        ].head(20)
-    )  # Print first 20 rows for debugging
 
     # Step 5: Deduplicate entities within the same docdb_family_id and person_ctry_code
     filtered_inventor_data = filtered_inventor_data.drop_duplicates(
@@ -639,42 +1606,26 @@ def calculate_applicants_inventors_indiv_non_indiv(
     # Individual Inventors
     invt_indiv_data = filtered_inventor_data[
         filtered_inventor_data["psn_sector_predicted"] == "INDIVIDUAL"
-    ].copy()
-    df_invt_indiv_counts = (
-        invt_indiv_data.groupby(["docdb_family_id", "person_ctry_code"])["person_id"]
-        .nunique()
-        .reset_index(name="invt_indiv_count")
-    )
+    ]
+    df_invt_indiv_counts = _count_persons(invt_indiv_data, "invt_indiv_count")
 
     # Non-Individual Inventors
     invt_non_indiv_data = filtered_inventor_data[
         filtered_inventor_data["psn_sector_predicted"] == "NON_INDIVIDUAL"
-    ].copy()
-    df_invt_non_indiv_counts = (
-        invt_non_indiv_data.groupby(["docdb_family_id", "person_ctry_code"])["person_id"]
-        .nunique()
-        .reset_index(name="invt_non_indiv_count")
-    )
+    ]
+    df_invt_non_indiv_counts = _count_persons(invt_non_indiv_data, "invt_non_indiv_count")
 
     # Non-Individual Applicants
     appl_non_indiv_data = filtered_applicant_data[
         filtered_applicant_data["psn_sector_predicted"] == "NON_INDIVIDUAL"
-    ].copy()
-    df_appl_non_indiv_counts = (
-        appl_non_indiv_data.groupby(["docdb_family_id", "person_ctry_code"])["person_id"]
-        .nunique()
-        .reset_index(name="appl_non_indiv_count")
-    )
+    ]
+    df_appl_non_indiv_counts = _count_persons(appl_non_indiv_data, "appl_non_indiv_count")
 
     # Individual Applicants
     appl_indiv_data = filtered_applicant_data[
         filtered_applicant_data["psn_sector_predicted"] == "INDIVIDUAL"
-    ].copy()
-    df_appl_indiv_counts = (
-        appl_indiv_data.groupby(["docdb_family_id", "person_ctry_code"])["person_id"]
-        .nunique()
-        .reset_index(name="appl_indiv_count")
-    )
+    ]
+    df_appl_indiv_counts = _count_persons(appl_indiv_data, "appl_indiv_count")
 
     # Step 7: Post-processing
     # Ensure no invalid country codes remain
@@ -783,7 +1734,146 @@ def individ_applicant(
     return df_indiv_applicant_ratio, num_families_with_indiv, ratio_only_indiv
 
 
-def female_invt_ratio(df_appl_invt: pd.DataFrame) -> pd.DataFrame:
+# First run of two or more letters, delimited by start/space/period before and by
+# space/hyphen/end after: skips initials ("J.", "J.R.") and titles ("Dr."), and keeps
+# the first part of hyphenated names ("Anne-Marie" -> "Anne")
+FIRST_NAME_PATTERN = r"(?:^|[\s.])([^\W\d_]{2,}(?:['’][^\W\d_]+)?)(?=[\s-]|$)"
+
+
+def extract_first_names(
+    person_names: pd.Series, orig_first_names: Optional[pd.Series] = None
+) -> pd.Series:
+    """
+    Extract first names from a column of "Lastname, Firstname" / "Firstname Lastname" names.
+
+    Args:
+        person_names (pd.Series): person_name values.
+        orig_first_names (pd.Series, optional): TLS226 first_name values aligned with
+            person_names; used instead of the parsed name where not empty.
+
+    Returns:
+        pd.Series: First names, "" where none could be extracted.
+    """
+    names = person_names.astype("string")
+    # The given names follow the last comma, if any
+    given_names = names.str.rsplit(",", n=1).str[-1]
+    first_names = given_names.str.extract(FIRST_NAME_PATTERN, expand=False)
+
+    if orig_first_names is not None:
+        orig = orig_first_names.astype("string").str.extract(
+            FIRST_NAME_PATTERN, expand=False
+        )
+        first_names = orig.fillna(first_names)
+
+    return first_names.fillna("").astype(object)
+
+
+def get_person_first_names(family_ids_list: list[int], db=None) -> pd.Series:
+    """
+    Look up the first names recorded in TLS226_PERSON_ORIG for the inventors of the
+    given families, with one join against a temp table of family IDs.
+
+    TLS226 is only filled for some offices and editions; persons without a
+    first name there are left out.
+
+    Args:
+        family_ids_list (list[int]): docdb_family_id values whose inventors to look up.
+        db: SQLAlchemy session; a new one is opened when omitted.
+
+    Returns:
+        pd.Series: first_name indexed by person_id.
+    """
+    if db is None:
+        with session_scope() as db:
+            return get_person_first_names(family_ids_list, db)
+
+    family_ids_table = _load_family_ids_temp_table(db, family_ids_list)
+    try:
+        query = (
+            db.query(t226.person_id, t226.person_orig_id, t226.first_name)
+            .join(t207, t226.person_id == t207.person_id)
+            .join(t201, t207.appln_id == t201.appln_id)
+            .join(
+                family_ids_table,
+                t201.docdb_family_id == family_ids_table.c.docdb_family_id,
+            )
+            .where(t207.invt_seq_nr > 0)
+            .where(t226.first_name != "")
+            .distinct()
+            .order_by(t226.person_id, t226.person_orig_id)
+        )
+        df_first_names = _fetch_dataframe(
+            db,
+            query,
+            {"person_id": "int64", "person_orig_id": "int64", "first_name": "object"},
+        )
+    finally:
+        family_ids_table.drop(db.connection())
+
+    if df_first_names.empty:
+        return pd.Series(dtype=object, name="first_name")
+    # Several sources may record a person, keep the first one
+    return df_first_names.drop_duplicates("person_id").set_index("person_id")["first_name"]
+
+
+def resolve_genders(keys, resolver: Optional[GenderizeResolver] = None) -> dict:
+    """
+    Resolve (first_name, country) pairs, serving repeats from the persistent cache.
+
+    With Config.gender_mode = "offline" the pairs are looked up in the local
+    name table instead (see gender_table.py), without any network access; the
+    table must have been built first, otherwise FileNotFoundError is raised.
+
+    Only cache misses reach Genderize.io, in batched concurrent requests (see
+    genderize_client.py); failed lookups resolve to "unknown" and are not
+    cached, so they are retried on the next run.
+
+    Args:
+        keys: Iterable of normalized (first_name, country) pairs.
+        resolver (GenderizeResolver, optional): Client for the cache misses, e.g. one
+            shared by all chunks of a run; a new one is opened and closed when omitted.
+
+    Returns:
+        dict: (first_name, country) -> (gender, probability).
+    """
+    keys = {key for key in keys if key[0]}
+
+    if config.Config.gender_mode == "offline":
+        # Local name table, no cache or network needed
+        name_table = load_name_table()
+        keys = list(keys)
+        genders, probabilities = name_table.lookup(
+            [first_name for first_name, _ in keys], [country for _, country in keys]
+        )
+        return dict(zip(keys, zip(genders, probabilities)))
+
+    cache = GenderCache()
+    resolved = cache.get_many(keys)
+    misses = keys - resolved.keys()
+    logger.info(f"Gender cache: {len(resolved)} hits, {len(misses)} misses")
+
+    if resolver is None:
+        resolver = GenderizeResolver()
+        try:
+            fetched = resolver.resolve(misses)
+        finally:
+            resolver.close()
+    else:
+        fetched = resolver.resolve(misses)
+    cache.set_many(fetched)
+    if len(fetched) < len(misses):
+        # Failed lookups read as "unknown": recompute stages built on them next run
+        skip_stage_cache(f"{len(misses) - len(fetched)} Genderize lookups failed")
+
+    resolved.update(fetched)
+    return resolved
+
+
+def female_invt_ratio(
+    df_appl_invt: pd.DataFrame,
+    db=None,
+    resolver: Optional[GenderizeResolver] = None,
+) -> pd.DataFrame:
     """
     Calculate the ratio of female inventors for each docdb_family_id and person_ctry_code.
 
@@ -794,6 +1884,9 @@ def female_invt_ratio(df_appl_invt: pd.DataFrame) -> pd.DataFrame:
             - person_name: Full name of the individual
             - person_ctry_code: Country code of the individual
             - invt_seq_nr: Sequence number indicating inventor status (> 0 for inventors)
+        db: SQLAlchemy session for the TLS226 first name lookup
+            (config.Config.use_orig_first_names); a new one is opened when omitted.
+        resolver (GenderizeResolver, optional): Passed on to resolve_genders.
 
     Returns:
         pd.DataFrame: DataFrame with columns:
@@ -804,41 +1897,63 @@ def female_invt_ratio(df_appl_invt: pd.DataFrame) -> pd.DataFrame:
             - female_ratio: Ratio of female inventors to total inventors
     """
     # Step 1: Filter to include only inventors
-    inventors_df = df_appl_invt[df_appl_invt["invt_seq_nr"] > 0].copy()
+    inventors_df = df_appl_invt[df_appl_invt["invt_seq_nr"] > 0]
 
     # Step 2: Deduplicate inventors per family
     unique_inventors_df = inventors_df.drop_duplicates(
         subset=["docdb_family_id", "person_id"]
     ).copy()
 
-    # Step 3: Define a helper function to infer gender using Genderize.io
-    def get_gender(name: str, country: str) -> tuple:
-        # Extract first name (handles "Lastname, Firstname" or "Firstname Lastname")
-        if "," in name:
-            first_name = name.split(",")[-1].strip().split()[0]
-        else:
-            first_name = name.split()[0]
-
-        # Query Genderize.io API
-        url = f"https://api.genderize.io?name={first_name}&country_id={country}"
-        response = requests.get(url).json()
-        gender = response.get("gender", "unknown")
-        probability = response.get("probability", 0)
-        if gender is None:
-            gender = "unknown"
-        return gender, probability
-
-    # Step 4: Apply gender inference with a threshold
-    threshold = 0.8
-    gender_prob = unique_inventors_df.apply(
-        lambda row: get_gender(row["person_name"], row["person_ctry_code"]),
-        axis=1,
-        result_type="expand",
-    )
-    unique_inventors_df.loc[:, ["gender", "probability"]] = gender_prob
-    unique_inventors_df.loc[:, "classification"] = unique_inventors_df.apply(
-        lambda row: row["gender"] if row["probability"] >= threshold else "unknown",
-        axis=1,
+    # Step 3: Extract first names and deduplicate (first name, country) pairs
+    orig_first_names = None
+    if config.Config.use_orig_first_names and not unique_inventors_df.empty:
+        try:
+            orig_first_names = unique_inventors_df["person_id"].map(
+                get_person_first_names(
+                    unique_inventors_df["docdb_family_id"].unique().tolist(), db
+                )
+            )
+        except SQLAlchemyError as e:
+            logger.warning(f"TLS226 first names unavailable, parsing person_name: {e}")
+            skip_stage_cache("TLS226 first names unavailable")
+    first_names = extract_first_names(
+        unique_inventors_df["person_name"], orig_first_names
+    )
+    df_keys = pd.DataFrame(
+        {
+            "first_name": first_names.str.strip().str.lower(),
+            "country": unique_inventors_df["person_ctry_code"]
+            .astype(object)
+            .fillna("")
+            .astype(str)
+            .str.strip()
+            .str.upper(),
+        }
+    )
+    df_unique_keys = df_keys.drop_duplicates()
+
+    # Step 4: Resolve each pair once, through the persistent cache
+    gender_lookup = resolve_genders(
+        df_unique_keys.itertuples(index=False, name=None), resolver
+    )
+    logger.info(
+        f"Resolved {len(df_unique_keys)} unique first names for {len(df_keys)} inventors"
+    )
+
+    threshold = config.Config.gender_threshold
+    df_lookup = pd.DataFrame(
+        [(*key, gender, probability) for key, (gender, probability) in gender_lookup.items()],
+        columns=["first_name", "country", "gender", "probability"],
+    )
+    df_keys = df_keys.merge(df_lookup, on=["first_name", "country"], how="left")
+    unique_inventors_df["gender"] = df_keys["gender"].fillna("unknown").to_numpy()
+    unique_inventors_df["probability"] = (
+        df_keys["probability"].fillna(0.0).astype(float).to_numpy()
+    )
+    unique_inventors_df["classification"] = np.where(
+        unique_inventors_df["probability"] >= threshold,
+        unique_inventors_df["gender"],
+        "unknown",
     )
 
     # Step 5: Exclude inventors with unknown gender
@@ -847,7 +1962,7 @@ def female_invt_ratio(df_appl_invt: pd.DataFrame) -> pd.DataFrame:
     ]
 
     # Step 6: Group by family ID and country code
-    grouped = filtered_df.groupby(["docdb_family_id", "person_ctry_code"])
+    grouped = filtered_df.groupby(["docdb_family_id", "person_ctry_code"], observed=True)
 
     # Count female inventors
     female_counts = (
@@ -867,83 +1982,177 @@ def female_invt_ratio(df_appl_invt: pd.DataFrame) -> pd.DataFrame:
     ratio_df["female_ratio"] = ratio_df["female_ratio"].fillna(0)  # Handle edge cases
 
     # Select the relevant columns for the output
-    df_female_inventor_ratio = ratio_df
+    df_female_inventor_ratio = ratio_df.astype({"person_ctry_code": object})
 
     return df_female_inventor_ratio
 
 
 #######################################
-# Parent function: This will start running previews functions over...the call come from main.py
-########################################
-def get_applicants_inventors_data(country_code: str, start_year: int, end_year: int):
-    if len(country_code) != 2 or not country_code.isalpha():
-        raise ValueError("Country code must be a 2-letter string (e.g., 'NO').")
-    if start_year < 1900 or start_year > 2025:
-        raise ValueError("Start year must be between 1900 and 2025.")  # Updated to 2025
-    if end_year < start_year or end_year > 2025:
-        raise ValueError(
-            "End year must be >= start year and <= 2025."
-        )  # Updated to 2025
+# Analysis stages run by get_applicants_inventors_data, see pipeline.py
 
-    # List of DataFrame names to return
-    df_names = [
-        "df_unique_family_ids",
-        "df_appl_invt",
-        "df_appl_invt_agg",
-        "df_applicant_ratios",
-        "df_inventor_ratios",
-        "df_combined_ratios",
-        "df_applicant_counts",
-        "df_inventor_counts",
-        "df_combined_counts",
-        "df_invt_indiv_counts",
-        "df_invt_non_indiv_counts",
-        "df_appl_non_indiv_counts",
-        "df_appl_indiv_counts",
-        "df_indiv_applicant_ratio",
-        "num_families_with_indiv",
-        "ratio_only_indiv",
-        "df_female_inventor_ratio",
-    ]
 
-    df_unique_family_ids = get_family_ids(country_code, start_year, end_year)
-    if df_unique_family_ids.empty:
-        logger.warning("No family IDs found for the given criteria")
-        return tuple(pd.DataFrame() for _ in df_names)
+def _representative_applns_stage(df_appl_invt: pd.DataFrame) -> dict:
+    """Representative applications per family, shared by all count stages."""
+    return select_representative_applns(clean_person_ctry_code(df_appl_invt))
+
+
+def _counts_stage(
+    df_appl_invt: pd.DataFrame,
+    df_unique_family_ids: pd.DataFrame,
+    representative_applns: dict,
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Applicant/inventor/combined counts with the configured counts engine."""
+    if config.Config.counts_engine == "sql":
+        # Counted inside the database, only the aggregated rows are transferred
+        return calculate_applicants_inventors_counts_sql(
+            df_unique_family_ids["docdb_family_id"].tolist()
+        )
+    return calculate_applicants_inventors_counts(df_appl_invt, representative_applns)
+
+
+def _counts_database_state() -> Optional[str]:
+    """The database the SQL counts engine reads, for the counts stage cache key."""
+    return backend_identity() if config.Config.counts_engine == "sql" else None
+
 
-    # For testing purposes
-    df_unique_family_ids = df_unique_family_ids[0:15]
+def _gender_sources_state() -> dict:
+    """
+    The offline name table and the TLS226 database female_invt_ratio reads, for
+    its stage cache key: a rebuilt table or another database recomputes the ratios.
+    """
+    return {
+        "name_table": (
+            table_fingerprint() if config.Config.gender_mode == "offline" else None
+        ),
+        "database": (
+            backend_identity() if config.Config.use_orig_first_names else None
+        ),
+    }
 
-    # Convert to list
-    family_ids_list = df_unique_family_ids["docdb_family_id"].tolist()
 
-    # Get applicant and inventor data
-    df_appl_invt = get_applicant_inventor(family_ids_list)
+# Outputs of the per-family stages, computed shard by shard when Config.compute_shards > 1
+FAMILY_METRICS_OUTPUTS = (
+    "representative_applns",
+    "df_applicant_counts",
+    "df_inventor_counts",
+    "df_combined_counts",
+    "df_applicant_ratios",
+    "df_inventor_ratios",
+    "df_combined_ratios",
+    "df_invt_indiv_counts",
+    "df_invt_non_indiv_counts",
+    "df_appl_non_indiv_counts",
+    "df_appl_indiv_counts",
+)
 
-    # Aggregate names and appln_ids into same rows
-    df_appl_invt_agg = aggregate_applicants_inventors(df_appl_invt)
 
-    # Calculate counts
-    df_applicant_counts, df_inventor_counts, df_combined_counts = (
-        calculate_applicants_inventors_counts(df_appl_invt)
+def _family_metrics_shard(df_appl_invt: pd.DataFrame) -> tuple:
+    """
+    Counts, ratios and individual/non-individual counts of one family shard.
+    Runs in a worker process; see family_shards.run_sharded.
+    """
+    representative_applns = _representative_applns_stage(df_appl_invt)
+    counts = calculate_applicants_inventors_counts(df_appl_invt, representative_applns)
+    ratios = calculate_applicants_inventors_ratios(*counts, count_matrices(*counts))
+    indiv_non_indiv = calculate_applicants_inventors_indiv_non_indiv(
+        df_appl_invt, representative_applns
     )
+    return (representative_applns, *counts, *ratios, *indiv_non_indiv)
 
-    # Calculate ratios
-    df_applicant_ratios, df_inventor_ratios, df_combined_ratios = (
-        calculate_applicants_inventors_ratios(
-            df_applicant_counts, df_inventor_counts, df_combined_counts
-        )
+
+def _in_family_order(outputs: tuple, names: tuple) -> tuple:
+    """
+    Sort per-family outputs concatenated from shards or chunks back into the
+    single-pass row order: by family, then country where the output has one.
+    """
+    def family_order(df: pd.DataFrame) -> pd.DataFrame:
+        columns = [c for c in ("docdb_family_id", "person_ctry_code") if c in df.columns]
+        return df.sort_values(columns, kind="stable").reset_index(drop=True)
+
+    return tuple(
+        {role: family_order(df) for role, df in value.items()}
+        if name == "representative_applns"
+        else family_order(value)
+        for name, value in zip(names, outputs)
     )
 
-    # Calculate individual/non-individual counts
-    (
-        df_invt_indiv_counts,
-        df_invt_non_indiv_counts,
-        df_appl_non_indiv_counts,
-        df_appl_indiv_counts,
-    ) = calculate_applicants_inventors_indiv_non_indiv(df_appl_invt)
 
-    # Generate plot for individual/non-individual counts
+def _family_metrics_stage(df_appl_invt: pd.DataFrame) -> tuple:
+    """
+    Per-family stages over docdb_family_id hash shards in worker processes. Every
+    family is whole in one shard, so the concatenated outputs equal the
+    single-process ones.
+    """
+    outputs = run_sharded(
+        _family_metrics_shard,
+        df_appl_invt,
+        config.Config.compute_shards,
+        config.Config.shard_workers or None,
+    )
+    return _in_family_order(outputs, FAMILY_METRICS_OUTPUTS)
+
+
+# Outputs of the per-family stages computed chunk by chunk from a spilled extract
+OUT_OF_CORE_OUTPUTS = FAMILY_METRICS_OUTPUTS + ("df_appl_invt_agg",)
+
+
+def _out_of_core_stage(appl_invt_path: str) -> tuple:
+    """
+    Per-family stages over a spilled extract, one chunk of whole families at a time
+    within config.Config.memory_budget_mb; only the per-family results are kept.
+    """
+    memory_budget = config.Config.memory_budget_mb * 1024**2
+    chunk_outputs = []
+    for chunk_number, chunk in enumerate(
+        iter_family_chunks(Path(appl_invt_path), memory_budget), start=1
+    ):
+        chunk = compact_appl_invt(chunk)
+        chunk_outputs.append(
+            (
+                *_family_metrics_shard(chunk),
+                aggregate_applicants_inventors(chunk),
+            )
+        )
+        logger.info(f"Processed chunk {chunk_number} ({len(chunk)} rows)")
+    return _in_family_order(concat_outputs(chunk_outputs), OUT_OF_CORE_OUTPUTS)
+
+
+def _out_of_core_gender_stage(appl_invt_path: str) -> pd.DataFrame:
+    """
+    Female inventor ratios over a spilled extract, chunk by chunk like
+    _out_of_core_stage, with one Genderize client for all chunks. A stage of its
+    own, so gender inference only runs when df_female_inventor_ratio is read.
+    """
+    memory_budget = config.Config.memory_budget_mb * 1024**2
+    resolver = GenderizeResolver()
+    try:
+        chunk_outputs = [
+            (female_invt_ratio(compact_appl_invt(chunk), resolver=resolver),)
+            for chunk in iter_family_chunks(Path(appl_invt_path), memory_budget)
+        ]
+    finally:
+        resolver.close()
+    return _in_family_order(concat_outputs(chunk_outputs), ("df_female_inventor_ratio",))[0]
+
+
+def _load_spilled_appl_invt(appl_invt_path: str) -> pd.DataFrame:
+    """The whole spilled extract, only loaded when df_appl_invt itself is read."""
+    return compact_appl_invt(pd.read_parquet(appl_invt_path))
+
+
+def _plot_indiv_non_indiv_stage(
+    country_code: str,
+    df_invt_indiv_counts: pd.DataFrame,
+    df_invt_non_indiv_counts: pd.DataFrame,
+    df_appl_non_indiv_counts: pd.DataFrame,
+    df_appl_indiv_counts: pd.DataFrame,
+    matrices: dict,
+    output_dir: Optional[Path] = None,
+) -> None:
+    """
+    Plot the individual/non-individual counts when all four frames have rows,
+    under output_dir (defaults to config.Config.output_dir).
+    """
     if all(
         not df.empty
         for df in [
@@ -959,19 +2168,772 @@ def get_applicants_inventors_data(country_code: str, start_year: int, end_year:
             df_appl_non_indiv_counts,
             df_appl_indiv_counts,
             sort_by_country=country_code,
+            output_dir=output_dir,
+            matrices=matrices,
         )
     else:
         logger.warning(
             "One or more individual/non-individual count DataFrames are empty"
         )
 
-    # Calculate individual applicant ratio
-    (df_indiv_applicant_ratio, num_families_with_indiv, ratio_only_indiv) = (
-        individ_applicant(df_appl_indiv_counts, df_appl_non_indiv_counts)
+
+def _country_share(
+    df_ratios: pd.DataFrame, ratio_column: str, country_code: str
+) -> pd.Series:
+    """Ratio of country_code per docdb_family_id (0 when the family has none)."""
+    in_country = df_ratios["person_ctry_code"] == country_code
+    return (
+        df_ratios[ratio_column]
+        .where(in_country, 0.0)
+        .groupby(df_ratios["docdb_family_id"])
+        .sum()
+    )
+
+
+# Outputs the preview metrics are estimated from, see preview_estimates
+PREVIEW_INPUTS = (
+    "df_applicant_ratios",
+    "df_inventor_ratios",
+    "df_combined_ratios",
+    "df_appl_indiv_counts",
+    "df_appl_non_indiv_counts",
+    "df_female_inventor_ratio",
+)
+
+
+def preview_estimates(
+    country_code: str, df_preview_sample: pd.DataFrame, frames: dict
+) -> pd.DataFrame:
+    """
+    Approximate population ratios of a preview run, with 95% confidence intervals.
+
+    Each metric is a per-family value averaged over all families of the country and
+    years, estimated from the stratified sample (see preview_sampling.stratified_mean).
+    Only metrics whose outputs are in frames are estimated, so a preview never
+    computes an output (like the gender inference behind df_female_inventor_ratio)
+    the caller did not ask for.
+
+    Args:
+        country_code (str): 2-letter country code.
+        df_preview_sample (pd.DataFrame): The sample, see preview_sampling.stratified_sample.
+        frames (dict): Computed outputs of the sampled families, by name (any of
+            PREVIEW_INPUTS): the applicant, inventor and combined ratios, the
+            individual and non-individual applicant counts (both needed) and the
+            female and known-gender inventor counts.
+
+    Returns:
+        pd.DataFrame: metric, estimate, ci_low, ci_high, n (sampled families
+        with a value) and population (families the sample represents).
+    """
+    # Step 1: Per-family values of each metric
+    metrics = {}
+    for output, ratio_column, metric in (
+        ("df_applicant_ratios", "applicant_ratio", "applicant_share"),
+        ("df_inventor_ratios", "inventor_ratio", "inventor_share"),
+        ("df_combined_ratios", "combined_ratio", "combined_share"),
+    ):
+        if output in frames:
+            metrics[f"{metric}_{country_code}"] = _country_share(
+                frames[output], ratio_column, country_code
+            )
+    if "df_appl_indiv_counts" in frames and "df_appl_non_indiv_counts" in frames:
+        applicants = pd.concat(
+            [
+                frames["df_appl_indiv_counts"]
+                .groupby("docdb_family_id")["appl_indiv_count"]
+                .sum(),
+                frames["df_appl_non_indiv_counts"]
+                .groupby("docdb_family_id")["appl_non_indiv_count"]
+                .sum(),
+            ],
+            axis=1,
+        ).fillna(0)
+        metrics["only_indiv_applicants"] = (
+            (applicants["appl_indiv_count"] > 0)
+            & (applicants["appl_non_indiv_count"] == 0)
+        ).astype(float)
+    if "df_female_inventor_ratio" in frames:
+        female_counts = frames["df_female_inventor_ratio"].groupby("docdb_family_id")[
+            ["female_count", "total_count"]
+        ].sum()
+        metrics["female_inventor_share"] = (
+            female_counts["female_count"] / female_counts["total_count"]
+        )
+
+    # Step 2: Stratified estimates
+    population = int(
+        df_preview_sample.groupby("stratum")["stratum_size"].first().sum()
+    )
+    rows = [
+        {"metric": metric, **stratified_mean(values, df_preview_sample), "population": population}
+        for metric, values in metrics.items()
+    ]
+    df_estimates = pd.DataFrame(
+        rows, columns=["metric", "estimate", "ci_low", "ci_high", "n", "population"]
+    )
+    # All metrics are shares, keep the normal-approximation intervals within [0, 1]
+    df_estimates[["ci_low", "ci_high"]] = df_estimates[["ci_low", "ci_high"]].clip(0, 1)
+    return df_estimates
+
+
+def build_analysis_pipeline(out_of_core: bool = False) -> Pipeline:
+    """
+    Stages computed from an extract (inputs country_code, df_unique_family_ids and
+    df_appl_invt). Aggregation, counts, individual/non-individual classification
+    and female inventor ratios do not depend on each other and run concurrently.
+
+    The counts are encoded once into sparse family x country matrices
+    (count_matrices, indiv_non_indiv_matrices), which the ratios and the plots read.
+
+    With out_of_core the extract is a spilled Parquet file (input appl_invt_path,
+    see get_spilled_extract) and all per-family stages run chunk by chunk within
+    config.Config.memory_budget_mb; df_appl_invt is only loaded if it is read.
+
+    With config.Config.compute_shards > 1 (and the pandas counts engine) the
+    per-family stages (representative applications, counts, ratios and
+    individual/non-individual counts) run as one stage over family-hash shards
+    in worker processes.
+
+    A preview extract is a stratified sample of the families (input
+    df_preview_sample); finish_analysis_run expands the ratios that were read
+    to the population, see preview_estimates.
+
+    Stages with a version are cached on disk (config.Config.use_stage_cache); bump
+    a stage's version whenever its function changes what it returns.
+    """
+    if out_of_core:
+        family_stages = [
+            Stage(
+                "out_of_core",
+                _out_of_core_stage,
+                inputs=("appl_invt_path",),
+                outputs=OUT_OF_CORE_OUTPUTS,
+            ),
+            Stage(
+                "out_of_core_female_inventor_ratio",
+                _out_of_core_gender_stage,
+                inputs=("appl_invt_path",),
+                outputs=("df_female_inventor_ratio",),
+            ),
+            Stage(
+                "load_appl_invt",
+                _load_spilled_appl_invt,
+                inputs=("appl_invt_path",),
+                outputs=("df_appl_invt",),
+            ),
+        ]
+    elif config.Config.compute_shards > 1 and config.Config.counts_engine == "pandas":
+        family_stages = [
+            Stage(
+                "family_metrics",
+                _family_metrics_stage,
+                inputs=("df_appl_invt",),
+                outputs=FAMILY_METRICS_OUTPUTS,
+                version="1",
+            ),
+        ]
+    else:
+        family_stages = [
+            Stage(
+                "representative_applns",
+                _representative_applns_stage,
+                inputs=("df_appl_invt",),
+                outputs=("representative_applns",),
+                version="1",
+            ),
+            Stage(
+                "counts",
+                _counts_stage,
+                inputs=("df_appl_invt", "df_unique_family_ids", "representative_applns"),
+                outputs=("df_applicant_counts", "df_inventor_counts", "df_combined_counts"),
+                version="1",
+                config_keys=(
+                    "counts_engine",
+                    "db_backend",
+                    "sqlite_path",
+                    "query_version",
+                    "patstat_edition",
+                ),
+                external_state=(_counts_database_state,),
+            ),
+            Stage(
+                "ratios",
+                calculate_applicants_inventors_ratios,
+                inputs=(
+                    "df_applicant_counts",
+                    "df_inventor_counts",
+                    "df_combined_counts",
+                    "count_matrices",
+                ),
+                outputs=("df_applicant_ratios", "df_inventor_ratios", "df_combined_ratios"),
+                version="1",
+            ),
+            Stage(
+                "indiv_non_indiv",
+                calculate_applicants_inventors_indiv_non_indiv,
+                inputs=("df_appl_invt", "representative_applns"),
+                outputs=(
+                    "df_invt_indiv_counts",
+                    "df_invt_non_indiv_counts",
+                    "df_appl_non_indiv_counts",
+                    "df_appl_indiv_counts",
+                ),
+                version="1",
+            ),
+        ]
+    if not out_of_core:
+        family_stages += [
+            Stage(
+                "aggregate",
+                aggregate_applicants_inventors,
+                inputs=("df_appl_invt",),
+                outputs=("df_appl_invt_agg",),
+                version="1",
+            ),
+            Stage(
+                "female_inventor_ratio",
+                female_invt_ratio,
+                inputs=("df_appl_invt",),
+                outputs=("df_female_inventor_ratio",),
+                version="1",
+                config_keys=(
+                    "gender_mode",
+                    "gender_table_dir",
+                    "gender_threshold",
+                    "use_orig_first_names",
+                    "patstat_edition",
+                ),
+                external_state=(_gender_sources_state,),
+            ),
+        ]
+    return Pipeline(
+        [
+            *family_stages,
+            # Sparse family x country matrices, built once and shared by ratios and plots
+            Stage(
+                "count_matrices",
+                count_matrices,
+                inputs=("df_applicant_counts", "df_inventor_counts", "df_combined_counts"),
+                outputs=("count_matrices",),
+            ),
+            Stage(
+                "indiv_non_indiv_matrices",
+                indiv_non_indiv_matrices,
+                inputs=(
+                    "df_invt_indiv_counts",
+                    "df_invt_non_indiv_counts",
+                    "df_appl_non_indiv_counts",
+                    "df_appl_indiv_counts",
+                ),
+                outputs=("indiv_non_indiv_matrices",),
+            ),
+            Stage(
+                "plot_indiv_non_indiv",
+                _plot_indiv_non_indiv_stage,
+                inputs=(
+                    "country_code",
+                    "df_invt_indiv_counts",
+                    "df_invt_non_indiv_counts",
+                    "df_appl_non_indiv_counts",
+                    "df_appl_indiv_counts",
+                    "indiv_non_indiv_matrices",
+                ),
+                outputs=("plot_indiv_non_indiv",),
+                exclusive=True,
+            ),
+            Stage(
+                "individ_applicant",
+                individ_applicant,
+                inputs=("df_appl_indiv_counts", "df_appl_non_indiv_counts"),
+                outputs=(
+                    "df_indiv_applicant_ratio",
+                    "num_families_with_indiv",
+                    "ratio_only_indiv",
+                ),
+                version="1",
+            ),
+        ]
+    )
+
+
+def get_applicants_inventors_results(
+    country_code: str,
+    start_year: int,
+    end_year: int,
+    spill_extract: Optional[bool] = None,
+    use_extract_cache: Optional[bool] = None,
+    preview_sample_size: Optional[int] = None,
+) -> Optional[LazyResults]:
+    """
+    Extract the applicants/inventors of a country and years and return the analysis
+    outputs as a LazyResults: each output (e.g. results.applicant_ratios,
+    results.female_inventor_ratio) is computed on first access and memoized, so
+    stages nobody reads, like gender inference, never run.
+
+    Args:
+        country_code (str): 2-letter country code.
+        start_year (int): First filing year.
+        end_year (int): Last filing year.
+        spill_extract (bool, optional): Overrides config.Config.spill_extract for
+            this run (e.g. the mode suggested by estimate_applicants_inventors_run).
+        use_extract_cache (bool, optional): Overrides config.Config.use_extract_cache.
+        preview_sample_size (int, optional): Overrides config.Config.preview_sample_size.
+
+    Returns:
+        Optional[LazyResults]: The outputs of build_analysis_pipeline, or None when
+        no family IDs match.
+    """
+    if len(country_code) != 2 or not country_code.isalpha():
+        raise ValueError("Country code must be a 2-letter string (e.g., 'NO').")
+    if start_year < 1900 or start_year > 2025:
+        raise ValueError("Start year must be between 1900 and 2025.")  # Updated to 2025
+    if end_year < start_year or end_year > 2025:
+        raise ValueError(
+            "End year must be >= start year and <= 2025."
+        )  # Updated to 2025
+
+    # Per-run settings, Config unless overridden by the caller
+    if spill_extract is None:
+        spill_extract = config.Config.spill_extract
+    if use_extract_cache is None:
+        use_extract_cache = config.Config.use_extract_cache
+    if preview_sample_size is None:
+        preview_sample_size = config.Config.preview_sample_size
+
+    # A preview extracts a stratified sample of the families, always in memory
+    sample_spec = (
+        {"size": int(preview_sample_size), "seed": int(config.Config.preview_seed)}
+        if preview_sample_size > 0
+        else None
     )
 
-    # Calculate female inventor ratio
-    df_female_inventor_ratio = female_invt_ratio(df_appl_invt)
+    if spill_extract and sample_spec is None:
+        # Out-of-core: the extract stays on disk and is processed chunk by chunk
+        df_unique_family_ids, appl_invt_path = get_spilled_extract(
+            country_code, start_year, end_year, use_cache=use_extract_cache
+        )
+        if appl_invt_path is None:
+            logger.warning("No family IDs found for the given criteria")
+            return None
+        return build_analysis_pipeline(out_of_core=True).lazy(
+            {
+                "country_code": country_code,
+                "df_unique_family_ids": df_unique_family_ids,
+                "appl_invt_path": str(appl_invt_path),
+            }
+        )
+
+    # Reuse a cached extract of the same country, years, query and PATSTAT edition
+    partitioned = config.Config.partition_by_year and sample_spec is None
+    cache_key_parts = extract_key_parts(country_code, start_year, end_year, sample_spec)
+    cached_frames = (
+        load_frames(cache_key_parts)
+        if use_extract_cache and not partitioned
+        else None
+    )
+    df_preview_sample = None
+
+    if partitioned:
+        # Incremental extraction: only filing years missing from the cache are queried
+        df_unique_family_ids, df_appl_invt = get_partitioned_extract(
+            country_code, start_year, end_year, use_cache=use_extract_cache
+        )
+        if df_unique_family_ids.empty:
+            logger.warning("No family IDs found for the given criteria")
+            return None
+    elif cached_frames is not None:
+        df_unique_family_ids = cached_frames["df_unique_family_ids"]
+        df_appl_invt = cached_frames["df_appl_invt"]
+        df_preview_sample = cached_frames.get("df_preview_sample")
+    else:
+        # One pooled session for the whole extraction of this run
+        start_time = time.perf_counter()
+        with session_scope() as db:
+            if sample_spec is None:
+                df_unique_family_ids = get_family_ids(
+                    country_code, start_year, end_year, db
+                )
+            else:
+                # Preview: a reproducible sample stratified by filing year and family size
+                df_family_strata = get_family_strata(
+                    country_code, start_year, end_year, db
+                )
+                if not df_family_strata.empty:
+                    df_preview_sample = stratified_sample(
+                        df_family_strata, sample_spec["size"], sample_spec["seed"]
+                    )
+                    df_unique_family_ids = df_preview_sample[["docdb_family_id"]]
+                else:
+                    df_unique_family_ids = df_family_strata
+            if df_unique_family_ids.empty:
+                logger.warning("No family IDs found for the given criteria")
+                return None
+
+            # Convert to list
+            family_ids_list = df_unique_family_ids["docdb_family_id"].tolist()
+
+            # Get applicant and inventor data
+            df_appl_invt = get_applicant_inventor(family_ids_list, db)
+        ThroughputHistory().record(
+            {EXTRACT: time.perf_counter() - start_time}, len(df_appl_invt)
+        )
+
+        # Narrow dtypes once at ingest; the cache then stores the compact frame
+        df_appl_invt = compact_appl_invt(df_appl_invt)
+
+        if use_extract_cache:
+            frames = {
+                "df_unique_family_ids": df_unique_family_ids,
+                "df_appl_invt": df_appl_invt,
+            }
+            if df_preview_sample is not None:
+                frames["df_preview_sample"] = df_preview_sample
+            save_frames(cache_key_parts, frames)
+
+    # No-op for fresh extracts; compacts partitions and extracts cached by older versions
+    df_appl_invt = compact_appl_invt(df_appl_invt)
+
+    # Analysis stages run on first access of their outputs
+    inputs = {
+        "country_code": country_code,
+        "df_unique_family_ids": df_unique_family_ids,
+        "df_appl_invt": df_appl_invt,
+    }
+    if df_preview_sample is not None:
+        inputs["df_preview_sample"] = df_preview_sample
+    return build_analysis_pipeline().lazy(inputs)
+
+
+# Stages run per country by get_multi_country_results (the matrices from the
+# country's counts); every other output is per family and selected from the
+# outputs over the union of the countries' families
+COUNTRY_STAGES = (
+    "count_matrices",
+    "indiv_non_indiv_matrices",
+    "plot_indiv_non_indiv",
+    "individ_applicant",
+)
+
+
+def _select_families(value, df_family_ids: pd.DataFrame):
+    """Rows of a per-family output (or dict of outputs) for the families in df_family_ids."""
+    if isinstance(value, dict):
+        return {key: _select_families(df, df_family_ids) for key, df in value.items()}
+    in_families = value["docdb_family_id"].isin(df_family_ids["docdb_family_id"])
+    return value[in_families].reset_index(drop=True)
+
+
+def _union_selection_stage(union_results: LazyResults, name: str) -> Stage:
+    """Stage selecting one country's families from an output over the union."""
+
+    def select_families(df_unique_family_ids: pd.DataFrame):
+        return _select_families(union_results[name], df_unique_family_ids)
+
+    return Stage(
+        f"select_{name}",
+        select_families,
+        inputs=("df_unique_family_ids",),
+        outputs=(name,),
+    )
+
+
+def _with_output_dir(stages: list[Stage], output_dir: Path) -> list[Stage]:
+    """The stages with their plots saved under output_dir (one folder per country)."""
+    return [
+        Stage(
+            stage.name,
+            partial(_plot_indiv_non_indiv_stage, output_dir=output_dir),
+            inputs=stage.inputs,
+            outputs=stage.outputs,
+            exclusive=stage.exclusive,
+        )
+        if stage.func is _plot_indiv_non_indiv_stage
+        else stage
+        for stage in stages
+    ]
+
+
+def get_multi_country_results(
+    country_codes: list[str], start_year: int, end_year: int, outputs: tuple = ()
+) -> dict:
+    """
+    Analyse several countries in one pass over the union of their families.
+
+    The families of all countries are found with one query, the applicants/inventors
+    of the union are extracted once, and the per-family stages (counts, ratios,
+    individual/non-individual classification, gender inference) run once over the
+    union: a family co-owned by e.g. NO and SE is fetched and classified once. Each
+    country's outputs are its families' rows of the shared outputs, which equal
+    those of get_applicants_inventors_results for that country; only the
+    dataset-wide individual applicant figures and the plots are computed per country,
+    the plots under config.Config.output_dir/<country code>.
+
+    Multi-country runs always extract in memory: preview_sample_size,
+    spill_extract and partition_by_year are ignored (with a warning).
+
+    Args:
+        country_codes (list[str]): 2-letter country codes.
+        start_year (int): First filing year.
+        end_year (int): Last filing year.
+        outputs (tuple, optional): Outputs every country will read; the union
+            stages behind them are computed right away, concurrently. Other
+            outputs of the union are computed on first access from any country.
+
+    Returns:
+        dict: country code -> LazyResults with the outputs of build_analysis_pipeline
+        (None for a country without families).
+    """
+    country_codes = list(dict.fromkeys(country_codes))
+    unsupported = [
+        name
+        for name, enabled in (
+            ("preview_sample_size", config.Config.preview_sample_size > 0),
+            ("spill_extract", config.Config.spill_extract),
+            ("partition_by_year", config.Config.partition_by_year),
+        )
+        if enabled
+    ]
+    if unsupported:
+        logger.warning(
+            f"Multi-country runs extract every family in memory, ignoring "
+            f"{', '.join(unsupported)}"
+        )
+    for country_code in country_codes:
+        if len(country_code) != 2 or not country_code.isalpha():
+            raise ValueError("Country code must be a 2-letter string (e.g., 'NO').")
+    if start_year < 1900 or start_year > 2025:
+        raise ValueError("Start year must be between 1900 and 2025.")
+    if end_year < start_year or end_year > 2025:
+        raise ValueError("End year must be >= start year and <= 2025.")
+
+    # Step 1: Families of every country and the shared extract of their union
+    cache_key_parts = {
+        **extract_key_parts("+".join(sorted(country_codes)), start_year, end_year),
+        # Lets invalidate_cache(country_code=...) find this entry for each country
+        "country_codes": sorted(country_codes),
+    }
+    cached_frames = (
+        load_frames(cache_key_parts) if config.Config.use_extract_cache else None
+    )
+    if cached_frames is not None:
+        df_family_countries = cached_frames["df_family_countries"]
+        df_appl_invt = cached_frames["df_appl_invt"]
+    else:
+        start_time = time.perf_counter()
+        with session_scope() as db:
+            df_family_countries = get_family_countries(
+                country_codes, start_year, end_year, db
+            )
+            if df_family_countries.empty:
+                logger.warning("No family IDs found for the given criteria")
+                return {country_code: None for country_code in country_codes}
+
+            family_ids_list = (
+                df_family_countries["docdb_family_id"].drop_duplicates().tolist()
+            )
+            df_appl_invt = get_applicant_inventor(family_ids_list, db)
+        ThroughputHistory().record(
+            {EXTRACT: time.perf_counter() - start_time}, len(df_appl_invt)
+        )
+        df_appl_invt = compact_appl_invt(df_appl_invt)
+
+        if config.Config.use_extract_cache:
+            save_frames(
+                cache_key_parts,
+                {
+                    "df_family_countries": df_family_countries,
+                    "df_appl_invt": df_appl_invt,
+                },
+            )
+    df_appl_invt = compact_appl_invt(df_appl_invt)
+
+    df_union_family_ids = (
+        df_family_countries[["docdb_family_id"]].drop_duplicates().reset_index(drop=True)
+    )
+    country_families = df_family_countries.groupby("person_ctry_code").size()
+    logger.info(
+        f"Extracted {len(df_union_family_ids)} families for {', '.join(country_codes)} "
+        f"once instead of {int(country_families.sum())} "
+        f"({len(df_appl_invt)} applicant/inventor rows)"
+    )
+
+    # Step 2: Per-family stages over the union, run on first access
+    analysis_pipeline = build_analysis_pipeline()
+    union_results = analysis_pipeline.lazy(
+        {
+            "df_unique_family_ids": df_union_family_ids,
+            "df_appl_invt": df_appl_invt,
+        }
+    )
+
+    # Step 3: Per country, its families' rows of the union outputs
+    shared_names = ["df_appl_invt"] + [
+        name
+        for name, stage in analysis_pipeline.producers.items()
+        if stage.name not in COUNTRY_STAGES
+    ]
+    country_stages = [
+        stage for stage in analysis_pipeline.stages if stage.name in COUNTRY_STAGES
+    ]
+    base_output_dir = Path(config.Config.output_dir)
+    union_outputs = [
+        name
+        for name in shared_names
+        if name in outputs or any(name in stage.inputs for stage in country_stages)
+    ]
+    if outputs and union_outputs:
+        union_results.compute(*union_outputs)
+    country_results = {}
+    for country_code in country_codes:
+        df_unique_family_ids = df_family_countries.loc[
+            df_family_countries["person_ctry_code"] == country_code, ["docdb_family_id"]
+        ].reset_index(drop=True)
+        if df_unique_family_ids.empty:
+            logger.warning(f"No family IDs found for {country_code}")
+            country_results[country_code] = None
+            continue
+        country_results[country_code] = Pipeline(
+            [
+                *(_union_selection_stage(union_results, name) for name in shared_names),
+                *_with_output_dir(country_stages, base_output_dir / country_code),
+            ]
+        ).lazy(
+            {
+                "country_code": country_code,
+                "df_unique_family_ids": df_unique_family_ids,
+            }
+        )
+    return country_results
+
+
+def _extract_row_stats(results: LazyResults) -> tuple[int, float]:
+    """
+    Rows and in-memory bytes per row of the run's df_appl_invt, without computing
+    it: a spilled extract is measured on its Parquet file (see spill_store.row_stats),
+    an in-memory one on a sample of its rows.
+    """
+    if not results.is_computed("df_appl_invt"):
+        return row_stats(Path(results.appl_invt_path))
+    df_appl_invt = results.df_appl_invt
+    if df_appl_invt.empty:
+        return 0, 0.0
+    sample = df_appl_invt.head(SAMPLE_ROWS)
+    return len(df_appl_invt), sample.memory_usage(deep=True).sum() / len(sample)
+
+
+def _record_analysis_throughput(
+    results: LazyResults, outputs: Iterable[str], elapsed: float
+) -> None:
+    """Add the stage timings of a run to the throughput history (cache hits left out)."""
+    rows, bytes_per_row = _extract_row_stats(results)
+    if rows == 0:
+        return
+    timings = {
+        stage: seconds
+        for stage, seconds in results.timings.items()
+        if stage not in results.cached_stages
+    }
+    # The wall time only reflects a whole run: every output computed, none from the cache
+    if set(DATA_OUTPUTS) <= set(outputs) and not results.cached_stages:
+        timings[ANALYSIS] = elapsed
+    ThroughputHistory().record(timings, rows, bytes_per_row)
+
+
+# Outputs returned by get_applicants_inventors_data, in order
+DATA_OUTPUTS = (
+    "df_unique_family_ids",
+    "df_appl_invt",
+    "df_appl_invt_agg",
+    "df_applicant_ratios",
+    "df_inventor_ratios",
+    "df_combined_ratios",
+    "df_applicant_counts",
+    "df_inventor_counts",
+    "df_combined_counts",
+    "df_appl_non_indiv_counts",
+    "df_appl_indiv_counts",
+    "df_indiv_applicant_ratio",
+    "num_families_with_indiv",
+    "ratio_only_indiv",
+    "df_female_inventor_ratio",
+)
+
+
+def finish_analysis_run(
+    results: LazyResults, outputs: Iterable[str], elapsed: float
+) -> Optional[pd.DataFrame]:
+    """
+    Bookkeeping once the outputs of a run have been read: record the throughput of
+    the stages that ran (for estimate_applicants_inventors_run) and, for a preview,
+    estimate the population ratios from the outputs computed so far (see
+    preview_estimates), log them and save them to preview_estimates.csv in
+    config.Config.output_dir.
+
+    Args:
+        results (LazyResults): Results of get_applicants_inventors_results.
+        outputs (Iterable[str]): Output names (with their "df_" prefix) computed in
+            the timed run; its wall time is only recorded when they include every
+            output of DATA_OUTPUTS.
+        elapsed (float): Seconds spent computing the outputs that were read.
+
+    Returns:
+        Optional[pd.DataFrame]: The preview estimates, None for a full run.
+    """
+    _record_analysis_throughput(results, outputs, elapsed)
+
+    if not results.provides("df_preview_sample"):
+        return None
+    df_preview_estimates = preview_estimates(
+        results.country_code,
+        results.df_preview_sample,
+        {name: results[name] for name in PREVIEW_INPUTS if results.is_computed(name)},
+    )
+    logger.info(
+        f"Preview estimates ({len(results.df_unique_family_ids)} sampled families):\n"
+        f"{df_preview_estimates.to_string(index=False)}"
+    )
+    preview_dir = Path(config.Config.output_dir)
+    preview_dir.mkdir(parents=True, exist_ok=True)
+    df_preview_estimates.to_csv(preview_dir / "preview_estimates.csv", index=False)
+    return df_preview_estimates
+
+
+#######################################
+# Parent function: This will start running previews functions over...the call come from main.py
+########################################
+def get_applicants_inventors_data(
+    country_code: str, start_year: int, end_year: int, **run_options
+):
+    # run_options: per-run settings, see get_applicants_inventors_results
+    results = get_applicants_inventors_results(
+        country_code, start_year, end_year, **run_options
+    )
+    if results is None:
+        return tuple(pd.DataFrame() for _ in DATA_OUTPUTS)
+
+    # Compute every output (and the individual/non-individual plot), independent stages concurrently
+    start_time = time.perf_counter()
+    (
+        df_unique_family_ids,
+        df_appl_invt,
+        df_appl_invt_agg,
+        df_applicant_ratios,
+        df_inventor_ratios,
+        df_combined_ratios,
+        df_applicant_counts,
+        df_inventor_counts,
+        df_combined_counts,
+        df_appl_non_indiv_counts,
+        df_appl_indiv_counts,
+        df_indiv_applicant_ratio,
+        num_families_with_indiv,
+        ratio_only_indiv,
+        df_female_inventor_ratio,
+        _,
+    ) = results.compute(*DATA_OUTPUTS, "plot_indiv_non_indiv")
+
+    # Throughput history and preview estimates
+    finish_analysis_run(results, DATA_OUTPUTS, time.perf_counter() - start_time)
 
     # Return all DataFrames and metrics
     return (
@@ -1050,3 +3012,35 @@ def get_applicants_inventors_data(country_code: str, start_year: int, end_year:
         ratio_only_indiv,
         df_female_inventor_ratio,
     )
+
+
+def get_multi_country_data(
+    country_codes: list[str], start_year: int, end_year: int
+) -> dict:
+    """
+    get_applicants_inventors_data for several countries in one pass, see
+    get_multi_country_results.
+
+    Args:
+        country_codes (list[str]): 2-letter country codes, e.g. ["NO", "SE", "DK", "FI"].
+        start_year (int): First filing year.
+        end_year (int): Last filing year.
+
+    Returns:
+        dict: country code -> the tuple get_applicants_inventors_data returns.
+    """
+    country_results = get_multi_country_results(
+        country_codes,
+        start_year,
+        end_year,
+        outputs=(*DATA_OUTPUTS, "plot_indiv_non_indiv"),
+    )
+    country_data = {}
+    for country_code, results in country_results.items():
+        if results is None:
+            country_data[country_code] = tuple(pd.DataFrame() for _ in DATA_OUTPUTS)
+            continue
+        country_data[country_code] = tuple(
+            results.compute(*DATA_OUTPUTS, "plot_indiv_non_indiv")[:-1]
+        )
+    return country_data
@@ -0,0 +1,341 @@
+# Offline PATSTAT stand-in: serves the models_tables schema from a local SQLite file,
+# so the extraction pipeline can be run, profiled and benchmarked without SQL Server.
+#
+# Usage:
+#   python offline_backend.py generate --families 200000
+#   python offline_backend.py load-csv C:/patstat/csv
+#   python offline_backend.py benchmark --country NO --start-year 2015 --end-year 2020
+import argparse
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Index
+
+import config
+from connect_database import get_engine
+from models_tables import (
+    Base,
+    TLS201_APPLN,
+    TLS206_PERSON,
+    TLS207_PERS_APPLN,
+    TLS226_PERSON_ORIG,
+)
+
+# Initialize Logger
+logger = logging.getLogger(__name__)
+
+# Tables loaded from PATSTAT CSV extracts, matched on the lower-case file prefix
+CSV_TABLES = [TLS201_APPLN, TLS206_PERSON, TLS207_PERS_APPLN, TLS226_PERSON_ORIG]
+
+# Secondary indexes used by the extraction queries
+OFFLINE_INDEXES = [
+    Index("ix_tls201_docdb_family_id", TLS201_APPLN.docdb_family_id),
+    Index("ix_tls201_appln_filing_year", TLS201_APPLN.appln_filing_year),
+    Index("ix_tls207_appln_id", TLS207_PERS_APPLN.appln_id),
+    Index("ix_tls206_person_ctry_code", TLS206_PERSON.person_ctry_code),
+    Index("ix_tls226_person_id", TLS226_PERSON_ORIG.person_id),
+]
+
+SYNTHETIC_COUNTRIES = ["NO", "SE", "DK", "FI", "IS", "DE", "US", "GB", "FR", "JP", "CN"]
+SYNTHETIC_COUNTRY_WEIGHTS = [0.30, 0.15, 0.08, 0.07, 0.01, 0.10, 0.12, 0.06, 0.05, 0.03, 0.03]
+SYNTHETIC_FIRST_NAMES = ["Ole", "Anne", "Lars", "Ingrid", "Erik", "Kari", "Per", "Nina", "John", "Maria"]
+SYNTHETIC_LAST_NAMES = ["Hansen", "Johansen", "Olsen", "Larsen", "Andersen", "Berg", "Smith", "Nilsson"]
+SYNTHETIC_COMPANIES = ["EQUINOR ASA", "NORSK HYDRO AS", "TELENOR ASA", "SIEMENS AG", "ACME INC", "NTNU UNIVERSITY"]
+
+
+def use_offline_backend(sqlite_path: str = None) -> None:
+    """Point connect_database at the offline SQLite file for the rest of the process."""
+    config.Config.update(
+        db_backend="sqlite",
+        sqlite_path=sqlite_path or config.Config.sqlite_path,
+    )
+
+
+def create_offline_schema() -> None:
+    """Create the models_tables schema and the extraction indexes in the offline database."""
+    engine = get_engine()
+    Base.metadata.create_all(engine)
+    for index in OFFLINE_INDEXES:
+        index.create(engine, checkfirst=True)
+
+
+def _insert_frame(df: pd.DataFrame, model, chunk_size: int = 50000) -> int:
+    """Append a DataFrame to the table of a models_tables class."""
+    engine = get_engine()
+    columns = [column.name for column in model.__table__.columns]
+    df[columns].to_sql(
+        model.__tablename__,
+        engine,
+        if_exists="append",
+        index=False,
+        chunksize=chunk_size,
+    )
+    return len(df)
+
+
+def load_patstat_csv(csv_dir: str, chunk_size: int = 200000) -> dict:
+    """
+    Load PATSTAT CSV extracts (e.g. tls201_part01.csv, tls206_part01.csv) into the
+    offline database, keeping only the columns defined in models_tables.
+
+    Args:
+        csv_dir (str): Folder with the CSV files.
+        chunk_size (int): Rows read and inserted per chunk.
+
+    Returns:
+        dict: Number of rows loaded per table.
+    """
+    create_offline_schema()
+    loaded = {}
+    for model in CSV_TABLES:
+        prefix = model.__tablename__.split("_")[0].lower()
+        columns = [column.name for column in model.__table__.columns]
+        csv_files = sorted(Path(csv_dir).glob(f"{prefix}*.csv"))
+        if not csv_files:
+            logger.warning(f"No CSV files found for {model.__tablename__} in {csv_dir}")
+            continue
+
+        loaded[model.__tablename__] = 0
+        for csv_file in csv_files:
+            for chunk in pd.read_csv(
+                csv_file, usecols=columns, chunksize=chunk_size, keep_default_na=False
+            ):
+                loaded[model.__tablename__] += _insert_frame(chunk, model)
+            logger.info(f"Loaded {csv_file} into {model.__tablename__}")
+    return loaded
+
+
+def generate_synthetic_patstat(
+    n_families: int = 10000,
+    start_year: int = 2010,
+    end_year: int = 2020,
+    seed: int = 0,
+) -> dict:
+    """
+    Fill the offline database with synthetic TLS201/TLS206/TLS207 data with
+    PATSTAT-like shape: families of 1-6 applications, 1-8 persons per family,
+    mixed individual and company applicants across Nordic and other countries.
+
+    Args:
+        n_families (int): Number of docdb families to generate.
+        start_year (int): First filing year.
+        end_year (int): Last filing year.
+        seed (int): Random seed, for reproducible benchmark data.
+
+    Returns:
+        dict: Number of rows generated per table.
+    """
+    create_offline_schema()
+    rng = np.random.default_rng(seed)
+
+    # TLS201: applications, grouped in families
+    family_ids = np.arange(1, n_families + 1, dtype=np.int64) * 10
+    applns_per_family = rng.integers(1, 7, size=n_families)
+    appln_family_ids = np.repeat(family_ids, applns_per_family)
+    n_applns = len(appln_family_ids)
+    appln_ids = np.arange(1, n_applns + 1, dtype=np.int64)
+    filing_years = np.repeat(
+        rng.integers(start_year, end_year + 1, size=n_families), applns_per_family
+    ) + rng.integers(0, 2, size=n_applns)
+    filing_dates = pd.to_datetime(
+        {"year": filing_years, "month": rng.integers(1, 13, size=n_applns), "day": 1}
+    )
+    publn_dates = filing_dates + pd.to_timedelta(rng.integers(180, 720, size=n_applns), unit="D")
+    df_appln = pd.DataFrame(
+        {
+            "appln_id": appln_ids,
+            "appln_auth": rng.choice(["NO", "EP", "US", "WO", "SE"], size=n_applns),
+            "appln_nr": appln_ids.astype(str),
+            "appln_kind": "A",
+            "appln_filing_date": filing_dates.dt.date,
+            "appln_filing_year": filing_years,
+            "appln_nr_epodoc": "",
+            "appln_nr_original": "",
+            "ipr_type": "PI",
+            "receiving_office": "",
+            "internat_appln_id": 0,
+            "int_phase": "N",
+            "reg_phase": "N",
+            "nat_phase": "N",
+            "earliest_filing_date": filing_dates.dt.date,
+            "earliest_filing_year": filing_years,
+            "earliest_filing_id": appln_ids,
+            "earliest_publn_date": publn_dates.dt.date,
+            "earliest_publn_year": publn_dates.dt.year,
+            "earliest_pat_publn_id": appln_ids,
+            "granted": rng.choice(["Y", "N"], size=n_applns),
+            "docdb_family_id": appln_family_ids,
+            "inpadoc_family_id": appln_family_ids,
+            "docdb_family_size": np.repeat(applns_per_family, applns_per_family),
+            "nb_citing_docdb_fam": 0,
+            "nb_applicants": rng.integers(1, 4, size=n_applns),
+            "nb_inventors": rng.integers(1, 6, size=n_applns),
+        }
+    )
+
+    # TLS206: persons, each belonging to one family
+    persons_per_family = rng.integers(1, 9, size=n_families)
+    n_persons = int(persons_per_family.sum())
+    person_ids = np.arange(1, n_persons + 1, dtype=np.int64)
+    is_company = rng.random(n_persons) < 0.3
+    individual_names = pd.Series(
+        rng.choice(SYNTHETIC_LAST_NAMES, size=n_persons)
+    ) + ", " + pd.Series(rng.choice(SYNTHETIC_FIRST_NAMES, size=n_persons))
+    company_names = pd.Series(rng.choice(SYNTHETIC_COMPANIES, size=n_persons))
+    df_person = pd.DataFrame(
+        {
+            "person_id": person_ids,
+            "person_name": np.where(is_company, company_names, individual_names),
+            "person_name_orig_lg": "",
+            "person_address": "",
+            "person_ctry_code": rng.choice(
+                SYNTHETIC_COUNTRIES, size=n_persons, p=SYNTHETIC_COUNTRY_WEIGHTS
+            ),
+            "nuts": "",
+            "nuts_level": 0,
+            "doc_std_name_id": person_ids,
+            "doc_std_name": "",
+            "psn_id": person_ids,
+            "psn_name": "",
+            "psn_level": 0,
+            "psn_sector": np.where(
+                is_company,
+                rng.choice(["COMPANY", "UNIVERSITY", "UNKNOWN"], size=n_persons),
+                rng.choice(["INDIVIDUAL", "UNKNOWN", ""], size=n_persons),
+            ),
+            "han_id": 0,
+            "han_name": "",
+            "han_harmonized": 0,
+        }
+    )
+
+    # TLS207: every person of a family linked to every application of the family
+    df_family_persons = pd.DataFrame(
+        {
+            "docdb_family_id": np.repeat(family_ids, persons_per_family),
+            "person_id": person_ids,
+            "is_company": is_company,
+        }
+    )
+    df_pers_appln = df_family_persons.merge(
+        df_appln[["docdb_family_id", "appln_id"]], on="docdb_family_id"
+    )
+    n_links = len(df_pers_appln)
+    is_applicant = df_pers_appln["is_company"].to_numpy() | (rng.random(n_links) < 0.2)
+    is_inventor = ~df_pers_appln["is_company"].to_numpy()
+    df_pers_appln["applt_seq_nr"] = np.where(
+        is_applicant, rng.integers(1, 4, size=n_links), 0
+    )
+    df_pers_appln["invt_seq_nr"] = np.where(
+        is_inventor, rng.integers(1, 6, size=n_links), 0
+    )
+
+    generated = {
+        TLS201_APPLN.__tablename__: _insert_frame(df_appln, TLS201_APPLN),
+        TLS206_PERSON.__tablename__: _insert_frame(df_person, TLS206_PERSON),
+        TLS207_PERS_APPLN.__tablename__: _insert_frame(df_pers_appln, TLS207_PERS_APPLN),
+    }
+    logger.info(f"Generated synthetic PATSTAT data: {generated}")
+    return generated
+
+
+def benchmark_extraction(
+    country_code: str,
+    start_year: int,
+    end_year: int,
+    extraction_modes: tuple = ("batch", "temp_table"),
+) -> pd.DataFrame:
+    """
+    Time get_family_ids and get_applicant_inventor against the configured backend.
+
+    Args:
+        country_code (str): 2-letter country code.
+        start_year (int): First filing year.
+        end_year (int): Last filing year.
+        extraction_modes (tuple): Values of Config.extraction_mode to compare.
+
+    Returns:
+        pd.DataFrame: One row per step with seconds, rows and rows_per_sec.
+    """
+    # Imported here, the pipeline module pulls in the plotting/Streamlit stack
+    from get_applicants_inventors_details import get_applicant_inventor, get_family_ids
+
+    timings = []
+    start = time.perf_counter()
+    df_unique_family_ids = get_family_ids(country_code, start_year, end_year)
+    seconds = time.perf_counter() - start
+    timings.append(
+        {"step": "get_family_ids", "seconds": seconds, "rows": len(df_unique_family_ids)}
+    )
+    if df_unique_family_ids.empty:
+        logger.warning("No family IDs found for the given criteria")
+        return pd.DataFrame(timings)
+
+    family_ids_list = df_unique_family_ids["docdb_family_id"].tolist()
+    original_mode = config.Config.extraction_mode
+    try:
+        for extraction_mode in extraction_modes:
+            config.Config.update(extraction_mode=extraction_mode)
+            start = time.perf_counter()
+            df_appl_invt = get_applicant_inventor(family_ids_list)
+            seconds = time.perf_counter() - start
+            timings.append(
+                {
+                    "step": f"get_applicant_inventor[{extraction_mode}]",
+                    "seconds": seconds,
+                    "rows": len(df_appl_invt),
+                }
+            )
+    finally:
+        config.Config.update(extraction_mode=original_mode)
+
+    df_timings = pd.DataFrame(timings)
+    df_timings["rows_per_sec"] = df_timings["rows"] / df_timings["seconds"]
+    return df_timings
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Offline PATSTAT stand-in backend")
+    parser.add_argument("--db", default=config.Config.sqlite_path, help="SQLite file")
+    parser.add_argument(
+        "--output-dir", default="offline_output", help="Folder for pipeline outputs"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser("generate", help="Generate synthetic data")
+    generate_parser.add_argument("--families", type=int, default=10000)
+    generate_parser.add_argument("--start-year", type=int, default=2010)
+    generate_parser.add_argument("--end-year", type=int, default=2020)
+    generate_parser.add_argument("--seed", type=int, default=0)
+
+    csv_parser = subparsers.add_parser("load-csv", help="Load PATSTAT CSV extracts")
+    csv_parser.add_argument("csv_dir")
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="Time the extraction")
+    benchmark_parser.add_argument("--country", default=config.Config.country_code)
+    benchmark_parser.add_argument("--start-year", type=int, default=config.Config.start_year)
+    benchmark_parser.add_argument("--end-year", type=int, default=config.Config.end_year)
+
+    args = parser.parse_args()
+    use_offline_backend(args.db)
+    Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+    config.Config.update(output_dir=args.output_dir)
+
+    if args.command == "generate":
+        print(
+            generate_synthetic_patstat(
+                args.families, args.start_year, args.end_year, args.seed
+            )
+        )
+    elif args.command == "load-csv":
+        print(load_patstat_csv(args.csv_dir))
+    elif args.command == "benchmark":
+        print(benchmark_extraction(args.country, args.start_year, args.end_year))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+# Small dependency-graph executor for the analysis stages.
+# Each Stage declares the named inputs it reads and the named outputs it
+# produces; a Pipeline starts every stage as soon as its inputs exist, so
+# independent stages run concurrently on a thread pool, and logs per-stage timings.
+# LazyResults runs only the stages behind the outputs that are actually read.
+# Versioned stages are cached on disk (extract_cache storage), keyed by a content
+# hash of their inputs plus the stage version, so unchanged stages are skipped.
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+import config
+from extract_cache import load_frames, save_frames
+from family_country_matrix import FamilyCountryMatrix
+
+# Initialize Logger
+logger = logging.getLogger(__name__)
+
+# Column holding a scalar stage output stored as a one-row frame
+SCALAR_COLUMN = "__scalar__"
+
+# State of the stage running in the current worker thread, see skip_stage_cache
+_stage_state = threading.local()
+
+
+def skip_stage_cache(reason: str) -> None:
+    """
+    Keep the output of the stage running in this thread out of the stage cache,
+    e.g. when it was computed on a fallback path because a service was down, so
+    the next run computes it again. No-op outside a pipeline stage.
+    """
+    _stage_state.skip_cache_reason = reason
+
+
+def _update_hash(hasher, value) -> None:
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        dtypes = value.dtypes if isinstance(value, pd.DataFrame) else [value.dtype]
+        columns = list(value.columns) if isinstance(value, pd.DataFrame) else [value.name]
+        hasher.update(repr((columns, [str(dtype) for dtype in dtypes])).encode("utf-8"))
+        hasher.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, FamilyCountryMatrix):
+        matrix = value.matrix
+        _update_hash(hasher, [matrix.shape, matrix.data, matrix.indices, matrix.indptr])
+        _update_hash(hasher, [value.families, value.countries])
+    elif isinstance(value, np.ndarray):
+        hasher.update(repr((value.dtype.str, value.shape)).encode("utf-8"))
+        if value.dtype == object:
+            hasher.update(repr(value.tolist()).encode("utf-8"))
+        else:
+            hasher.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=repr):
+            hasher.update(repr(key).encode("utf-8"))
+            _update_hash(hasher, value[key])
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _update_hash(hasher, item)
+    else:
+        hasher.update(repr(value).encode("utf-8"))
+
+
+def hash_value(value) -> str:
+    """
+    Content hash of a stage input (DataFrames, arrays, FamilyCountryMatrix, dicts/lists
+    of them, or scalars).
+    """
+    hasher = hashlib.sha256()
+    _update_hash(hasher, value)
+    return hasher.hexdigest()[:32]
+
+
+def _encode_outputs(outputs: dict) -> Optional[dict]:
+    """Flatten stage outputs into named DataFrames, or None if not cacheable."""
+    frames = {}
+    for name, value in outputs.items():
+        if isinstance(value, pd.DataFrame):
+            frames[name] = value
+        elif isinstance(value, dict) and value and all(
+            isinstance(item, pd.DataFrame) for item in value.values()
+        ):
+            for key, df in value.items():
+                frames[f"{name}.{key}"] = df
+        elif value is None or isinstance(value, (bool, int, float, str, np.generic)):
+            frames[name] = pd.DataFrame({SCALAR_COLUMN: [value]})
+        else:
+            return None
+    return frames
+
+
+def _decode_outputs(frames: dict, output_names: tuple) -> Optional[dict]:
+    """Inverse of _encode_outputs; None if an output is missing."""
+    outputs = {}
+    for frame_name, df in frames.items():
+        name, _, key = frame_name.partition(".")
+        if key:
+            outputs.setdefault(name, {})[key] = df
+        elif list(df.columns) == [SCALAR_COLUMN]:
+            outputs[name] = df[SCALAR_COLUMN].iloc[0]
+        else:
+            outputs[name] = df
+    if set(outputs) != set(output_names):
+        return None
+    return outputs
+
+
+class Stage:
+    """
+    One named pipeline step.
+
+    Args:
+        name (str): Stage name, used in logs and timings.
+        func (Callable): Called with the input values as positional arguments, in order.
+        inputs (tuple): Names of the values func reads.
+        outputs (tuple): Names of the values func returns; with several outputs
+            func returns a tuple in the same order.
+        exclusive (bool): Never run concurrently with another exclusive stage
+            (e.g. matplotlib plotting, which is not thread safe).
+        version (str, optional): Code version of func; set it to cache the outputs
+            on disk and bump it whenever func changes what it returns.
+        config_keys (tuple): Config attributes that change the outputs, added to the cache key.
+        external_state (tuple): Callables returning a fingerprint of state the stage reads
+            besides its inputs and Config (e.g. a database or a file), added to the cache key.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        inputs: tuple = (),
+        outputs: tuple = (),
+        exclusive: bool = False,
+        version: Optional[str] = None,
+        config_keys: tuple = (),
+        external_state: tuple = (),
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.exclusive = exclusive
+        self.version = version
+        self.config_keys = tuple(config_keys)
+        self.external_state = tuple(external_state)
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, inputs={self.inputs}, outputs={self.outputs})"
+
+
+class Pipeline:
+    """
+    Run stages in dependency order, concurrently where the graph allows.
+    After a run, timings holds the seconds per stage and cached_stages the stages
+    loaded from the stage cache.
+
+    Args:
+        stages (list[Stage]): The stages; every output name must be unique.
+        workers (int, optional): Thread pool size; defaults to Config.pipeline_workers.
+        hash_memo (dict, optional): id(value) -> (value, hash) memo shared between
+            runs over the same values.
+    """
+
+    def __init__(
+        self,
+        stages: list[Stage],
+        workers: Optional[int] = None,
+        hash_memo: Optional[dict] = None,
+    ):
+        self.stages = list(stages)
+        self.workers = max(1, workers or config.Config.pipeline_workers)
+        self.timings = {}
+        self.cache_stats = {"hits": 0, "misses": 0}
+        self.cached_stages = set()
+        self._exclusive_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._hash_memo = {} if hash_memo is None else hash_memo
+
+        self.producers = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(
+                        f"Output {output!r} is produced by both "
+                        f"{self.producers[output].name!r} and {stage.name!r}."
+                    )
+                self.producers[output] = stage
+
+    def _hash_input(self, value) -> str:
+        """hash_value, memoized per object (the same frame feeds several stages)."""
+        memo = self._hash_memo.get(id(value))
+        if memo is None or memo[0] is not value:
+            memo = (value, hash_value(value))
+            self._hash_memo[id(value)] = memo
+        return memo[1]
+
+    def _cache_key_parts(self, stage: Stage, args: list) -> dict:
+        return {
+            "kind": "stage",
+            "stage": stage.name,
+            "version": stage.version,
+            "inputs": [self._hash_input(value) for value in args],
+            "config": {key: getattr(config.Config, key) for key in stage.config_keys},
+            "external": [fingerprint() for fingerprint in stage.external_state],
+        }
+
+    def _count_cache(self, outcome: str) -> None:
+        with self._stats_lock:
+            self.cache_stats[outcome] += 1
+
+    def _call_stage(self, stage: Stage, args: list) -> dict:
+        """Call the stage function and map its return value onto its output names."""
+        if stage.exclusive:
+            with self._exclusive_lock:
+                result = stage.func(*args)
+        else:
+            result = stage.func(*args)
+
+        if len(stage.outputs) == 0:
+            return {}
+        if len(stage.outputs) == 1:
+            return {stage.outputs[0]: result}
+        if len(result) != len(stage.outputs):
+            raise ValueError(
+                f"Stage {stage.name!r} returned {len(result)} values, "
+                f"expected {len(stage.outputs)} ({stage.outputs})."
+            )
+        return dict(zip(stage.outputs, result))
+
+    def _run_stage(self, stage: Stage, args: list) -> dict:
+        """Run one stage, through the stage cache when it is versioned."""
+        start_time = time.perf_counter()
+        use_cache = stage.version is not None and config.Config.use_stage_cache
+        if not use_cache:
+            outputs = self._call_stage(stage, args)
+            source = "finished"
+        else:
+            key_parts = self._cache_key_parts(stage, args)
+            frames = load_frames(key_parts)
+            outputs = None if frames is None else _decode_outputs(frames, stage.outputs)
+            if outputs is not None:
+                self._count_cache("hits")
+                self.cached_stages.add(stage.name)
+                source = "loaded from stage cache"
+            else:
+                self._count_cache("misses")
+                _stage_state.skip_cache_reason = None
+                try:
+                    outputs = self._call_stage(stage, args)
+                finally:
+                    skip_reason = _stage_state.skip_cache_reason
+                    _stage_state.skip_cache_reason = None
+                source = "finished"
+                frames = _encode_outputs(outputs)
+                if skip_reason:
+                    logger.warning(f"Stage '{stage.name}' not cached: {skip_reason}")
+                elif frames is None:
+                    logger.warning(f"Stage '{stage.name}' outputs cannot be cached")
+                else:
+                    try:
+                        save_frames(key_parts, frames, index=True)
+                    except Exception as e:
+                        logger.warning(f"Could not cache stage '{stage.name}': {e}")
+
+        elapsed = time.perf_counter() - start_time
+        self.timings[stage.name] = elapsed
+        logger.info(f"Stage '{stage.name}' {source} in {elapsed:.2f}s")
+        return outputs
+
+    def run(self, inputs: dict) -> dict:
+        """
+        Run all stages.
+
+        Args:
+            inputs (dict): Initial values, by name.
+
+        Returns:
+            dict: The initial values plus every stage output, by name.
+        """
+        results = dict(inputs)
+        missing = {
+            name
+            for stage in self.stages
+            for name in stage.inputs
+            if name not in results and name not in self.producers
+        }
+        if missing:
+            raise ValueError(f"No input or stage provides {sorted(missing)}.")
+
+        self.timings = {}
+        self.cached_stages = set()
+        pending = list(self.stages)
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            running = {}
+            while pending or running:
+                # Submit every stage whose inputs are all available
+                for stage in [s for s in pending if all(i in results for i in s.inputs)]:
+                    pending.remove(stage)
+                    args = [results[name] for name in stage.inputs]
+                    running[executor.submit(self._run_stage, stage, args)] = stage
+                if not running:
+                    raise ValueError(
+                        f"Stages {[s.name for s in pending]} can never run (dependency cycle)."
+                    )
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        results.update(future.result())
+                    except Exception:
+                        logger.error(f"Stage '{stage.name}' failed")
+                        for other in running:
+                            other.cancel()
+                        raise
+
+        elapsed = time.perf_counter() - start_time
+        logger.info(
+            f"Pipeline finished in {elapsed:.2f}s "
+            f"({sum(self.timings.values()):.2f}s of stage time on {self.workers} workers)"
+        )
+        if self.cache_stats["hits"] or self.cache_stats["misses"]:
+            logger.info(
+                f"Stage cache: {self.cache_stats['hits']} hits, "
+                f"{self.cache_stats['misses']} misses"
+            )
+        return results
+
+    def lazy(self, inputs: dict) -> "LazyResults":
+        """Wrap the stages in a LazyResults that computes outputs on first access."""
+        return LazyResults(self, inputs)
+
+
+class LazyResults:
+    """
+    Stage outputs computed on first access and memoized.
+
+    Outputs are read as attributes or items; a "df_" prefix may be left out, so
+    results.applicant_ratios and results["df_applicant_ratios"] are the same
+    frame. Only the stages an output depends on are run, concurrently where
+    the graph allows.
+
+    Args:
+        pipeline (Pipeline): Stages and worker count.
+        inputs (dict): Initial values, by name.
+    """
+
+    def __init__(self, pipeline: Pipeline, inputs: dict):
+        self._pipeline = pipeline
+        self._values = dict(inputs)
+        self._lock = threading.RLock()
+        self._hash_memo = {}
+        self.timings = {}
+        self.cache_stats = {"hits": 0, "misses": 0}
+        self.cached_stages = set()
+
+    def _resolve_name(self, name: str) -> str:
+        for candidate in (name, f"df_{name}"):
+            if candidate in self._values or candidate in self._pipeline.producers:
+                return candidate
+        raise KeyError(f"Unknown pipeline output: {name!r}")
+
+    def compute(self, *names: str) -> list:
+        """
+        Compute (if needed) and return the given outputs.
+
+        Returns:
+            list: The values, in the order of names.
+        """
+        names = [self._resolve_name(name) for name in names]
+        with self._lock:
+            # Collect the stages still needed for the requested outputs
+            needed = {}
+            to_visit = [name for name in names if name not in self._values]
+            while to_visit:
+                stage = self._pipeline.producers[to_visit.pop()]
+                if stage.name in needed:
+                    continue
+                needed[stage.name] = stage
+                to_visit.extend(i for i in stage.inputs if i not in self._values)
+
+            if needed:
+                sub_pipeline = Pipeline(
+                    [s for s in self._pipeline.stages if s.name in needed],
+                    workers=self._pipeline.workers,
+                    hash_memo=self._hash_memo,
+                )
+                self._values.update(sub_pipeline.run(self._values))
+                self.timings.update(sub_pipeline.timings)
+                self.cached_stages.update(sub_pipeline.cached_stages)
+                for outcome, count in sub_pipeline.cache_stats.items():
+                    self.cache_stats[outcome] += count
+            return [self._values[name] for name in names]
+
+    def provides(self, name: str) -> bool:
+        """Whether name is an input or the output of a stage."""
+        try:
+            self._resolve_name(name)
+        except KeyError:
+            return False
+        return True
+
+    def is_computed(self, name: str) -> bool:
+        return self._resolve_name(name) in self._values
+
+    def __getitem__(self, name: str):
+        return self.compute(name)[0]
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError as e:
+            raise AttributeError(str(e)) from None
@@ -6,11 +6,72 @@ import logging
 from typing import Optional
 from typing import Union
 import config
+from family_country_matrix import (
+    FamilyCountryMatrix,
+    descending_order,
+    shared_matrices,
+)
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
 
+def _percentage_table(
+    df_final: pd.DataFrame,
+    value_column: str,
+    sort_by_country: str,
+    max_countries: int,
+    fallback_to_top: bool = False,
+    matrix: Optional[FamilyCountryMatrix] = None,
+) -> tuple[pd.DataFrame, list]:
+    """
+    Percentage contribution of each country per family, ready for a stacked bar chart.
+
+    Percentages, country means and the 'Others' rollup are computed on the sparse
+    family x country matrix; only the top countries are densified.
+
+    Args:
+        df_final (pd.DataFrame): Long frame with docdb_family_id, person_ctry_code and value_column.
+        value_column (str): Ratio or count column.
+        sort_by_country (str): Country code to sort the families by.
+        max_countries (int): Countries shown before the rest is rolled into 'Others'.
+        fallback_to_top (bool): Sort by the top country when sort_by_country is absent.
+        matrix (FamilyCountryMatrix, optional): The counts or ratios of df_final already
+            encoded (e.g. from count_matrices); rows are normalized, so either gives
+            the same percentages. Built from df_final when not given.
+
+    Returns:
+        tuple: (percentage_table, top_countries); countries are ordered by mean
+        contribution and families by their sort_by_country percentage.
+    """
+    if matrix is None:
+        matrix = FamilyCountryMatrix.from_long(df_final, value_column)
+    else:
+        matrix = matrix.compact()
+    matrix = matrix.row_normalize(100)
+
+    # Sort countries by mean contribution across families
+    country_means = matrix.country_means()
+    country_order = list(country_means.index[descending_order(country_means.to_numpy())])
+
+    # Sort families by the specified country if present
+    row_order = None
+    if sort_by_country in country_order:
+        row_order = descending_order(matrix.column(sort_by_country))
+    elif fallback_to_top:
+        logger.warning(f"'{sort_by_country}' not found; sorting by top country.")
+        row_order = descending_order(matrix.column(country_order[0]))
+
+    # Aggregate less significant countries into 'Others'
+    if len(country_order) > max_countries:
+        top_countries = country_order[:max_countries]
+        percentage_table = matrix.to_frame(top_countries, row_order, others="Others")
+    else:
+        top_countries = country_order
+        percentage_table = matrix.to_frame(top_countries, row_order)
+    return percentage_table, top_countries
+
+
 ############### USINING PLOtly graph for intercation
 import plotly.graph_objects as go
 def plot_appl_invt_ratios_interactive(
@@ -53,37 +114,14 @@ def plot_appl_invt_ratios_interactive(
             logger.warning(f"No data to plot for {ratio_type} ratios")
             continue
 
-        # Create pivot table and calculate percentages
-        pivot_table = df_final.pivot(
-            index="docdb_family_id",
-            columns="person_ctry_code",
-            values=f"{ratio_type}_ratio",
-        ).fillna(0)
-        percentage_table = pivot_table.div(pivot_table.sum(axis=1), axis=0) * 100
-
-        # Sort by mean contribution across families
-        country_order = percentage_table.mean().sort_values(ascending=False).index
-        percentage_table = percentage_table[country_order]
-
-        # Sort by the specified country if present
-        if sort_by_country in percentage_table.columns:
-            percentage_table = percentage_table.sort_values(
-                by=sort_by_country, ascending=False
-            )
-        else:
-            logger.warning(f"'{sort_by_country}' not found; sorting by top country.")
-            percentage_table = percentage_table.sort_values(
-                by=country_order[0], ascending=False
-            )
-
-        # Aggregate less significant countries into 'Others'
-        if len(percentage_table.columns) > max_legend_countries:
-            top_countries = percentage_table.columns[:max_legend_countries]
-            others_countries = percentage_table.columns[max_legend_countries:]
-            percentage_table["Others"] = percentage_table[others_countries].sum(axis=1)
-            percentage_table = percentage_table.drop(columns=others_countries)
-        else:
-            top_countries = percentage_table.columns
+        # Percentages per family, with minor countries rolled into 'Others'
+        percentage_table, top_countries = _percentage_table(
+            df_final,
+            f"{ratio_type}_ratio",
+            sort_by_country,
+            max_legend_countries,
+            fallback_to_top=True,
+        )
 
         # Reset index for plotting (1-based index)
         percentage_table = percentage_table.reset_index(drop=True)
@@ -141,6 +179,7 @@ def plot_appl_invt_ratios(
     output_dir: Path = None,  # Default to None, will use config.output_dir
     figsize: tuple = (12, 8),
     dpi: int = 300,
+    matrices: Optional[dict] = None,
 ) -> None:
     """
     Plot stacked bar charts of country ratios for applicants, inventors, and combined for each docdb_family_id.
@@ -153,6 +192,8 @@ def plot_appl_invt_ratios(
         output_dir (Path, optional): Directory to save the plots; defaults to config.output_dir/plots/applicants_inventors
         figsize (tuple): Figure size (width, height) in inches (default (12, 8))
         dpi (int): Resolution of the saved plot (default 300)
+        matrices (dict, optional): count_matrices output of the same run; the
+            matrices are built from the ratio frames when not given
     """
     # Use config.output_dir
     base_output_dir = Path(config.Config.output_dir)
@@ -176,32 +217,14 @@ def plot_appl_invt_ratios(
         if df_final.empty:
             logger.warning(f"No data to plot for {ratio_type} ratios")
             continue
-        # Create pivot table and calculate percentages
-        pivot_table = df_final.pivot(
-            index="docdb_family_id",
-            columns="person_ctry_code",
-            values=f"{ratio_type}_ratio",
-        ).fillna(0)
-        percentage_table = pivot_table.div(pivot_table.sum(axis=1), axis=0) * 100
-
-        # Sort by mean contribution across families
-        country_order = percentage_table.mean().sort_values(ascending=False).index
-        percentage_table = percentage_table[country_order]
-
-        # Sort by the specified country if present
-        if sort_by_country in percentage_table.columns:
-            percentage_table = percentage_table.sort_values(
-                by=sort_by_country, ascending=False
-            )
-
-        # Aggregate less significant countries into 'Others'
-        if len(percentage_table.columns) > MAX_COUNTRIES_IN_LEGEND:
-            top_countries = percentage_table.columns[:MAX_COUNTRIES_IN_LEGEND]
-            others_countries = percentage_table.columns[MAX_COUNTRIES_IN_LEGEND:]
-            percentage_table["Others"] = percentage_table[others_countries].sum(axis=1)
-            percentage_table = percentage_table.drop(columns=others_countries)
-        else:
-            top_countries = percentage_table.columns
+        # Percentages per family, with minor countries rolled into 'Others'
+        percentage_table, top_countries = _percentage_table(
+            df_final,
+            f"{ratio_type}_ratio",
+            sort_by_country,
+            MAX_COUNTRIES_IN_LEGEND,
+            matrix=matrices[ratio_type] if matrices is not None else None,
+        )
 
         # Reset index for plotting (1-based index)
         percentage_table = percentage_table.reset_index(drop=True)
@@ -259,7 +282,9 @@ def plot_appl_invt_counts(
     output_dir: Path = None,
     figsize: tuple = (12, 8),
     dpi: int = 300,
+    matrices: Optional[dict] = None,
 ) -> None:
+    # matrices: count_matrices output of the same run, built from the frames when not given
     # Use config.output_dir if output_dir is not provided
     base_output_dir = (
         output_dir if output_dir is not None else Path(config.Config.output_dir)
@@ -301,41 +326,41 @@ def plot_appl_invt_counts(
             logger.warning(f"No data to plot for {count_type} counts")
             continue
 
-        # Pivot table to get counts per docdb_family_id and person_ctry_code
-        pivot_table = df_final.pivot(
-            index="docdb_family_id",
-            columns="person_ctry_code",
-            values=f"{count_type}_count",
-        ).fillna(0)
-
-        # Sort by 'sort_by_country' counts if it exists, otherwise by index
-        if sort_by_country in pivot_table.columns:
-            pivot_table = pivot_table.sort_values(by=sort_by_country, ascending=False)
+        # Sparse counts per docdb_family_id and person_ctry_code
+        if matrices is not None:
+            matrix = matrices[count_type].compact()
         else:
-            pivot_table = pivot_table.sort_index()
+            matrix = FamilyCountryMatrix.from_long(df_final, f"{count_type}_count")
+        countries = list(matrix.countries)
+
+        # Sort by 'sort_by_country' counts if it exists, otherwise by family id
+        row_order = None
+        if sort_by_country in countries:
+            row_order = descending_order(matrix.column(sort_by_country))
 
         # Aggregate less significant countries into 'Others'
-        if len(pivot_table.columns) > MAX_COUNTRIES_IN_LEGEND:
-            country_totals = pivot_table.sum()
-            non_zero_countries = country_totals[country_totals > 0].index
+        if len(countries) > MAX_COUNTRIES_IN_LEGEND:
+            non_zero_countries = matrix.nonzero_countries()
 
             # Always include 'sort_by_country' in top_countries if it has non-zero count
             if sort_by_country in non_zero_countries:
                 top_countries = [sort_by_country]
-                remaining_countries = non_zero_countries.difference([sort_by_country])
-                top_remaining = remaining_countries[: MAX_COUNTRIES_IN_LEGEND - 1]
-                top_countries.extend(top_remaining)
+                remaining_countries = [
+                    c for c in non_zero_countries if c != sort_by_country
+                ]
+                top_countries.extend(remaining_countries[: MAX_COUNTRIES_IN_LEGEND - 1])
             else:
                 top_countries = non_zero_countries[:MAX_COUNTRIES_IN_LEGEND]
 
-            others_countries = non_zero_countries.difference(top_countries)
-            if others_countries.any():
-                pivot_table["Others"] = pivot_table[others_countries].sum(axis=1)
-            else:
-                pivot_table["Others"] = 0
-            pivot_table = pivot_table.drop(columns=others_countries)
+            others_countries = set(non_zero_countries).difference(top_countries)
+            pivot_table = matrix.to_frame(
+                [c for c in countries if c not in others_countries],
+                row_order,
+                others="Others",
+            )
         else:
-            top_countries = pivot_table.columns
+            top_countries = countries
+            pivot_table = matrix.to_frame(countries, row_order)
 
         # Reset index for plotting (1-based index)
         pivot_table = pivot_table.reset_index(drop=True)
@@ -416,6 +441,7 @@ def plot_appl_invt_side_by_side(
     output_dir: Path = None,
     figsize: tuple = (12, 8),
     dpi: int = 300,
+    matrices: Optional[dict] = None,
 ) -> None:
     """
     Plot side-by-side bar charts of inventor and applicant counts per country for each docdb_family_id.
@@ -427,6 +453,8 @@ def plot_appl_invt_side_by_side(
         output_dir (Path, optional): Directory to save the plots; defaults to config.output_dir/plots/applicants_inventors
         figsize (tuple): Figure size (width, height) in inches (default (12, 8))
         dpi (int): Resolution of the saved plot (default 300)
+        matrices (dict, optional): count_matrices output of the same run; built from
+            the frames when not given
     """
     # Use config.output_dir if output_dir is not provided
     base_output_dir = (
@@ -457,34 +485,30 @@ def plot_appl_invt_side_by_side(
     color_map = {country: colors[i] for i, country in enumerate(all_countries)}
     color_map["Others"] = "gray"
 
-    # Pivot tables for inventors and applicants
-    inventor_pivot = df_inventor_counts.pivot(
-        index="docdb_family_id", columns="person_ctry_code", values="inventor_count"
-    ).fillna(0)
-    applicant_pivot = df_applicant_counts.pivot(
-        index="docdb_family_id", columns="person_ctry_code", values="applicant_count"
-    ).fillna(0)
-
-    # Ensure both pivots have the same index
-    all_families = inventor_pivot.index.union(applicant_pivot.index)
-    inventor_pivot = inventor_pivot.reindex(all_families, fill_value=0)
-    applicant_pivot = applicant_pivot.reindex(all_families, fill_value=0)
+    # Sparse counts for inventors and applicants on the same family axis
+    if matrices is None:
+        matrices = shared_matrices(
+            {
+                "inventor": (df_inventor_counts, "inventor_count"),
+                "applicant": (df_applicant_counts, "applicant_count"),
+            }
+        )
 
     # Sort by total 'sort_by_country' counts (inventors + applicants)
-    if (
-        sort_by_country in inventor_pivot.columns
-        or sort_by_country in applicant_pivot.columns
-    ):
-        no_inventors = inventor_pivot.get(
-            sort_by_country, pd.Series(0, index=inventor_pivot.index)
-        )
-        no_applicants = applicant_pivot.get(
-            sort_by_country, pd.Series(0, index=applicant_pivot.index)
-        )
-        total_no_counts = no_inventors + no_applicants
-        sort_order = total_no_counts.sort_values(ascending=False).index
-        inventor_pivot = inventor_pivot.loc[sort_order]
-        applicant_pivot = applicant_pivot.loc[sort_order]
+    row_order = None
+    if sort_by_country in matrices["inventor"].countries:
+        total_no_counts = matrices["inventor"].column(sort_by_country) + matrices[
+            "applicant"
+        ].column(sort_by_country)
+        row_order = descending_order(total_no_counts)
+
+    # Densify only the countries each role actually has
+    inventor_pivot = matrices["inventor"].to_frame(
+        matrices["inventor"].nonzero_countries(), row_order
+    )
+    applicant_pivot = matrices["applicant"].to_frame(
+        matrices["applicant"].nonzero_countries(), row_order
+    )
 
     # Reset index for plotting (1-based index)
     inventor_pivot = inventor_pivot.reset_index(drop=True)
@@ -608,6 +632,7 @@ def plot_appl_invt_indiv_non_indiv(
     output_dir: Path = None,
     figsize: tuple = (12, 8),
     dpi: int = 300,
+    matrices: Optional[dict] = None,
 ) -> None:
     """
     Plot positive and negative bar charts for individual/non-individual inventors and applicants per country for each docdb_family_id.
@@ -621,6 +646,8 @@ def plot_appl_invt_indiv_non_indiv(
         output_dir (Path, optional): Directory to save the plots; defaults to config.output_dir/plots/applicants_inventors
         figsize (tuple): Figure size (width, height) in inches (default (12, 8))
         dpi (int): Resolution of the saved plot (default 300)
+        matrices (dict, optional): indiv_non_indiv_matrices output of the same run;
+            built from the frames when not given
     """
     # Use config.output_dir if output_dir is not provided
     base_output_dir = (
@@ -661,53 +688,28 @@ def plot_appl_invt_indiv_non_indiv(
     color_map = {country: colors[i] for i, country in enumerate(all_countries)}
     color_map["Others"] = "gray"
 
-    # Pivot tables
-    invt_indiv_pivot = df_invt_indiv_counts.pivot(
-        index="docdb_family_id", columns="person_ctry_code", values="invt_indiv_count"
-    ).fillna(0)
-    invt_non_indiv_pivot = df_invt_non_indiv_counts.pivot(
-        index="docdb_family_id",
-        columns="person_ctry_code",
-        values="invt_non_indiv_count",
-    ).fillna(0)
-    appl_non_indiv_pivot = df_appl_non_indiv_counts.pivot(
-        index="docdb_family_id",
-        columns="person_ctry_code",
-        values="appl_non_indiv_count",
-    ).fillna(0)
-    appl_indiv_pivot = df_appl_indiv_counts.pivot(
-        index="docdb_family_id", columns="person_ctry_code", values="appl_indiv_count"
-    ).fillna(0)
-
-    # Ensure all pivots have the same index
-    all_families = (
-        invt_indiv_pivot.index.union(invt_non_indiv_pivot.index)
-        .union(appl_non_indiv_pivot.index)
-        .union(appl_indiv_pivot.index)
-    )
-    invt_indiv_pivot = invt_indiv_pivot.reindex(all_families, fill_value=0)
-    invt_non_indiv_pivot = invt_non_indiv_pivot.reindex(all_families, fill_value=0)
-    appl_non_indiv_pivot = appl_non_indiv_pivot.reindex(all_families, fill_value=0)
-    appl_indiv_pivot = appl_indiv_pivot.reindex(all_families, fill_value=0)
+    # Sparse counts for all four categories on the same family axis
+    if matrices is None:
+        matrices = shared_matrices(
+            {
+                "invt_indiv": (df_invt_indiv_counts, "invt_indiv_count"),
+                "invt_non_indiv": (df_invt_non_indiv_counts, "invt_non_indiv_count"),
+                "appl_non_indiv": (df_appl_non_indiv_counts, "appl_non_indiv_count"),
+                "appl_indiv": (df_appl_indiv_counts, "appl_indiv_count"),
+            }
+        )
 
     # Sort by total 'sort_by_country' counts across all categories
-    total_sort_counts = (
-        invt_indiv_pivot.get(sort_by_country, pd.Series(0, index=invt_indiv_pivot.index))
-        + invt_non_indiv_pivot.get(
-            sort_by_country, pd.Series(0, index=invt_non_indiv_pivot.index)
-        )
-        + appl_non_indiv_pivot.get(
-            sort_by_country, pd.Series(0, index=appl_non_indiv_pivot.index)
-        )
-        + appl_indiv_pivot.get(
-            sort_by_country, pd.Series(0, index=appl_indiv_pivot.index)
-        )
+    total_sort_counts = sum(
+        matrix.column(sort_by_country) for matrix in matrices.values()
+    )
+    sort_order = descending_order(total_sort_counts)
+
+    # Densify only the countries each category actually has
+    invt_indiv_pivot, invt_non_indiv_pivot, appl_non_indiv_pivot, appl_indiv_pivot = (
+        matrices[category].to_frame(matrices[category].nonzero_countries(), sort_order)
+        for category in ("invt_indiv", "invt_non_indiv", "appl_non_indiv", "appl_indiv")
     )
-    sort_order = total_sort_counts.sort_values(ascending=False).index
-    invt_indiv_pivot = invt_indiv_pivot.loc[sort_order]
-    invt_non_indiv_pivot = invt_non_indiv_pivot.loc[sort_order]
-    appl_non_indiv_pivot = appl_non_indiv_pivot.loc[sort_order]
-    appl_indiv_pivot = appl_indiv_pivot.loc[sort_order]
 
     # Reset index for plotting (1-based index)
     invt_indiv_pivot = invt_indiv_pivot.reset_index(drop=True)
@@ -900,6 +902,8 @@ def plot_individ_appl_invt_ratios(
     output_dir: Path = None,  # Default to None, will use config.output_dir
     figsize: tuple = (12, 8),
     dpi: int = 300,
+    count_matrices: Optional[dict] = None,
+    indiv_non_indiv_matrices: Optional[dict] = None,
 ) -> None:
     """
     Plot individual applicant/inventor ratios as line or bar charts.
@@ -913,6 +917,9 @@ def plot_individ_appl_invt_ratios(
         output_dir (Path, optional): Directory to save plots
         figsize (tuple): Figure size (default (12, 8))
         dpi (int): Resolution of saved plots (default 300)
+        count_matrices (dict, optional): count_matrices output of the same run
+        indiv_non_indiv_matrices (dict, optional): indiv_non_indiv_matrices output of
+            the same run; the individual applicant ratios are derived from it
     """
     # Set output directory
     base_output_dir = (
@@ -939,35 +946,46 @@ def plot_individ_appl_invt_ratios(
             continue
 
         if ratio_type == "indiv_applicant":
-            # Pivot table for individual applicant ratio
-            pivot_table = df_final.pivot(
-                index="docdb_family_id",
-                columns="person_ctry_code",
-                values="indiv_applicant_ratio",
-            ).fillna(0)
+            # Sparse individual applicant ratios per family and country
+            if indiv_non_indiv_matrices is not None:
+                # appl_indiv_count / all applicants of the family, see individ_applicant
+                appl_indiv = indiv_non_indiv_matrices["appl_indiv"]
+                appl_non_indiv = indiv_non_indiv_matrices["appl_non_indiv"]
+                matrix = appl_indiv.divide_rows(
+                    appl_indiv.row_sums() + appl_non_indiv.row_sums()
+                ).restrict(
+                    appl_indiv.matrix.getnnz(axis=1) + appl_non_indiv.matrix.getnnz(axis=1) > 0,
+                    appl_indiv.matrix.getnnz(axis=0) + appl_non_indiv.matrix.getnnz(axis=0) > 0,
+                )
+            else:
+                matrix = FamilyCountryMatrix.from_long(df_final, "indiv_applicant_ratio")
 
             # Sort by specified country if present
-            if sort_by_country in pivot_table.columns:
-                pivot_table_filtered = pivot_table[pivot_table[sort_by_country].notna()]
-                pivot_table_sorted = pivot_table_filtered.sort_values(
-                    by=sort_by_country, ascending=False
-                )
+            row_order = None
+            if sort_by_country in matrix.countries:
+                row_order = descending_order(matrix.column(sort_by_country))
             else:
-                pivot_table_sorted = pivot_table
                 logger.warning(
                     f"Specified country '{sort_by_country}' not found in data"
                 )
 
             # Determine top countries based on mean ratio
-            mean_ratios = pivot_table_sorted.mean().sort_values(ascending=False)
-            top_countries = mean_ratios.index[:MAX_COUNTRIES_IN_LEGEND]
+            mean_ratios = matrix.country_means()
+            top_countries = list(
+                mean_ratios.index[descending_order(mean_ratios.to_numpy())][
+                    :MAX_COUNTRIES_IN_LEGEND
+                ]
+            )
 
             # Include specified country if not in top N
             if (
                 sort_by_country not in top_countries
-                and sort_by_country in pivot_table_sorted.columns
+                and sort_by_country in matrix.countries
             ):
-                top_countries = list(top_countries) + [sort_by_country]
+                top_countries = top_countries + [sort_by_country]
+
+            # Densify only the plotted countries
+            pivot_table_sorted = matrix.to_frame(top_countries, row_order)
 
             # Reset index for plotting (1-based index)
             pivot_table_sorted = pivot_table_sorted.reset_index(drop=True)
@@ -1008,34 +1026,14 @@ def plot_individ_appl_invt_ratios(
             logger.info(f"Saved plot as {filename}")
             plt.close()
         else:
-            # Pivot table for other ratio types
-            pivot_table = df_final.pivot(
-                index="docdb_family_id",
-                columns="person_ctry_code",
-                values=f"{ratio_type}_ratio",
-            ).fillna(0)
-            percentage_table = pivot_table.div(pivot_table.sum(axis=1), axis=0) * 100
-
-            # Sort by mean contribution across families
-            country_order = percentage_table.mean().sort_values(ascending=False).index
-            percentage_table = percentage_table[country_order]
-
-            # Sort by the specified country if present
-            if sort_by_country in percentage_table.columns:
-                percentage_table = percentage_table.sort_values(
-                    by=sort_by_country, ascending=False
-                )
-
-            # Aggregate less significant countries into 'Others'
-            if len(percentage_table.columns) > MAX_COUNTRIES_IN_LEGEND:
-                top_countries = percentage_table.columns[:MAX_COUNTRIES_IN_LEGEND]
-                others_countries = percentage_table.columns[MAX_COUNTRIES_IN_LEGEND:]
-                percentage_table["Others"] = percentage_table[others_countries].sum(
-                    axis=1
-                )
-                percentage_table = percentage_table.drop(columns=others_countries)
-            else:
-                top_countries = percentage_table.columns
+            # Percentages per family, with minor countries rolled into 'Others'
+            percentage_table, top_countries = _percentage_table(
+                df_final,
+                f"{ratio_type}_ratio",
+                sort_by_country,
+                MAX_COUNTRIES_IN_LEGEND,
+                matrix=count_matrices[ratio_type] if count_matrices is not None else None,
+            )
 
             # Reset index for plotting (1-based index)
             percentage_table = percentage_table.reset_index(drop=True)
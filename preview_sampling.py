@@ -0,0 +1,137 @@
+# Stratified family samples for quick preview runs.
+# Families are stratified by filing year and family size bucket, a reproducible
+# sample is drawn with proportional allocation, and family-level metrics computed
+# on the sample are expanded to the population with the stratified mean estimator
+# and a normal-approximation confidence interval.
+import logging
+
+import numpy as np
+import pandas as pd
+
+# Initialize Logger
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the docdb_family_size buckets (the last bucket is open ended)
+FAMILY_SIZE_BUCKETS = [1, 3, 7, 15]
+
+# Two-sided 95% normal quantile
+Z_95 = 1.959964
+
+
+def family_size_bucket(family_size: pd.Series) -> pd.Series:
+    """Bucket index of each family size: 1, 2-3, 4-7, 8-15 and 16+."""
+    return pd.Series(
+        np.searchsorted(FAMILY_SIZE_BUCKETS, family_size.to_numpy(), side="left"),
+        index=family_size.index,
+    )
+
+
+def stratified_sample(df_families: pd.DataFrame, sample_size: int, seed: int) -> pd.DataFrame:
+    """
+    Draw a reproducible stratified sample of families.
+
+    Strata are (filing year, family size bucket); each stratum gets a share of the
+    sample proportional to its size (largest remainder rounding, at least one
+    family per stratum while the sample size allows).
+
+    Args:
+        df_families (pd.DataFrame): One row per family with docdb_family_id,
+            appln_filing_year and docdb_family_size.
+        sample_size (int): Families to draw; the whole population if larger.
+        seed (int): Random seed, the same seed and population give the same sample.
+
+    Returns:
+        pd.DataFrame: Sampled docdb_family_id with their stratum, stratum_size (N_h)
+        and stratum_sample_size (n_h), ordered by family ID.
+    """
+    df = df_families.sort_values("docdb_family_id").reset_index(drop=True)
+    df["stratum"] = (
+        df["appln_filing_year"].astype(str)
+        + "/"
+        + family_size_bucket(df["docdb_family_size"]).astype(str)
+    )
+    stratum_sizes = df["stratum"].value_counts().sort_index()
+    sample_size = min(sample_size, len(df))
+
+    # Step 1: Proportional allocation with largest remainder rounding
+    quotas = stratum_sizes * sample_size / len(df)
+    allocation = np.floor(quotas).astype(int)
+    if sample_size >= len(stratum_sizes):
+        allocation = allocation.clip(lower=1)
+    remainder = sample_size - allocation.sum()
+    if remainder > 0:
+        order = (quotas - allocation).sort_values(ascending=False, kind="stable").index
+        allocation[order[:remainder]] += 1
+    elif remainder < 0:
+        # The one-per-stratum minimum overshot: take back from the largest strata
+        for stratum in allocation.sort_values(ascending=False, kind="stable").index:
+            if remainder == 0:
+                break
+            if allocation[stratum] > 1:
+                allocation[stratum] -= 1
+                remainder += 1
+
+    # Step 2: Random families within each stratum
+    rng = np.random.default_rng(seed)
+    df["random_rank"] = rng.permutation(len(df))
+    df = df.sort_values(["stratum", "random_rank"])
+    df["rank_in_stratum"] = df.groupby("stratum").cumcount()
+    sample = df[df["rank_in_stratum"] < df["stratum"].map(allocation)]
+
+    sample = sample.assign(
+        stratum_size=sample["stratum"].map(stratum_sizes).astype(int),
+        stratum_sample_size=sample["stratum"].map(allocation).astype(int),
+    )
+    logger.info(
+        f"Drew a stratified sample of {len(sample)} of {len(df)} families "
+        f"over {int((allocation > 0).sum())} strata (seed {seed})"
+    )
+    return (
+        sample[["docdb_family_id", "stratum", "stratum_size", "stratum_sample_size"]]
+        .sort_values("docdb_family_id")
+        .reset_index(drop=True)
+    )
+
+
+def stratified_mean(values: pd.Series, df_sample: pd.DataFrame) -> dict:
+    """
+    Population mean of a family-level metric from a stratified sample.
+
+    Families of the sample without a value (e.g. no inventor of known gender) are
+    left out of their stratum; strata without any value are dropped and the
+    remaining stratum weights renormalized, so domain metrics are approximate.
+
+    Args:
+        values (pd.Series): Metric per docdb_family_id (index).
+        df_sample (pd.DataFrame): Output of stratified_sample.
+
+    Returns:
+        dict: estimate, ci_low, ci_high (95%) and n (sampled families with a value).
+    """
+    df = df_sample.assign(value=df_sample["docdb_family_id"].map(values)).dropna(
+        subset=["value"]
+    )
+    if df.empty:
+        return {"estimate": np.nan, "ci_low": np.nan, "ci_high": np.nan, "n": 0}
+
+    strata = df.groupby("stratum").agg(
+        mean=("value", "mean"),
+        var=("value", "var"),
+        n=("value", "size"),
+        N=("stratum_size", "first"),
+    )
+    strata["var"] = strata["var"].fillna(0.0)
+    weights = strata["N"] / strata["N"].sum()
+
+    estimate = float((weights * strata["mean"]).sum())
+    # Variance with the finite population correction per stratum
+    variance = float(
+        (weights**2 * (1 - strata["n"] / strata["N"]) * strata["var"] / strata["n"]).sum()
+    )
+    margin = Z_95 * np.sqrt(variance)
+    return {
+        "estimate": estimate,
+        "ci_low": estimate - margin,
+        "ci_high": estimate + margin,
+        "n": int(strata["n"].sum()),
+    }
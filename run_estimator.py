@@ -0,0 +1,171 @@
+# Dry-run size and time estimates for an extraction and analysis run.
+# Every run records its extraction and per-stage throughput (rows per second) and the
+# in-memory size of df_appl_invt per row in a small JSON history; predict_run turns
+# the row and family counts of a planned run (cheap COUNT queries, see
+# get_applicants_inventors_details.estimate_applicants_inventors_run) into predicted
+# memory and wall time, and a suggested execution mode.
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+import config
+
+# Initialize Logger
+logger = logging.getLogger(__name__)
+
+# Used until a run has been recorded (measured on a synthetic extract)
+DEFAULT_ROWS_PER_SECOND = {"extract": 20_000, "analysis": 75_000}
+DEFAULT_BYTES_PER_ROW = 170  # Compact df_appl_invt, see compact_appl_invt
+
+# Throughput keys that are not individual analysis stages
+EXTRACT = "extract"
+ANALYSIS = "analysis"
+
+_history_lock = threading.Lock()
+
+
+class ThroughputHistory:
+    """
+    Recent throughput of previous runs, kept in a JSON file.
+
+    Args:
+        path (str, optional): History file; defaults to Config.throughput_history_path.
+        max_records (int, optional): Records kept per stage; defaults to
+            Config.throughput_history_size.
+    """
+
+    def __init__(self, path: str = None, max_records: int = None):
+        self.path = Path(path or config.Config.throughput_history_path)
+        self.max_records = max_records or config.Config.throughput_history_size
+        self.data = self._load()
+
+    def _load(self) -> dict:
+        if self.path.is_file():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Ignoring unreadable throughput history {self.path}: {e}")
+        return {"stages": {}, "bytes_per_row": []}
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def record(self, timings: dict, rows: int, bytes_per_row: float = None) -> None:
+        """
+        Add one run.
+
+        Args:
+            timings (dict): Stage (or EXTRACT / ANALYSIS) -> seconds.
+            rows (int): df_appl_invt rows processed.
+            bytes_per_row (float, optional): In-memory size of df_appl_invt per row.
+        """
+        if rows <= 0:
+            return
+        with _history_lock:
+            self.data = self._load()
+            for stage, seconds in timings.items():
+                if seconds <= 0:
+                    continue
+                records = self.data["stages"].setdefault(stage, [])
+                records.append({"rows": int(rows), "seconds": float(seconds), "recorded": time.time()})
+                del records[: -self.max_records]
+            if bytes_per_row:
+                self.data["bytes_per_row"].append(float(bytes_per_row))
+                del self.data["bytes_per_row"][: -self.max_records]
+            try:
+                self._save()
+            except OSError as e:
+                # The history only feeds estimates, never fail a run over it
+                logger.warning(f"Could not save throughput history {self.path}: {e}")
+
+    def predict_seconds(self, stage: str, rows: int) -> Optional[float]:
+        """
+        Predicted seconds of a stage for rows, None if the stage was never recorded.
+
+        With runs of at least two sizes, a least-squares line seconds = overhead +
+        rows / throughput is fitted, so small runs dominated by fixed costs do not
+        inflate predictions for large ones; otherwise the median throughput is used.
+        """
+        records = self.data["stages"].get(stage)
+        if not records:
+            return None
+        sizes = np.array([r["rows"] for r in records], dtype=float)
+        seconds = np.array([r["seconds"] for r in records], dtype=float)
+        if len(np.unique(sizes)) >= 2:
+            slope, overhead = np.polyfit(sizes, seconds, 1)
+            if slope > 0:
+                return float(max(overhead, 0.0) + slope * rows)
+        return float(rows / statistics.median(sizes / seconds))
+
+    def bytes_per_row(self) -> Optional[float]:
+        values = self.data["bytes_per_row"]
+        return statistics.median(values) if values else None
+
+    def runs(self) -> int:
+        """Number of recorded analysis runs."""
+        return len(self.data["stages"].get(ANALYSIS, []))
+
+    def stages(self) -> list:
+        return [s for s in self.data["stages"] if s not in (EXTRACT, ANALYSIS)]
+
+
+def predict_run(families: int, rows: int, history: ThroughputHistory = None) -> dict:
+    """
+    Predict memory and wall time of a run from its size and the throughput history.
+
+    Args:
+        families (int): Number of families to extract.
+        rows (int): Expected df_appl_invt rows.
+        history (ThroughputHistory, optional): Defaults to the configured history file.
+
+    Returns:
+        dict: families, rows, memory_mb, extract_seconds, analysis_seconds, seconds
+        (predicted wall time), stage_seconds (per analysis stage), based_on_runs and
+        mode: "spill" when df_appl_invt would exceed Config.memory_budget_mb,
+        "cache" when the run takes longer than Config.estimate_warn_seconds (keep
+        the extract cached so a rerun is fast), otherwise "direct".
+    """
+    history = history or ThroughputHistory()
+
+    def seconds_for(stage: str) -> float:
+        seconds = history.predict_seconds(stage, rows)
+        return rows / DEFAULT_ROWS_PER_SECOND[stage] if seconds is None else seconds
+
+    memory_mb = rows * (history.bytes_per_row() or DEFAULT_BYTES_PER_ROW) / 1024**2
+    extract_seconds = seconds_for(EXTRACT)
+    analysis_seconds = seconds_for(ANALYSIS)
+    seconds = extract_seconds + analysis_seconds
+
+    if memory_mb > config.Config.memory_budget_mb:
+        mode = "spill"
+    elif seconds > config.Config.estimate_warn_seconds:
+        mode = "cache"
+    else:
+        mode = "direct"
+
+    return {
+        "families": int(families),
+        "rows": int(rows),
+        "memory_mb": round(memory_mb, 1),
+        "extract_seconds": round(extract_seconds, 1),
+        "analysis_seconds": round(analysis_seconds, 1),
+        "seconds": round(seconds, 1),
+        "stage_seconds": {
+            stage: round(history.predict_seconds(stage, rows), 1)
+            for stage in history.stages()
+        },
+        "based_on_runs": history.runs(),
+        "mode": mode,
+    }
@@ -0,0 +1,172 @@
+# Spill-to-disk storage for extracts too large to hold in memory.
+# Extraction batches are appended to one Parquet file as they complete (one row
+# group per batch), and read back as chunks that never split a family, sized to a
+# memory budget, so per-family stages can run chunk by chunk.
+import logging
+import os
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Initialize Logger
+logger = logging.getLogger(__name__)
+
+# Copies of a chunk the per-family stages hold at once (filtered/merged frames)
+CHUNK_MEMORY_FACTOR = 4
+
+# Rows read to measure the in-memory size of a row
+SAMPLE_ROWS = 10_000
+
+ARROW_TYPES = {
+    "int8": pa.int8(),
+    "int16": pa.int16(),
+    "int32": pa.int32(),
+    "int64": pa.int64(),
+    "float32": pa.float32(),
+    "float64": pa.float64(),
+    "object": pa.string(),
+    "datetime64[s]": pa.timestamp("s"),
+}
+
+
+def arrow_schema(dtypes: dict) -> pa.Schema:
+    """Arrow schema of a frame with the given column dtypes (object columns hold strings)."""
+    return pa.schema([(column, ARROW_TYPES[dtype]) for column, dtype in dtypes.items()])
+
+
+def _is_nullable_int(series: pd.Series) -> bool:
+    """Integer column with NULLs (see connect_database.fetch_columnar), written as is."""
+    return isinstance(series.dtype, pd.api.extensions.ExtensionDtype) and series.dtype.kind in "iu"
+
+
+class ParquetSpill:
+    """
+    Append DataFrames with fixed column dtypes to one Parquet file.
+
+    The file is written under a temporary name and only moved to path by close(),
+    so a crashed run never leaves a truncated file behind.
+
+    Args:
+        path (Path): Final Parquet file.
+        dtypes (dict): Column name -> dtype of every appended frame.
+    """
+
+    def __init__(self, path: Path, dtypes: dict):
+        self.path = Path(path)
+        self.dtypes = dict(dtypes)
+        self.schema = arrow_schema(dtypes)
+        self.rows = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        self._writer = pq.ParquetWriter(self._tmp_path, self.schema)
+
+    def append(self, df: pd.DataFrame) -> None:
+        if df.empty:
+            return
+        df = df.astype(
+            {
+                c: d
+                for c, d in self.dtypes.items()
+                if c in df.columns and d != "object" and not _is_nullable_int(df[c])
+            }
+        )
+        table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        self._writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self) -> Path:
+        """Finish the file and move it into place."""
+        self._writer.close()
+        os.replace(self._tmp_path, self.path)
+        logger.info(f"Spilled {self.rows} rows to {self.path}")
+        return self.path
+
+    def abort(self) -> None:
+        """Drop the partial file."""
+        self._writer.close()
+        self._tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def row_stats(path: Path) -> tuple[int, float]:
+    """
+    Row count (from the Parquet metadata) and in-memory bytes per row of a spilled
+    file, without loading it. The row size is measured on a pandas sample: Parquet
+    sizes are dictionary-encoded and far below the in-memory size.
+
+    Returns:
+        tuple: (rows, bytes per row); bytes per row is 0.0 for an empty file.
+    """
+    parquet_file = pq.ParquetFile(path)
+    rows = parquet_file.metadata.num_rows
+    sample = next(parquet_file.iter_batches(batch_size=SAMPLE_ROWS), None)
+    if sample is None or sample.num_rows == 0:
+        return rows, 0.0
+    return rows, sample.to_pandas().memory_usage(deep=True).sum() / sample.num_rows
+
+
+def chunk_rows(path: Path, memory_budget_bytes: int) -> int:
+    """
+    Rows per chunk so that one chunk, with the copies stages make of it, stays
+    within memory_budget_bytes (row size as measured by row_stats).
+    """
+    _, row_bytes = row_stats(path)
+    if row_bytes == 0:
+        return 1
+    return max(1, int(memory_budget_bytes // (row_bytes * CHUNK_MEMORY_FACTOR)))
+
+
+def iter_family_chunks(
+    path: Path,
+    memory_budget_bytes: int,
+    family_column: str = "docdb_family_id",
+) -> Iterator[pd.DataFrame]:
+    """
+    Read a spilled file back in chunks that never split a family.
+
+    The rows of a family must be contiguous in the file (ParquetSpill appends each
+    extraction batch whole, ordered by family). A family larger than one chunk is
+    yielded whole in a bigger chunk.
+
+    Args:
+        path (Path): Parquet file written by ParquetSpill.
+        memory_budget_bytes (int): Approximate memory allowed per chunk.
+        family_column (str): Column identifying the family of a row.
+
+    Yields:
+        pd.DataFrame: Consecutive chunks of whole families; an empty file yields
+        one empty frame, so consumers still see the columns.
+    """
+    if pq.ParquetFile(path).metadata.num_rows == 0:
+        yield pq.read_table(path).to_pandas()
+        return
+
+    rows_per_chunk = chunk_rows(path, memory_budget_bytes)
+    carry = None
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=rows_per_chunk):
+        df = batch.to_pandas()
+        if carry is not None:
+            df = pd.concat([carry, df], ignore_index=True)
+
+        # Hold back the last family, its rows may continue in the next batch
+        families = df[family_column].to_numpy()
+        boundaries = np.flatnonzero(families != families[-1])
+        tail_start = boundaries[-1] + 1 if len(boundaries) else 0
+        carry = df.iloc[tail_start:]
+        if tail_start > 0:
+            yield df.iloc[:tail_start]
+
+    if carry is not None and not carry.empty:
+        yield carry.reset_index(drop=True)
@@ -0,0 +1,136 @@
+# Tests of genderize_client.GenderizeResolver against a local Genderize stub server.
+# Run with: python -m pytest -q test_genderize_client.py
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import config
+from genderize_client import GenderizeResolver
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answer name[] queries like Genderize; server.statuses queues error codes to send first."""
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        with self.server.lock:
+            self.server.requests.append((time.monotonic(), params))
+            status = self.server.statuses.pop(0) if self.server.statuses else 200
+        if status != 200:
+            self.send_response(status)
+            self.end_headers()
+            return
+
+        country = params.get("country_id", [None])[0]
+        payload = [
+            {
+                "name": name,
+                "gender": "female" if name.endswith("a") else "male",
+                "probability": 0.9,
+                "country_id": country,
+            }
+            for name in params.get("name[]", [])
+        ]
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.statuses = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(config.Config, "genderize_backoff", 0.05)
+
+
+def make_resolver(server, **kwargs) -> GenderizeResolver:
+    options = {"batch_size": 10, "workers": 1, "rate_limit": 0, "timeout": 2, "max_retries": 0}
+    options.update(kwargs)
+    host, port = server.server_address
+    return GenderizeResolver(base_url=f"http://{host}:{port}/", **options)
+
+
+def test_batches_per_country(stub_server):
+    resolver = make_resolver(stub_server, batch_size=2, workers=2)
+    keys = [("anna", "NO"), ("ole", "NO"), ("kari", "NO"), ("erik", "SE")]
+
+    results = resolver.resolve(keys)
+
+    assert results == {
+        ("anna", "NO"): ("female", 0.9),
+        ("ole", "NO"): ("male", 0.9),
+        ("kari", "NO"): ("male", 0.9),
+        ("erik", "SE"): ("male", 0.9),
+    }
+    # One country_id per request, at most batch_size names each
+    sent = sorted(
+        (params["country_id"][0], sorted(params["name[]"]))
+        for _, params in stub_server.requests
+    )
+    assert sent == [("NO", ["anna", "kari"]), ("NO", ["ole"]), ("SE", ["erik"])]
+
+
+def test_retries_429_and_5xx_with_backoff(stub_server):
+    stub_server.statuses = [429, 503]
+    resolver = make_resolver(stub_server, max_retries=2)
+
+    results = resolver.resolve([("anna", "NO")])
+
+    assert results == {("anna", "NO"): ("female", 0.9)}
+    times = [t for t, _ in stub_server.requests]
+    assert len(times) == 3
+    # Exponential backoff: genderize_backoff, then twice that
+    assert times[1] - times[0] >= 0.05
+    assert times[2] - times[1] >= 0.1
+
+
+def test_failures_degrade_to_missing(stub_server):
+    stub_server.statuses = [500, 500]
+    resolver = make_resolver(stub_server, batch_size=1, max_retries=1)
+
+    results = resolver.resolve([("anna", "NO"), ("ole", "NO")])
+
+    # The batch that exhausted its retries is left out, the other one resolves
+    assert len(results) == 1
+    assert len(stub_server.requests) == 3
+
+
+def test_unreachable_server_degrades_to_missing():
+    resolver = GenderizeResolver(
+        base_url="http://127.0.0.1:9/", rate_limit=0, timeout=1, max_retries=0
+    )
+
+    assert resolver.resolve([("anna", "NO")]) == {}
+
+
+def test_rate_limit_spreads_requests(stub_server):
+    resolver = make_resolver(stub_server, batch_size=1, workers=4, rate_limit=20)
+    keys = [(name, "NO") for name in ("anna", "ole", "kari", "erik", "per")]
+
+    results = resolver.resolve(keys)
+
+    assert len(results) == 5
+    times = sorted(t for t, _ in stub_server.requests)
+    # 5 requests at 20 per second start over at least 4 intervals of 50 ms
+    assert times[-1] - times[0] >= 4 * 0.05 - 0.01